@@ -0,0 +1,163 @@
+"""Подсказки адресов по префиксу.
+
+Слова всех адресов лежат в отсортированном списке пар (слово, номер адреса):
+адреса, где есть слово с данным началом, - это непрерывный диапазон,
+границы которого находятся двоичным поиском. "тверс 15" находит
+"москва улица тверская дом 15". Ранжирование - по частоте использования.
+"""
+
+import heapq
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from geocode_cache import normalize_address
+
+# Символ больше любой буквы: верхняя граница диапазона префикса
+_MAX_CHAR = '\U0010ffff'
+# Если под префикс попадает больше слов, идем по адресам в порядке частоты
+_RANGE_SCAN_LIMIT = 256
+
+
+def normalize_query(query: str) -> List[str]:
+    """Слова ввода пользователя; недописанное последнее слово не раскрываем"""
+    words = normalize_address(query).split()
+    if not words or not query[-1:].isalnum():
+        return words
+    # "ул" могло быть началом "улан-удэ": последнее слово берем как есть
+    raw_last = query.casefold().replace('ё', 'е').split()[-1].strip('.,;:()"«»')
+    if normalize_address(raw_last) == words[-1]:
+        words[-1] = raw_last
+    return words
+
+
+class AddressSuggestIndex:
+    """Префиксный индекс адресов с ранжированием по частоте"""
+
+    def __init__(self, memo_size: int = 2048):
+        self.addresses: List[str] = []
+        self.frequencies: List[int] = []
+        # " слово слово ...": начало слова ищется как подстрока " префикс"
+        self._texts: List[str] = []
+        self._ids: Dict[str, int] = {}
+        # Отсортированные пары (слово, номер адреса)
+        self._entries: List[Tuple[str, int]] = []
+        # Номера адресов по убыванию частоты; пересчитывается лениво
+        self._ranked: List[int] = []
+        self._ranked_dirty = False
+        # Готовые ответы на популярные префиксы; сбрасываются при изменениях
+        self._memo: Dict[Tuple[Tuple[str, ...], int], List[str]] = {}
+        self.memo_size = memo_size
+        self.lookups = 0
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def _append(self, address: str, key: str, weight: int, entries: List[Tuple[str, int]]):
+        address_id = len(self.addresses)
+        self._ids[key] = address_id
+        self.addresses.append(address.strip())
+        self.frequencies.append(weight)
+        self._texts.append(' ' + key)
+        entries.extend((word, address_id) for word in set(key.split(' ')))
+
+    def add(self, address: str, weight: int = 1):
+        """Добавить адрес или увеличить его частоту"""
+        self.add_many((address,), weight)
+
+    def add_many(self, addresses: Iterable[str], weight: int = 1):
+        """Добавить пачку адресов: одна сортировка на всю пачку"""
+        self.add_weighted((address, weight) for address in addresses)
+
+    def add_weighted(self, items: Iterable[Tuple[str, int]]):
+        """Добавить пачку пар (адрес, вес)"""
+        new_entries: List[Tuple[str, int]] = []
+        for address, weight in items:
+            key = normalize_address(address)
+            if not key:
+                continue
+            address_id = self._ids.get(key)
+            if address_id is not None:
+                self.frequencies[address_id] += weight
+            else:
+                self._append(address, key, weight, new_entries)
+        if len(new_entries) <= _RANGE_SCAN_LIMIT:
+            for entry in new_entries:
+                insort(self._entries, entry)
+        else:
+            self._entries.extend(new_entries)
+            self._entries.sort()
+        self._ranked_dirty = True
+        self._memo.clear()
+
+    def _word_range(self, prefix: str) -> Tuple[int, int]:
+        start = bisect_left(self._entries, (prefix,))
+        return start, bisect_left(self._entries, (prefix + _MAX_CHAR,), start)
+
+    def _scan_ranked(self, needles: Tuple[str, ...], limit: int, budget: int) -> Optional[List[int]]:
+        if self._ranked_dirty:
+            self._ranked = sorted(range(len(self.addresses)), key=self.frequencies.__getitem__, reverse=True)
+            self._ranked_dirty = False
+        texts = self._texts
+        best = []
+        for address_id in self._ranked[:budget]:
+            text = texts[address_id]
+            for needle in needles:
+                if needle not in text:
+                    break
+            else:
+                best.append(address_id)
+                if len(best) == limit:
+                    return best
+        return best if budget >= len(self._ranked) else None
+
+    def suggest(self, query: str, limit: int = 5) -> List[str]:
+        """До limit самых частых адресов, где каждое слово запроса - начало слова адреса"""
+        self.lookups += 1
+        prefixes = tuple(normalize_query(query))
+        if not prefixes or limit <= 0:
+            return []
+        memo_key = (prefixes, limit)
+        cached = self._memo.get(memo_key)
+        if cached is not None:
+            return cached
+
+        # Слова запроса от самого избирательного: первое задает диапазон кандидатов
+        ranges = sorted(
+            ((self._word_range(prefix), ' ' + prefix) for prefix in prefixes),
+            key=lambda item: item[0][1] - item[0][0]
+        )
+        (start, end), _ = ranges[0]
+        needles = tuple(needle for _, needle in ranges)
+        best = None
+        if end - start > _RANGE_SCAN_LIMIT:
+            # Кандидатов много: обычно первые подходящие в порядке частоты
+            # находятся быстро; если нет - сдаемся и разбираем диапазон
+            best = self._scan_ranked(needles, limit, (end - start) // 4)
+        if best is None:
+            matched = list({address_id for _, address_id in self._entries[start:end]})
+            texts = self._texts
+            for needle in needles[1:]:
+                matched = [address_id for address_id in matched if needle in texts[address_id]]
+            best = heapq.nlargest(limit, matched, key=lambda address_id: (self.frequencies[address_id], -address_id))
+        result = [self.addresses[address_id] for address_id in best]
+
+        if len(self._memo) >= self.memo_size:
+            self._memo.clear()
+        self._memo[memo_key] = result
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'addresses': len(self.addresses),
+            'entries': len(self._entries),
+            'lookups': self.lookups,
+        }
+
+
+def store_address(store: dict) -> Optional[str]:
+    """Адрес магазина из ответа 5ka.ru, если он есть"""
+    for key in ('address', 'full_address', 'store_address'):
+        value = store.get(key)
+        if isinstance(value, str) and value.strip():
+            return value
+    return None
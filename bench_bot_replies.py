@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Замер стоимости обработчиков команд бота: сборка ответа на каждое обновление
+против готовых ответов BotReplies.
+
+    python bench_bot_replies.py [число обновлений]  (по умолчанию 20000)
+
+Сеть не участвует: reply_text подменен заглушкой. "После" - настоящие
+обработчики TelegramBot. У /start в обоих вариантах в замер входит переход
+в поток для записи пользователя, только сама запись в SQLite - заглушка.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
+
+from bot_users import BotUserStore
+from telegram_bot import TelegramBot
+
+WEBAPP_URL = 'https://example.org'
+
+
+async def start_before(users, update, context):
+    """/start в том виде, как он был до BotReplies"""
+    user = update.effective_user
+    try:
+        await asyncio.to_thread(users.record, update.effective_chat.id, user.first_name, user.language_code)
+    except Exception as e:
+        print(f"Error recording bot user: {e}")
+    webapp = WebAppInfo(url=WEBAPP_URL)
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🛒 Открыть магазин", web_app=webapp)]
+    ])
+
+    welcome_text = f"""
+🎉 Добро пожаловать в 5ka Mini App, {user.first_name}!
+
+🛍️ Что можно делать:
+- Найти ближайшие магазины Пятёрочка
+- Просматривать каталог товаров
+- Добавлять товары в корзину
+- Оформлять заказы
+
+Нажмите кнопку ниже, чтобы начать покупки!
+        """
+
+    await update.message.reply_text(welcome_text, reply_markup=keyboard)
+
+
+async def shop_before(update, context):
+    webapp = WebAppInfo(url=WEBAPP_URL)
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🛒 Перейти в магазин", web_app=webapp)]
+    ])
+
+    await update.message.reply_text(
+        "🛍️ Нажмите кнопку для перехода в магазин:",
+        reply_markup=keyboard
+    )
+
+
+class NullUsers(BotUserStore):
+    """Хранилище без записи: замеряем обработчик, а не диск"""
+
+    def record(self, chat_id, first_name=None, language_code=None):
+        pass
+
+
+def fake_update(i: int):
+    async def reply_text(text, reply_markup=None):
+        return None
+
+    user = SimpleNamespace(id=i, first_name=f"Пользователь{i}", language_code='ru')
+    return SimpleNamespace(
+        effective_user=user,
+        effective_chat=SimpleNamespace(id=i),
+        message=SimpleNamespace(reply_text=reply_text)
+    )
+
+
+async def timed(label: str, handler, updates):
+    started = time.perf_counter()
+    for update in updates:
+        await handler(update, None)
+    elapsed = time.perf_counter() - started
+    print(f"  {label:<40} {elapsed / len(updates) * 1e6:8.2f} мкс на обновление")
+    return elapsed
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    updates = [fake_update(i) for i in range(count)]
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = TelegramBot('123:abc', WEBAPP_URL, users=NullUsers(os.path.join(tmp, 'bench.db')))
+
+        print(f"Обновлений: {count}")
+        before = await timed('/start: сборка на каждое обновление',
+                             lambda update, context: start_before(bot.users, update, context), updates)
+        after = await timed('/start: BotReplies', bot.start_command, updates)
+        print(f"  {'ускорение':<40} {before / after:8.1f}x")
+        before = await timed('/shop: сборка на каждое обновление', shop_before, updates)
+        after = await timed('/shop: BotReplies', bot.shop_command, updates)
+        print(f"  {'ускорение':<40} {before / after:8.1f}x")
+        bot.users.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""Замер памяти и скорости каталога: список словарей против ProductCatalog.
+
+    python bench_catalog.py [число товаров]  (по умолчанию 50000)
+"""
+
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from product_catalog import ProductCatalog, np
+
+CATEGORIES = ['Молочные продукты', 'Хлеб и выпечка', 'Напитки', 'Мясо и птица', 'Фрукты и овощи', 'Сладости']
+WORDS = ['Молоко', 'Сыр', 'Творог', 'Хлеб', 'Шоколад', 'Йогурт', 'Кефир', 'Сок', 'Вода', 'Чай', 'Кофе', 'Колбаса']
+
+
+def generate(count: int):
+    """Товары в формате ответа 5ka.ru"""
+    random.seed(42)
+    for i in range(count):
+        price = round(random.uniform(30, 1500), 2)
+        promo = random.random() < 0.2
+        category = random.randrange(len(CATEGORIES))
+        yield {
+            'id': 100000 + i,
+            'name': f"{random.choice(WORDS)} Бренд{random.randrange(500)} {random.randint(50, 2000)} г",
+            'description': f"Описание товара {i}",
+            'price': price,
+            'old_price': round(price * 1.25, 2) if promo else None,
+            'category_id': category,
+            'category_name': CATEGORIES[category],
+            'image': f"https://5ka.ru/media/products/{100000 + i}.jpg",
+        }
+
+
+def measure(build):
+    """(результат, прирост памяти в байтах)"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def timed(label, func, repeat=20):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    print(f"  {label:<40} {(time.perf_counter() - started) / repeat * 1000:8.2f} мс")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    # Как сейчас: разобранный JSON-ответ
+    payload = json.dumps({'products': list(generate(count))}, ensure_ascii=False)
+
+    dicts, dicts_bytes = measure(lambda: json.loads(payload)['products'])
+    catalog, catalog_bytes = measure(lambda: ProductCatalog(json.loads(payload)['products']))
+
+    print(f"Товаров: {count}, numpy: {'да' if np is not None else 'нет'}")
+    print(f"  {'список словарей':<40} {dicts_bytes / count * 10000 / 2**20:8.2f} МБ на 10k товаров")
+    print(f"  {'ProductCatalog':<40} {catalog_bytes / count * 10000 / 2**20:8.2f} МБ на 10k товаров")
+
+    # Файл каталога через mmap: в куче воркера почти ничего, страницы общие
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'catalog.bin')
+        catalog.save(path)
+        mapped, mapped_bytes = measure(lambda: ProductCatalog.open(path))
+        print(f"  {'ProductCatalog.open (mmap)':<40} {mapped_bytes / count * 10000 / 2**20:8.2f} МБ на 10k товаров "
+              f"(файл {os.path.getsize(path) / count * 10000 / 2**20:.2f} МБ на 10k, общий для воркеров)")
+        del mapped
+
+    print("Фильтры и сортировка:")
+    timed("список словарей: категория + цена", lambda: sorted(
+        (p for p in dicts if p['category_id'] == 2 and 100 <= p['price'] <= 500), key=lambda p: p['price']
+    ))
+    timed("каталог: категория + цена", lambda: catalog.sort(
+        catalog.filter(category_id=2, min_price=100, max_price=500), 'price'
+    ))
+    timed("список словарей: акции по скидке", lambda: sorted(
+        (p for p in dicts if p['old_price']), key=lambda p: p['price'] - p['old_price']
+    ))
+    timed("каталог: акции по скидке", lambda: catalog.sort(catalog.filter(promo=True), 'discount'))
+
+
+if __name__ == "__main__":
+    main()
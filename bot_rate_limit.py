@@ -0,0 +1,250 @@
+"""Очередь исходящих запросов бота к Bot API с ограничением скорости.
+
+Telegram пускает около 30 сообщений в секунду на бота, не больше
+сообщения в секунду в один личный чат и 20 в минуту в группу; сверх этого
+отвечает 429 с retry_after. Каждая попытка отправки ждет токена сначала
+в корзине своего чата, затем в общей; 429 уводит общую корзину в минус
+на retry_after, поэтому все отправки, включая повтор, ждут паузу прямо
+в очереди за токеном.
+
+Лимит 30/с - на бота, а не на процесс. С REDIS_URL общая корзина живет в
+Redis и делится между воркерами uvicorn и рассылкой; без Redis каждый из
+TELEGRAM_SEND_PROCESSES процессов получает свою долю лимита.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from datetime import timedelta
+from typing import Any, Callable, Coroutine, Dict, Optional
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+try:
+    import redis.asyncio as aioredis
+    from redis.exceptions import WatchError
+except ImportError:  # без redis общая корзина делится между процессами поровну
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+# Сколько процессов отправляют от имени бота (воркеры uvicorn в режиме webhook)
+TELEGRAM_SEND_PROCESSES = int(os.getenv('TELEGRAM_SEND_PROCESSES') or os.getenv('WEB_CONCURRENCY') or 1)
+SEND_BUDGET_KEY = 'telegram:send_budget'
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity в запасе"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        # asyncio.Lock отдает очередь в порядке прихода
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                self._refill(time.monotonic())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    async def pause(self, seconds: float):
+        """Не выдавать токенов seconds секунд (429 с retry_after)"""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def is_idle(self) -> bool:
+        """Корзина полна и никто не ждет: ее можно выбросить и создать заново"""
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity and not self._lock.locked()
+
+
+class RedisTokenBucket:
+    """Token bucket в Redis: один лимит на всех процессах, которые отправляют от имени бота.
+
+    Состояние - хэш {tokens, updated}; списание - оптимистичная транзакция
+    WATCH/MULTI, как в RedisUserStore. Внутри процесса очередь FIFO держит asyncio.Lock.
+    """
+
+    # Сколько раз повторять списание при конкурентной записи ключа
+    MAX_RETRIES = 50
+
+    def __init__(self, client, key: str, rate: float, capacity: Optional[float] = None):
+        self.redis = client
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._lock = asyncio.Lock()
+
+    def _refilled(self, state, now: float) -> float:
+        tokens, updated = state
+        if tokens is None or updated is None:
+            return self.capacity
+        return min(self.capacity, float(tokens) + (now - float(updated)) * self.rate)
+
+    async def _update(self, change: Callable[[float], Optional[float]]) -> float:
+        """Атомарно применить change к числу токенов; None - ничего не записывать.
+
+        Возвращает число токенов после пополнения, до change.
+        """
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for _ in range(self.MAX_RETRIES):
+                try:
+                    await pipe.watch(self.key)
+                    now = time.time()
+                    tokens = self._refilled(await pipe.hmget(self.key, 'tokens', 'updated'), now)
+                    new_tokens = change(tokens)
+                    if new_tokens is None:
+                        await pipe.unwatch()
+                        return tokens
+                    pipe.multi()
+                    pipe.hset(self.key, mapping={'tokens': new_tokens, 'updated': now})
+                    # Полная корзина без ключа - то же самое, что ключ с capacity
+                    pipe.expire(self.key, max(60, int(self.capacity / self.rate) + 60))
+                    await pipe.execute()
+                    return tokens
+                except WatchError:
+                    continue
+        raise RuntimeError(f"Не удалось списать токен {self.key}: слишком много конфликтов")
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                tokens = await self._update(lambda tokens: tokens - 1 if tokens >= 1 else None)
+                if tokens >= 1:
+                    return
+                await asyncio.sleep((1 - tokens) / self.rate)
+
+    async def pause(self, seconds: float):
+        """Не выдавать токенов seconds секунд ни одному процессу"""
+        await self._update(lambda tokens: min(tokens, -seconds * self.rate))
+
+
+def send_budget_from_env(rate: float, redis_url: Optional[str] = None, client=None):
+    """Общая корзина отправок бота: в Redis, если он задан, иначе доля rate на процесс"""
+    redis_url = redis_url if redis_url is not None else os.getenv('REDIS_URL')
+    if client is not None or (redis_url and aioredis is not None):
+        if client is None:
+            client = aioredis.from_url(redis_url)
+        return RedisTokenBucket(client, SEND_BUDGET_KEY, rate)
+    if redis_url:
+        logger.warning("REDIS_URL задан, но пакет redis не установлен - лимит бота делится между процессами")
+    return TokenBucket(rate / max(1, TELEGRAM_SEND_PROCESSES))
+
+
+class SendQueueLimiter(BaseRateLimiter):
+    """BaseRateLimiter для python-telegram-bot: общая корзина, корзины чатов и retry_after"""
+
+    def __init__(self, global_rate: float = 30, private_rate: float = 1, group_rate: float = 20 / 60,
+                 max_retries: int = 3, max_chats: int = 10000, global_bucket=None):
+        # Общую корзину можно передать готовой: RedisTokenBucket или корзину рассылки
+        self.global_bucket = global_bucket if global_bucket is not None else TokenBucket(global_rate)
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._chats: "OrderedDict[Any, TokenBucket]" = OrderedDict()
+        self._paused_until = 0.0
+        self.waiting = 0
+        self.in_flight = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self._latencies = deque(maxlen=1024)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Отрицательные id - группы и каналы
+            text = str(chat_id)
+            is_group = not text.lstrip('-').isdigit() or text.startswith('-')
+            bucket = TokenBucket(self.group_rate, 3) if is_group else TokenBucket(self.private_rate, 1)
+            self._chats[chat_id] = bucket
+            if len(self._chats) > self.max_chats:
+                oldest, old_bucket = next(iter(self._chats.items()))
+                if old_bucket.is_idle():
+                    del self._chats[oldest]
+        self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def process_request(self, callback: Callable[..., Coroutine[Any, Any, Any]], args: Any,
+                              kwargs: Dict[str, Any], endpoint: str, data: Dict[str, Any],
+                              rate_limit_args: Optional[Dict[str, Any]]):
+        chat_id = data.get('chat_id')
+        if chat_id is None:
+            # Служебные вызовы (getMe, setWebhook, answerCallbackQuery) не ограничиваем
+            return await callback(*args, **kwargs)
+
+        max_retries = (rate_limit_args or {}).get('max_retries', self.max_retries)
+        enqueued = time.monotonic()
+        for attempt in range(max_retries + 1):
+            # Токены - на каждую попытку: повтор после 429 тоже отправка.
+            # Пауза после 429 сидит в общей корзине, ее ждут все в очереди
+            self.waiting += 1
+            try:
+                await self._chat_bucket(chat_id).acquire()
+                await self.global_bucket.acquire()
+            finally:
+                self.waiting -= 1
+
+            self.in_flight += 1
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == max_retries:
+                    self.failed += 1
+                    raise
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                self.retries += 1
+                # 429 - ограничение на бота целиком: притормаживаем все отправки
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                await self.global_bucket.pause(retry_after)
+                logger.warning(f"Bot API flood control on {endpoint}: retry in {retry_after}s")
+                continue
+            except Exception:
+                self.failed += 1
+                raise
+            finally:
+                self.in_flight -= 1
+            self.sent += 1
+            self._latencies.append(time.monotonic() - enqueued)
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+
+        def percentile(p: float) -> float:
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 4) if latencies else 0.0
+
+        return {
+            'queue_depth': self.waiting,
+            'in_flight': self.in_flight,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retries': self.retries,
+            'paused_for': round(max(0.0, self._paused_until - time.monotonic()), 3),
+            'chats': len(self._chats),
+            'latency_p50': percentile(0.5),
+            'latency_p95': percentile(0.95),
+            'latency_max': round(latencies[-1], 4) if latencies else 0.0,
+        }
@@ -0,0 +1,125 @@
+"""Готовые ответы бота.
+
+Тексты и клавиатуры собираются один раз при создании бота, обработчик
+только подставляет имя пользователя в заранее разрезанный шаблон.
+Тексты лежат в каталоге по языкам: встроенный русский плюс, при
+необходимости, JSON-файл BOT_REPLIES_PATH вида {"en": {"start": "..."}},
+который читается один раз при запуске. Для языка без перевода и для
+отсутствующих в переводе ключей берется язык по умолчанию.
+"""
+
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
+
+import fast_json
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_LOCALE = 'ru'
+DEFAULT_LOCALE = os.getenv('BOT_LOCALE', FALLBACK_LOCALE)
+NAME_PLACEHOLDER = '{first_name}'
+
+REPLY_CATALOG: Dict[str, Dict[str, str]] = {
+    'ru': {
+        'start': """
+🎉 Добро пожаловать в 5ka Mini App, {first_name}!
+
+🛍️ Что можно делать:
+- Найти ближайшие магазины Пятёрочка
+- Просматривать каталог товаров  
+- Добавлять товары в корзину
+- Оформлять заказы
+
+Нажмите кнопку ниже, чтобы начать покупки!
+        """,
+        'start_button': '🛒 Открыть магазин',
+        'shop': '🛍️ Нажмите кнопку для перехода в магазин:',
+        'shop_button': '🛒 Перейти в магазин',
+        'help': """
+📖 Помощь по использованию 5ka Mini App
+
+**Команды:**
+/start - Запуск бота и приветствие
+/shop - Быстрый доступ к магазину  
+/help - Эта справка
+
+**Как пользоваться:**
+1. Нажмите "Открыть магазин"
+2. Введите ваш адрес
+3. Выберите ближайший магазин
+4. Добавляйте товары в корзину
+5. Оформите заказ
+
+По вопросам пишите разработчику.
+        """,
+    },
+}
+
+
+def load_catalog(path: Optional[str] = None) -> Dict[str, Dict[str, str]]:
+    """Встроенный каталог, дополненный переводами из JSON-файла"""
+    catalog = {locale: dict(texts) for locale, texts in REPLY_CATALOG.items()}
+    path = path or os.getenv('BOT_REPLIES_PATH')
+    if not path:
+        return catalog
+    try:
+        extra = fast_json.loads(Path(path).read_bytes())
+    except Exception as e:
+        logger.error(f"Error loading bot replies from {path}: {e}")
+        return catalog
+    for locale, texts in extra.items():
+        catalog.setdefault(locale, {}).update(texts)
+    return catalog
+
+
+class LocaleReplies:
+    """Ответы на одном языке: текст /start разрезан по имени, клавиатуры готовы"""
+
+    def __init__(self, texts: Dict[str, str], webapp_url: str):
+        webapp = WebAppInfo(url=webapp_url)
+        self.start_parts = texts['start'].split(NAME_PLACEHOLDER)
+        self.start_keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton(texts['start_button'], web_app=webapp)]
+        ])
+        self.shop_text = texts['shop']
+        self.shop_keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton(texts['shop_button'], web_app=webapp)]
+        ])
+        self.help_text = texts['help']
+
+    def start_text(self, first_name: Optional[str]) -> str:
+        return (first_name or '').join(self.start_parts)
+
+
+class BotReplies:
+    """Ответы бота по языкам пользователя, собранные при запуске"""
+
+    def __init__(self, webapp_url: str, catalog: Optional[Dict[str, Dict[str, str]]] = None,
+                 default_locale: str = DEFAULT_LOCALE):
+        catalog = catalog if catalog is not None else load_catalog()
+        if default_locale not in catalog:
+            logger.error(f"No bot replies for BOT_LOCALE={default_locale}, using {FALLBACK_LOCALE}")
+            default_locale = FALLBACK_LOCALE
+        defaults = catalog[default_locale]
+        self.default = LocaleReplies(defaults, webapp_url)
+        self.locales = {default_locale: self.default}
+        for locale, texts in catalog.items():
+            if locale != default_locale:
+                self.locales[locale] = LocaleReplies({**defaults, **texts}, webapp_url)
+
+    def for_language(self, language_code: Optional[str]) -> LocaleReplies:
+        """Ответы для language_code из Telegram ("en", "pt-br"), иначе язык по умолчанию"""
+        if not language_code:
+            return self.default
+        replies = self.locales.get(language_code)
+        if replies is None:
+            replies = self.locales.get(language_code.split('-')[0].lower(), self.default)
+        return replies
+
+    def start(self, first_name: Optional[str], language_code: Optional[str] = None) -> Tuple[str, InlineKeyboardMarkup]:
+        replies = self.for_language(language_code)
+        return replies.start_text(first_name), replies.start_keyboard
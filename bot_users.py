@@ -0,0 +1,96 @@
+"""Пользователи бота в SQLite: кто приходил с /start и рассылки им.
+
+Пишет сюда обработчик /start (TelegramBot), читает - рассылка (broadcast.py).
+"""
+
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import local_db
+
+
+class BotUserStore:
+    """Пользователи бота в SQLite"""
+
+    def __init__(self, db_path: Optional[Path] = None):
+        self._connection = local_db.connect(db_path)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS bot_users ('
+                ' chat_id INTEGER PRIMARY KEY,'
+                ' first_name TEXT,'
+                ' language_code TEXT,'
+                ' started_at REAL NOT NULL,'
+                ' blocked INTEGER NOT NULL DEFAULT 0)'
+            )
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS broadcasts ('
+                ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+                ' text TEXT NOT NULL,'
+                ' button_text TEXT,'
+                ' created_at REAL NOT NULL,'
+                ' last_chat_id INTEGER NOT NULL DEFAULT 0,'
+                ' sent INTEGER NOT NULL DEFAULT 0,'
+                ' failed INTEGER NOT NULL DEFAULT 0,'
+                ' blocked INTEGER NOT NULL DEFAULT 0,'
+                ' duration REAL NOT NULL DEFAULT 0,'
+                ' finished_at REAL)'
+            )
+
+    def record(self, chat_id: int, first_name: Optional[str] = None, language_code: Optional[str] = None):
+        """Запомнить пользователя; повторный /start снимает отметку о блокировке"""
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT INTO bot_users (chat_id, first_name, language_code, started_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(chat_id) DO UPDATE SET first_name = excluded.first_name, '
+                'language_code = excluded.language_code, blocked = 0',
+                (chat_id, first_name, language_code, time.time())
+            )
+
+    def mark_blocked(self, chat_ids: List[int]):
+        with self._lock, self._connection:
+            self._connection.executemany('UPDATE bot_users SET blocked = 1 WHERE chat_id = ?',
+                                         [(chat_id,) for chat_id in chat_ids])
+
+    def recipient_batch(self, after_chat_id: int = 0, batch_size: int = 500) -> List[int]:
+        """Следующие batch_size chat_id активных пользователей после after_chat_id по возрастанию"""
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT chat_id FROM bot_users WHERE chat_id > ? AND blocked = 0 ORDER BY chat_id LIMIT ?',
+                (after_chat_id, batch_size)
+            ).fetchall()
+        return [chat_id for (chat_id,) in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM bot_users WHERE blocked = 0').fetchone()[0]
+
+    def create_broadcast(self, text: str, button_text: Optional[str]) -> int:
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                'INSERT INTO broadcasts (text, button_text, created_at) VALUES (?, ?, ?)',
+                (text, button_text, time.time())
+            )
+        return cursor.lastrowid
+
+    def broadcast(self, broadcast_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            cursor = self._connection.execute('SELECT * FROM broadcasts WHERE id = ?', (broadcast_id,))
+            row = cursor.fetchone()
+            columns = [column[0] for column in cursor.description]
+        return dict(zip(columns, row)) if row is not None else None
+
+    def save_progress(self, broadcast_id: int, last_chat_id: int, sent: int, failed: int, blocked: int,
+                      duration: float, finished: bool = False):
+        with self._lock, self._connection:
+            self._connection.execute(
+                'UPDATE broadcasts SET last_chat_id = ?, sent = ?, failed = ?, blocked = ?, duration = ?, '
+                'finished_at = ? WHERE id = ?',
+                (last_chat_id, sent, failed, blocked, duration, time.time() if finished else None, broadcast_id)
+            )
+
+    def close(self):
+        self._connection.close()
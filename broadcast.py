@@ -0,0 +1,203 @@
+"""Рассылка сообщения с кнопкой Mini App всем пользователям бота.
+
+Получатели - пользователи, приходившие в бота с /start (таблица bot_users).
+Они читаются из SQLite пачками по возрастанию chat_id, без загрузки всей
+базы в память, и раздаются пулу воркеров. Отправки идут через лимитер бота,
+общая корзина которого с REDIS_URL одна на рассылку и все воркеры API;
+своя корзина рассылки берет из нее не больше BROADCAST_RATE, чтобы ответам
+на команды оставался запас. Прогресс сохраняется в broadcasts: после
+падения запуск с тем же id продолжает с последнего chat_id, до которого
+все уже отправлено.
+Сообщения, отправленные после этой отметки, но до падения, уйдут повторно.
+
+Запуск: python broadcast.py "Текст" [--button "Открыть магазин"] [--resume ID]
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import time
+from collections import deque
+from typing import Any, Dict, List
+
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
+from telegram.error import Forbidden, TelegramError
+
+from bot_rate_limit import TokenBucket
+from bot_users import BotUserStore
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """Последний chat_id, до которого включительно все отправлено, и счетчики до него.
+
+    Воркеры заканчивают не по порядку: отметка двигается только по
+    непрерывному префиксу выданных chat_id. Итоги отправок за отметкой
+    в счетчики не попадают - после падения эти чаты обработаются заново.
+    """
+
+    def __init__(self, last_chat_id: int, counters: Dict[str, int]):
+        self.last_chat_id = last_chat_id
+        self.counters = dict(counters)
+        self._issued = deque()
+        self._done: Dict[int, str] = {}
+
+    def issue(self, chat_id: int):
+        self._issued.append(chat_id)
+
+    def done(self, chat_id: int, outcome: str):
+        self._done[chat_id] = outcome
+        while self._issued and self._issued[0] in self._done:
+            self.last_chat_id = self._issued.popleft()
+            self.counters[self._done.pop(self.last_chat_id)] += 1
+
+
+class Broadcaster:
+    """Пул воркеров, отправляющих одно сообщение всем получателям"""
+
+    def __init__(self, bot: Bot, users: BotUserStore, webapp_url: str, workers: int = 16,
+                 rate: float = 25, checkpoint_every: int = 200, batch_size: int = 500):
+        # bot - с лимитером бота (SendQueueLimiter): он держит общий лимит и паузы после 429
+        self.bot = bot
+        self.users = users
+        self.webapp_url = webapp_url
+        self.workers = workers
+        self.rate = rate
+        self.checkpoint_every = checkpoint_every
+        self.batch_size = batch_size
+
+    async def run(self, broadcast_id: int) -> Dict[str, Any]:
+        """Отправить (или продолжить) рассылку; возвращает отчет"""
+        state = await asyncio.to_thread(self.users.broadcast, broadcast_id)
+        if state is None:
+            raise ValueError(f"Рассылка {broadcast_id} не найдена")
+        keyboard = None
+        if state['button_text']:
+            keyboard = InlineKeyboardMarkup([
+                [InlineKeyboardButton(state['button_text'], web_app=WebAppInfo(url=self.webapp_url))]
+            ])
+
+        checkpoint = Checkpoint(state['last_chat_id'],
+                                {'sent': state['sent'], 'failed': state['failed'], 'blocked': state['blocked']})
+        bucket = TokenBucket(self.rate)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 4)
+        blocked: List[int] = []
+        started = time.monotonic()
+        previous_duration = state['duration']
+        completed = 0
+
+        async def save(finished: bool = False):
+            # Забираем накопленное до первого await: пока пишем, воркеры продолжают
+            # отправлять и дописывают blocked. Отметка берется в тот же момент,
+            # поэтому все заблокированные до нее попадают в pending
+            pending = blocked[:]
+            blocked.clear()
+            last_chat_id = checkpoint.last_chat_id
+            counters = dict(checkpoint.counters)
+            if pending:
+                await asyncio.to_thread(self.users.mark_blocked, pending)
+            await asyncio.to_thread(
+                self.users.save_progress, broadcast_id, last_chat_id,
+                counters['sent'], counters['failed'], counters['blocked'],
+                previous_duration + time.monotonic() - started, finished
+            )
+
+        async def worker():
+            nonlocal completed
+            while True:
+                chat_id = await queue.get()
+                if chat_id is None:
+                    return
+                await bucket.acquire()
+                outcome = 'sent'
+                try:
+                    await self.bot.send_message(chat_id, state['text'], reply_markup=keyboard)
+                except Forbidden:
+                    # Пользователь заблокировал бота: больше ему не пишем
+                    outcome = 'blocked'
+                    blocked.append(chat_id)
+                except TelegramError as e:
+                    outcome = 'failed'
+                    logger.warning(f"Broadcast {broadcast_id}: failed to send to {chat_id}: {e}")
+                checkpoint.done(chat_id, outcome)
+                completed += 1
+                if completed % self.checkpoint_every == 0:
+                    await save()
+                    elapsed = time.monotonic() - started
+                    logger.info(f"Broadcast {broadcast_id}: {completed} done, {completed / elapsed:.1f} msg/s")
+
+        tasks = [asyncio.create_task(worker()) for _ in range(self.workers)]
+        try:
+            after_chat_id = checkpoint.last_chat_id
+            while True:
+                # Пачку целиком читаем из SQLite в потоке: один переход на batch_size получателей
+                batch = await asyncio.to_thread(self.users.recipient_batch, after_chat_id, self.batch_size)
+                if not batch:
+                    break
+                for chat_id in batch:
+                    checkpoint.issue(chat_id)
+                    await queue.put(chat_id)
+                after_chat_id = batch[-1]
+            for _ in tasks:
+                await queue.put(None)
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await save(finished=all(task.done() and not task.cancelled() for task in tasks))
+
+        elapsed = time.monotonic() - started
+        counters = checkpoint.counters
+        total = sum(counters.values())
+        report = {
+            'broadcast_id': broadcast_id,
+            **counters,
+            'processed': completed,
+            'duration': round(elapsed, 3),
+            'throughput': round(completed / elapsed, 2) if elapsed else 0.0,
+            'failure_rate': round((counters['failed'] + counters['blocked']) / total, 4) if total else 0.0,
+        }
+        logger.info(f"Broadcast {broadcast_id} finished: {report}")
+        return report
+
+
+async def main(argv: List[str]):
+    import argparse
+    from telegram_bot import TelegramBot
+
+    parser = argparse.ArgumentParser(description='Рассылка пользователям бота')
+    parser.add_argument('text', nargs='?', help='Текст сообщения')
+    parser.add_argument('--button', default='🛒 Открыть магазин', help='Текст кнопки Mini App ("" - без кнопки)')
+    parser.add_argument('--resume', type=int, help='Продолжить рассылку с этим id')
+    args = parser.parse_args(argv)
+    if args.resume is None and not args.text:
+        parser.error('нужен текст сообщения или --resume')
+
+    token = os.getenv('TELEGRAM_BOT_TOKEN')
+    if not token:
+        raise SystemExit('TELEGRAM_BOT_TOKEN не установлен')
+    webapp_url = os.getenv('WEBAPP_URL', 'http://localhost:8000')
+    bot = TelegramBot(token, webapp_url, api_url=os.getenv('TELEGRAM_API_URL'))
+    if isinstance(bot.rate_limiter.global_bucket, TokenBucket):
+        logger.warning("REDIS_URL не задан: рассылка не делит лимит с воркерами API, "
+                       "учтите ее процесс в TELEGRAM_SEND_PROCESSES")
+    users = bot.users
+    broadcast_id = args.resume or users.create_broadcast(args.text, args.button or None)
+    logger.info(f"Broadcast {broadcast_id}: {users.count()} recipients")
+
+    broadcaster = Broadcaster(
+        bot.application.bot, users, webapp_url,
+        workers=int(os.getenv('BROADCAST_WORKERS', 16)),
+        rate=float(os.getenv('BROADCAST_RATE', 25))
+    )
+    async with bot.application.bot:
+        report = await broadcaster.run(broadcast_id)
+    users.close()
+    print(report)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(sys.argv[1:]))
@@ -0,0 +1,234 @@
+"""Операции над корзиной.
+
+Корзина хранится как JSON-документ:
+    {'items': {product_id: {...}}, 'total_price': '123.40'}
+Позиции лежат в упорядоченном словаре по product_id, поэтому любое
+изменение строки - O(1), а итог пересчитывается инкрементально в Decimal.
+Цены в документе - строки, чтобы не терять копейки при сериализации.
+"""
+
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, Iterable, List, Optional
+
+ZERO = Decimal('0')
+CENTS = Decimal('0.01')
+
+OP_ADD = 'add'
+OP_SET = 'set'
+OP_REMOVE = 'remove'
+OPERATIONS = (OP_ADD, OP_SET, OP_REMOVE)
+
+# Больше этого количества одного товара в корзине быть не может
+MAX_QUANTITY = 999
+
+
+class CartError(ValueError):
+    """Некорректная операция с корзиной"""
+
+
+def new_cart() -> Dict[str, Any]:
+    """Пустая корзина"""
+    return {'items': {}, 'total_price': '0'}
+
+
+def to_decimal(value: Any) -> Decimal:
+    """Цена в Decimal без артефактов float"""
+    try:
+        price = Decimal(str(value))
+    except (InvalidOperation, TypeError, ValueError):
+        raise CartError(f"Некорректная цена: {value!r}")
+    if not price.is_finite() or price < 0:
+        raise CartError(f"Некорректная цена: {value!r}")
+    return price
+
+
+def _to_quantity(value: Any, minimum: int = 0) -> int:
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise CartError(f"Некорректное количество: {value!r}")
+    try:
+        quantity = int(value)
+    except ValueError:
+        raise CartError(f"Некорректное количество: {value!r}")
+    if quantity < minimum:
+        raise CartError(f"Некорректное количество: {value!r}")
+    if quantity > MAX_QUANTITY:
+        raise CartError(f"Количество больше {MAX_QUANTITY}: {value!r}")
+    return quantity
+
+
+def _upgrade(cart: Dict[str, Any]) -> Dict[str, Any]:
+    """Перевести корзину старого формата (список позиций) в словарь"""
+    if isinstance(cart['items'], list):
+        items = {}
+        for item in cart['items']:
+            items[str(item['product_id'])] = {**item, 'price': str(to_decimal(item['price']))}
+        cart['items'] = items
+        cart['total_price'] = str(sum(
+            (Decimal(item['price']) * item['quantity'] for item in items.values()), ZERO
+        ))
+    return cart
+
+
+def _change_total(cart: Dict[str, Any], delta: Decimal):
+    cart['total_price'] = str(Decimal(cart['total_price']) + delta)
+
+
+def add_item(cart: Dict[str, Any], product_id: str, name: Optional[str], price: Any, quantity: int = 1):
+    """Добавить товар или увеличить его количество"""
+    _upgrade(cart)
+    product_id = str(product_id)
+    item = cart['items'].get(product_id)
+    if item is None:
+        unit_price = to_decimal(price)
+        cart['items'][product_id] = {
+            'product_id': product_id,
+            'name': name,
+            'price': str(unit_price),
+            'quantity': quantity
+        }
+    else:
+        unit_price = Decimal(item['price'])
+        item['quantity'] += quantity
+    _change_total(cart, unit_price * quantity)
+
+
+def set_quantity(cart: Dict[str, Any], product_id: str, quantity: int,
+                 name: Optional[str] = None, price: Any = None):
+    """Выставить количество товара; 0 - удалить позицию"""
+    _upgrade(cart)
+    product_id = str(product_id)
+    item = cart['items'].get(product_id)
+    if item is None:
+        if quantity == 0:
+            return
+        if price is None:
+            raise CartError(f"Товара {product_id} нет в корзине")
+        add_item(cart, product_id, name, price, quantity)
+        return
+    if quantity == 0:
+        remove_item(cart, product_id)
+        return
+    _change_total(cart, Decimal(item['price']) * (quantity - item['quantity']))
+    item['quantity'] = quantity
+
+
+def remove_item(cart: Dict[str, Any], product_id: str):
+    """Удалить позицию из корзины"""
+    _upgrade(cart)
+    item = cart['items'].pop(str(product_id), None)
+    if item is not None:
+        _change_total(cart, -Decimal(item['price']) * item['quantity'])
+
+
+def parse_operations(cart: Dict[str, Any], operations: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Проверить пакет операций целиком до применения.
+
+    После успешной проверки apply_operations уже не может упасть на середине,
+    поэтому пакет применяется либо целиком, либо никак.
+    """
+    _upgrade(cart)
+    parsed = []
+    # Количество товара в корзине с учетом уже проверенных операций пакета
+    quantities = {}
+    for operation in operations:
+        if not isinstance(operation, dict):
+            raise CartError(f"Некорректная операция: {operation!r}")
+        op = operation.get('op')
+        if op not in OPERATIONS:
+            raise CartError(f"Неизвестная операция: {op!r}")
+        product_id = operation.get('product_id')
+        if product_id in (None, ''):
+            raise CartError("Не указан product_id")
+        product_id = str(product_id)
+
+        item = {'op': op, 'product_id': product_id}
+        if op == OP_REMOVE:
+            quantities[product_id] = 0
+        else:
+            # 0 означает удаление только для set; add добавляет хотя бы одну штуку
+            if op == OP_ADD:
+                item['quantity'] = _to_quantity(operation.get('quantity', 1), minimum=1)
+            else:
+                item['quantity'] = _to_quantity(operation.get('quantity'))
+            price = operation.get('price')
+            item['price'] = to_decimal(price) if price is not None else None
+            item['name'] = operation.get('name')
+            current = quantities.get(product_id)
+            if current is None:
+                current = cart['items'][product_id]['quantity'] if product_id in cart['items'] else 0
+            if item['quantity'] > 0 and not current and item['price'] is None:
+                raise CartError(f"Для товара {product_id} не указана цена")
+            quantity = current + item['quantity'] if op == OP_ADD else item['quantity']
+            if quantity > MAX_QUANTITY:
+                raise CartError(f"Количество товара {product_id} больше {MAX_QUANTITY}")
+            quantities[product_id] = quantity
+        parsed.append(item)
+    return parsed
+
+
+def apply_operations(cart: Dict[str, Any], operations: List[Dict[str, Any]], priced_at: Optional[float] = None):
+    """Применить проверенные parse_operations операции.
+
+    priced_at - время цен, с которыми пришли позиции: новая корзина
+    получает его сразу и не пересчитывается при первом же чтении.
+    """
+    was_empty = not cart['items']
+    for operation in operations:
+        op = operation['op']
+        if op == OP_ADD:
+            add_item(cart, operation['product_id'], operation['name'], operation['price'], operation['quantity'])
+        elif op == OP_SET:
+            set_quantity(cart, operation['product_id'], operation['quantity'],
+                         operation['name'], operation['price'])
+        else:
+            remove_item(cart, operation['product_id'])
+    if priced_at is not None and was_empty and cart['items']:
+        cart['priced_at'] = priced_at
+
+
+def reprice(cart: Dict[str, Any], offers: Dict[str, Dict[str, Any]], priced_at: float) -> int:
+    """Обновить цены и наличие позиций по предложениям магазина; возвращает число измененных цен.
+
+    offers: {product_id: {'price': ..., 'available': bool}}; позиции без
+    предложения не трогаем. Итог пересчитывается заново.
+    """
+    _upgrade(cart)
+    changed = 0
+    for product_id, item in cart['items'].items():
+        offer = offers.get(product_id)
+        if offer is None:
+            continue
+        item['available'] = bool(offer.get('available', True))
+        if offer.get('price') is None:
+            continue
+        price = str(to_decimal(offer['price']))
+        if price != item['price']:
+            item['price'] = price
+            changed += 1
+    cart['total_price'] = str(sum(
+        (Decimal(item['price']) * item['quantity'] for item in cart['items'].values()), ZERO
+    ))
+    cart['priced_at'] = priced_at
+    return changed
+
+
+def cart_count(cart: Dict[str, Any]) -> int:
+    """Количество позиций в корзине"""
+    return len(_upgrade(cart)['items'])
+
+
+def cart_total(cart: Dict[str, Any]) -> float:
+    """Итог корзины для ответа API"""
+    return float(Decimal(_upgrade(cart)['total_price']).quantize(CENTS))
+
+
+def cart_response(cart: Dict[str, Any]) -> Dict[str, Any]:
+    """Корзина в формате, который ждет фронтенд: список позиций и числовые цены"""
+    _upgrade(cart)
+    return {
+        'items': [
+            {**item, 'price': float(Decimal(item['price']))}
+            for item in cart['items'].values()
+        ],
+        'total_price': cart_total(cart)
+    }
@@ -0,0 +1,327 @@
+"""Фоновый обход каталога 5ka.ru.
+
+Обходит категории и страницы товаров по каждому магазину с ограниченной
+конкурентностью, сравнивает результат с прошлым обходом по хэшам товаров
+и пишет в SQLite только изменившиеся товары. После обхода с изменениями
+выгружает снимок каталога каждого магазина отдельно: цены и наличие у
+магазинов свои. Снимок первого магазина из списка - основной, из него
+строится локальный поиск.
+
+Запуск отдельным процессом: python catalog_crawler.py [--once]
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+import local_db
+from product_catalog import ProductCatalog
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'application/json, text/plain, */*',
+    'Accept-Language': 'ru-RU,ru;q=0.9,en;q=0.8',
+}
+
+# Магазин "по умолчанию", когда список магазинов не задан
+GLOBAL_STORE = ''
+
+
+def extract_items(data: Any, keys: Tuple[str, ...]) -> List[Dict[str, Any]]:
+    """Список объектов из ответа API (список или объект-обертка)"""
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict):
+        for key in keys:
+            if isinstance(data.get(key), list):
+                return data[key]
+    return []
+
+
+def product_digest(product: Dict[str, Any]) -> str:
+    """Хэш содержимого товара для сравнения с прошлым обходом"""
+    encoded = json.dumps(product, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.blake2b(encoded.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class CatalogCrawler:
+    """Обход каталога с инкрементальной записью в SQLite"""
+
+    def __init__(self, api_base: str = 'https://5ka.ru/api', stores: Optional[List[str]] = None,
+                 db_path: Optional[Path] = None, snapshot_path: Optional[Path] = None,
+                 concurrency: int = 8, page_size: int = 100, max_pages: int = 100,
+                 client: Optional[httpx.AsyncClient] = None):
+        self.api_base = api_base.rstrip('/')
+        self.stores = stores or [GLOBAL_STORE]
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else None
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.client = client
+        self._own_client = client is None
+        self._connection = local_db.connect(db_path)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS catalog_products ('
+                ' store_id TEXT NOT NULL,'
+                ' product_id TEXT NOT NULL,'
+                ' data TEXT NOT NULL,'
+                ' digest TEXT NOT NULL,'
+                ' updated_at REAL NOT NULL,'
+                ' PRIMARY KEY (store_id, product_id))'
+            )
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS catalog_crawls ('
+                ' started_at REAL NOT NULL,'
+                ' duration REAL NOT NULL,'
+                ' requests INTEGER NOT NULL,'
+                ' errors INTEGER NOT NULL,'
+                ' products INTEGER NOT NULL,'
+                ' changed INTEGER NOT NULL,'
+                ' removed INTEGER NOT NULL)'
+            )
+        self.last_stats: Dict[str, Any] = {}
+        self.crawls = 0
+
+    async def _get(self, semaphore: asyncio.Semaphore, counters: Dict[str, int],
+                   path: str, params: Dict[str, Any]) -> Any:
+        async with semaphore:
+            counters['requests'] += 1
+            response = await self.client.get(f"{self.api_base}/{path}", params=params)
+        response.raise_for_status()
+        return response.json()
+
+    async def _crawl_category(self, semaphore, counters, store_id: str,
+                              category: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], bool]:
+        """Все страницы одной категории: (товары, обойдена ли категория целиком)"""
+        products = []
+        for page in range(1, self.max_pages + 1):
+            params = {'category_id': category['id'], 'page': page, 'limit': self.page_size}
+            if store_id:
+                params['store_id'] = store_id
+            items = extract_items(
+                await self._get(semaphore, counters, 'products', params), ('products', 'results', 'items')
+            )
+            for item in items:
+                item.setdefault('category_id', category['id'])
+                if category.get('name'):
+                    item.setdefault('category_name', category['name'])
+            products.extend(items)
+            if len(items) < self.page_size:
+                return products, True
+        # Уперлись в max_pages: дальше могли быть еще товары
+        logger.warning(f"Catalog crawl: category {category['id']} truncated at {self.max_pages} pages "
+                       f"for store {store_id or '-'}")
+        return products, False
+
+    async def _crawl_store(self, semaphore, counters,
+                           store_id: str) -> Tuple[Dict[str, Dict[str, Any]], bool]:
+        """({product_id: товар}, полный ли обход) магазина"""
+        params = {'store_id': store_id} if store_id else {}
+        try:
+            categories = extract_items(
+                await self._get(semaphore, counters, 'categories', params), ('categories', 'results', 'items')
+            )
+        except (httpx.HTTPError, ValueError) as e:
+            counters['errors'] += 1
+            logger.error(f"Catalog crawl: categories failed for store {store_id or '-'}: {e}")
+            return {}, False
+
+        categories = [category for category in categories if isinstance(category, dict) and 'id' in category]
+        results = await asyncio.gather(
+            *(self._crawl_category(semaphore, counters, store_id, category) for category in categories),
+            return_exceptions=True
+        )
+        products: Dict[str, Dict[str, Any]] = {}
+        complete = True
+        for category, result in zip(categories, results):
+            if isinstance(result, BaseException):
+                counters['errors'] += 1
+                complete = False
+                logger.error(f"Catalog crawl: category {category['id']} failed for store {store_id or '-'}: {result}")
+                continue
+            items, category_complete = result
+            complete = complete and category_complete
+            for product in items:
+                if product.get('id') is not None:
+                    products[str(product['id'])] = product
+        return products, complete
+
+    def _apply(self, store_id: str, products: Dict[str, Dict[str, Any]], complete: bool) -> Tuple[int, int]:
+        """Записать изменившиеся товары и удалить пропавшие: (changed, removed).
+
+        Без полного обхода пропавшие товары удалять нельзя.
+        """
+        with self._lock:
+            previous = dict(self._connection.execute(
+                'SELECT product_id, digest FROM catalog_products WHERE store_id = ?', (store_id,)
+            ).fetchall())
+
+        now = time.time()
+        changed_rows = []
+        for product_id, product in products.items():
+            digest = product_digest(product)
+            if previous.get(product_id) != digest:
+                changed_rows.append((store_id, product_id, json.dumps(product, ensure_ascii=False), digest, now))
+        removed = [(store_id, product_id) for product_id in previous.keys() - products.keys()] if complete else []
+
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO catalog_products (store_id, product_id, data, digest, updated_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                changed_rows
+            )
+            self._connection.executemany(
+                'DELETE FROM catalog_products WHERE store_id = ? AND product_id = ?', removed
+            )
+        return len(changed_rows), len(removed)
+
+    def products(self, store_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Товары из локального каталога (все магазины или один)"""
+        with self._lock:
+            if store_id is None:
+                rows = self._connection.execute('SELECT store_id, data FROM catalog_products').fetchall()
+            else:
+                rows = self._connection.execute(
+                    'SELECT store_id, data FROM catalog_products WHERE store_id = ?', (store_id,)
+                ).fetchall()
+        products = []
+        for row_store_id, data in rows:
+            product = json.loads(data)
+            if row_store_id:
+                product.setdefault('store_id', row_store_id)
+            products.append(product)
+        return products
+
+    def snapshot_path_for(self, store_id: str) -> Optional[Path]:
+        """Файл-снимок магазина: data/catalog.bin для первого, data/catalog.<store_id>.bin для остальных"""
+        if self.snapshot_path is None:
+            return None
+        if store_id == self.stores[0]:
+            return self.snapshot_path
+        return self.snapshot_path.with_name(f"{self.snapshot_path.stem}.{store_id}{self.snapshot_path.suffix}")
+
+    def export_snapshot(self, store_id: str):
+        """Выгрузить каталог магазина в файл-снимок атомарно: во временный файл и rename"""
+        path = self.snapshot_path_for(store_id)
+        if path is None:
+            return
+        products = self.products(store_id)
+        if path.suffix != '.json':
+            # Бинарный колоночный каталог для чтения через mmap
+            ProductCatalog(products).save(path)
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'products': products}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    async def crawl(self) -> Dict[str, Any]:
+        """Один полный обход всех магазинов"""
+        started_at = time.time()
+        counters = {'requests': 0, 'errors': 0}
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                headers=DEFAULT_HEADERS,
+                timeout=httpx.Timeout(10.0, connect=5.0),
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+                follow_redirects=True
+            )
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        total_products = changed = removed = 0
+        for store_id in self.stores:
+            products, complete = await self._crawl_store(semaphore, counters, store_id)
+            if not products and not complete:
+                continue
+            total_products += len(products)
+            store_changed, store_removed = await asyncio.to_thread(self._apply, store_id, products, complete)
+            changed += store_changed
+            removed += store_removed
+            if store_changed or store_removed:
+                await asyncio.to_thread(self.export_snapshot, store_id)
+
+        duration = time.time() - started_at
+        self.last_stats = {
+            'started_at': started_at,
+            'duration': round(duration, 3),
+            'requests': counters['requests'],
+            'errors': counters['errors'],
+            'products': total_products,
+            'changed': changed,
+            'removed': removed,
+            'change_rate': round((changed + removed) / total_products, 4) if total_products else 0.0,
+        }
+        self.crawls += 1
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT INTO catalog_crawls (started_at, duration, requests, errors, products, changed, removed) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (started_at, duration, counters['requests'], counters['errors'], total_products, changed, removed)
+            )
+        logger.info(
+            f"Catalog crawl finished in {duration:.1f}s: {counters['requests']} requests, "
+            f"{counters['errors']} errors, {total_products} products, {changed} changed, {removed} removed"
+        )
+        return self.last_stats
+
+    async def run(self, interval: float):
+        """Обходить каталог каждые interval секунд"""
+        while True:
+            try:
+                await self.crawl()
+            except Exception as e:
+                logger.error(f"Catalog crawl failed: {e}")
+            await asyncio.sleep(interval)
+
+    async def close(self):
+        if self._own_client and self.client is not None:
+            await self.client.aclose()
+            self.client = None
+        self._connection.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {'crawls': self.crawls, 'last': self.last_stats}
+
+
+def crawler_from_env(client: Optional[httpx.AsyncClient] = None) -> CatalogCrawler:
+    """Обходчик с настройками из переменных окружения"""
+    stores = [store.strip() for store in os.getenv('CRAWLER_STORES', '').split(',') if store.strip()]
+    return CatalogCrawler(
+        api_base=os.getenv('FIVEKA_API_URL', 'https://5ka.ru/api'),
+        stores=stores,
+        snapshot_path=Path(os.getenv('PRODUCTS_SNAPSHOT', 'data/catalog.bin')),
+        concurrency=int(os.getenv('CRAWLER_CONCURRENCY', 8)),
+        page_size=int(os.getenv('CRAWLER_PAGE_SIZE', 100)),
+        max_pages=int(os.getenv('CRAWLER_MAX_PAGES', 100)),
+        client=client
+    )
+
+
+async def main(once: bool = False):
+    crawler = crawler_from_env()
+    try:
+        if once:
+            await crawler.crawl()
+        else:
+            await crawler.run(float(os.getenv('CRAWLER_INTERVAL', 3600)))
+    finally:
+        await crawler.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(once='--once' in sys.argv))
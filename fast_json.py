@@ -0,0 +1,47 @@
+"""Быстрая сериализация JSON: orjson, если установлен, иначе стандартный json"""
+
+import json
+from decimal import Decimal
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен
+    orjson = None
+
+
+def _default(value: Any):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def dumps(value: Any) -> bytes:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+    loads = orjson.loads
+else:
+    def dumps(value: Any) -> bytes:
+        return json.dumps(
+            value, default=_default, ensure_ascii=False, separators=(',', ':')
+        ).encode('utf-8')
+
+    def loads(data) -> Any:
+        return json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse, сериализующий через orjson"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class RawJSONResponse(Response):
+    """Готовые JSON-байты (например, ответ 5ka.ru) без разбора и повторной сериализации"""
+
+    media_type = 'application/json'
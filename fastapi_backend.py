@@ -1,22 +1,97 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import RedirectResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import httpx
 import json
 import asyncio
+import hmac
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from datetime import datetime
 import logging
 from urllib.parse import urljoin, quote
+import os
 import re
+import time
+
+from fiveka_cache import LRUCache, TieredCache, SingleFlight, UpstreamPayload, make_cache_key, MISS
+from fast_json import FastJSONResponse, RawJSONResponse
+from http_compression import CompressionMiddleware
+from fiveka_resilience import AdaptiveLimiter, CircuitBreaker, UpstreamUnavailable
+from user_storage import create_user_stores
+from store_index import StoreDirectory, extract_stores, parse_areas
+from geocode_cache import GeocodeCache
+from address_suggest import AddressSuggestIndex, store_address
+from product_search import CatalogSearch
+from product_catalog import SORT_KEYS, ProductCatalog, product_available, product_prices
+from catalog_crawler import crawler_from_env
+from telegram_webhook import webhook_from_env
+from telegram_auth import AuthError, auth_from_env
+from product_pages import (
+    CursorError, append_field, chunk_pages, decode_cursor, encode_cursor, page_items, query_fingerprint
+)
+from webapp_shell import FRONTEND_DIR, IMMUTABLE_CACHE_CONTROL, STATIC_DIR, ImmutableStaticFiles, ShellPage, etag_matches
+from image_proxy import (
+    FORMATS, PILLOW_AVAILABLE, ImageCache, ImageProxy, choose_format, image_links_from_env, image_version,
+    product_image_url, snap_width
+)
+from cart_model import (
+    CartError, apply_operations, cart_count, cart_response, cart_total, parse_operations, remove_item, reprice
+)
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="5ka Proxy API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Создание и закрытие общих ресурсов вместе с приложением"""
+    await fiveka_api.start()
+    await asyncio.to_thread(store_directory.load)
+    if GEOCODE_WARM_FILE and os.path.exists(GEOCODE_WARM_FILE):
+        await asyncio.to_thread(geocode_cache.warm_from_file, GEOCODE_WARM_FILE)
+    global address_index
+    address_index = await asyncio.to_thread(build_address_index)
+    address_refresh_task = asyncio.create_task(run_address_index_refresh(ADDRESS_SUGGEST_REFRESH_INTERVAL))
+    store_refresh_task = asyncio.create_task(store_directory.run_refresh(
+        STORES_REFRESH_INTERVAL, fetch=fiveka_api.fetch_stores,
+        areas=STORES_REFRESH_AREAS, refresh_age=STORES_REFRESH_AGE
+    ))
+    await asyncio.to_thread(product_search.load)
+    search_refresh_task = asyncio.create_task(product_search.run_refresh(PRODUCTS_REFRESH_INTERVAL))
+    global catalog_crawler
+    crawler_task = None
+    if CATALOG_CRAWLER == 'lifespan':
+        # Обход в процессе API: запускать только с одним воркером
+        catalog_crawler = crawler_from_env(client=await fiveka_api.get_client())
+        crawler_task = asyncio.create_task(catalog_crawler.run(CRAWLER_INTERVAL))
+    if bot_webhook is not None:
+        await bot_webhook.start()
+    yield
+    if bot_webhook is not None:
+        await bot_webhook.stop()
+    store_refresh_task.cancel()
+    address_refresh_task.cancel()
+    search_refresh_task.cancel()
+    if crawler_task is not None:
+        crawler_task.cancel()
+        await catalog_crawler.close()
+    await fiveka_api.close()
+    await cart_store.close()
+    await session_store.close()
+    geocode_cache.close()
+
+app = FastAPI(
+    title="5ka Proxy API",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
+)
+
+# Сжатие ответов API (brotli/gzip), мелкие ответы не трогаем
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv('COMPRESS_MIN_SIZE', 1024)))
 
 # CORS middleware для работы с Telegram Mini App
 app.add_middleware(
@@ -27,6 +102,35 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Telegram-бот в режиме webhook: обновления принимает это же приложение
+bot_webhook = webhook_from_env()
+if bot_webhook is not None:
+    bot_webhook.mount(app)
+
+# Пользователь Mini App: initData проверяется при входе, дальше - токен сессии
+session_auth = auth_from_env()
+
+def request_user(http_request: Request, body: Optional[Dict[str, Any]] = None) -> str:
+    """Проверенный user_id из токена сессии (Authorization: Bearer ...).
+    
+    Без токена бота проверять нечем - тогда, как раньше, user_id из тела запроса.
+    """
+    if session_auth is None:
+        return str((body or {}).get('user_id') or 'demo_user')
+    scheme, _, token = http_request.headers.get('authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        raise HTTPException(status_code=401, detail='Нужна авторизация')
+    try:
+        return session_auth.authenticate(token)
+    except AuthError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+
+def path_user(http_request: Request, user_id: str) -> str:
+    """user_id из пути, если он совпадает с проверенным пользователем"""
+    if session_auth is not None and request_user(http_request) != user_id:
+        raise HTTPException(status_code=403, detail='Чужая корзина')
+    return user_id
+
 # Модели данных
 class AddressRequest(BaseModel):
     address: str
@@ -51,17 +155,149 @@ class Cart(BaseModel):
     address: str
     comment: Optional[str] = None
 
-# Хранилище данных (в продакшене использовать Redis или базу данных)
-user_sessions = {}
-user_carts = {}
+# Хранилище корзин и сессий: Redis при заданном REDIS_URL, общий для всех воркеров
+cart_store, session_store = create_user_stores(
+    redis_url=os.getenv('REDIS_URL'),
+    cart_ttl=int(os.getenv('CART_TTL', 7 * 24 * 3600)),
+    session_ttl=int(os.getenv('SESSION_TTL', 24 * 3600))
+)
+
+# TTL кэша ответов 5ka.ru по эндпоинтам (секунды); 0 - не кэшировать
+CACHE_TTLS = {
+    'categories': int(os.getenv('CACHE_TTL_CATEGORIES', 6 * 3600)),
+    'products': int(os.getenv('CACHE_TTL_PRODUCTS', 300)),
+    'product': int(os.getenv('CACHE_TTL_PRODUCT', 300)),
+}
+# Сколько еще после TTL можно отдавать устаревший ответ, пока он обновляется в фоне
+STALE_CACHE_TTL = int(os.getenv('CACHE_STALE_TTL', 24 * 3600))
+# Сколько помнить ошибку апстрима (4xx/5xx)
+NEGATIVE_CACHE_TTL = int(os.getenv('NEGATIVE_CACHE_TTL', 15))
+
+# Пул соединений и таймауты httpx-клиента к 5ka.ru
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv('UPSTREAM_MAX_CONNECTIONS', 100))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv('UPSTREAM_MAX_KEEPALIVE', 20))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv('UPSTREAM_KEEPALIVE_EXPIRY', 30))
+UPSTREAM_HTTP2 = os.getenv('UPSTREAM_HTTP2', 'false').lower() == 'true'
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', 5))
+UPSTREAM_READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', 10))
+UPSTREAM_WRITE_TIMEOUT = float(os.getenv('UPSTREAM_WRITE_TIMEOUT', 10))
+UPSTREAM_POOL_TIMEOUT = float(os.getenv('UPSTREAM_POOL_TIMEOUT', 5))
+
+# Товары у 5ka.ru запрашиваются страницами этого размера; limit клиента не больше PRODUCTS_MAX_LIMIT
+PRODUCTS_CHUNK_SIZE = int(os.getenv('PRODUCTS_CHUNK_SIZE', 20))
+PRODUCTS_MAX_LIMIT = int(os.getenv('PRODUCTS_MAX_LIMIT', 100))
+
+# POST /api/products/bulk: максимум id в запросе и одновременных запросов к 5ka.ru
+BULK_MAX_IDS = int(os.getenv('BULK_MAX_IDS', 200))
+BULK_CONCURRENCY = int(os.getenv('BULK_CONCURRENCY', 8))
+# Цены в корзине старше этого (секунды) пересчитываются при GET /api/cart
+CART_REPRICE_AGE = float(os.getenv('CART_REPRICE_AGE', 900))
+
+# Максимум операций в одном POST /api/cart/batch
+MAX_CART_BATCH = int(os.getenv('MAX_CART_BATCH', 200))
+
+# Circuit breaker и адаптивный лимит конкурентности на каждый эндпоинт 5ka.ru
+BREAKER_ERROR_RATE = float(os.getenv('BREAKER_ERROR_RATE', 0.5))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv('BREAKER_SLOW_CALL_SECONDS', 3))
+BREAKER_OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', 30))
+LIMITER_INITIAL = int(os.getenv('LIMITER_INITIAL', 20))
+LIMITER_MAX = int(os.getenv('LIMITER_MAX', UPSTREAM_MAX_CONNECTIONS))
+LIMITER_LATENCY_TARGET = float(os.getenv('LIMITER_LATENCY_TARGET', 1.0))
+# Сколько запрос ждет свободного слота лимитера, прежде чем получить 503
+LIMITER_WAIT_TIMEOUT = float(os.getenv('LIMITER_WAIT_TIMEOUT', UPSTREAM_POOL_TIMEOUT))
+# Retry-After в ответе 503, когда 5ka.ru недоступен
+UPSTREAM_RETRY_AFTER = int(os.getenv('UPSTREAM_RETRY_AFTER', 5))
+
+# Локальный справочник магазинов: снимок на диске общий для всех воркеров
+store_directory = StoreDirectory(
+    os.getenv('STORES_SNAPSHOT', 'data/stores.json'),
+    max_age=float(os.getenv('STORES_MAX_AGE', 24 * 3600))
+)
+STORES_REFRESH_INTERVAL = float(os.getenv('STORES_REFRESH_INTERVAL', 300))
+# Области, которые фоново перезапрашиваются у 5ka.ru, и как часто (секунды)
+STORES_REFRESH_AREAS = parse_areas(os.getenv('STORES_REFRESH_AREAS', '55.7558,37.6176,30000'))
+STORES_REFRESH_AGE = float(os.getenv('STORES_REFRESH_AGE', 6 * 3600))
+
+# Кэш геокодирования по нормализованному адресу: LRU в памяти + SQLite
+geocode_cache = GeocodeCache(
+    max_size=int(os.getenv('GEOCODE_CACHE_SIZE', 10000)),
+    max_age=float(os.getenv('GEOCODE_CACHE_MAX_AGE', 30 * 24 * 3600))
+)
+# Файл с заранее известными адресами для прогрева кэша при старте
+GEOCODE_WARM_FILE = os.getenv('GEOCODE_WARM_FILE')
+
+# Локальный поиск товаров по снимку каталога
+product_search = CatalogSearch(os.getenv('PRODUCTS_SNAPSHOT', 'data/catalog.bin'))
+PRODUCTS_REFRESH_INTERVAL = float(os.getenv('PRODUCTS_REFRESH_INTERVAL', 300))
+
+# Фоновый обход каталога: off, lifespan (в процессе API) или process (startup_script.py)
+CATALOG_CRAWLER = os.getenv('CATALOG_CRAWLER', 'off').lower()
+CRAWLER_INTERVAL = float(os.getenv('CRAWLER_INTERVAL', 3600))
+catalog_crawler = None
+
+# Уменьшенные картинки товаров в дисковом кэше
+image_proxy = ImageProxy(
+    ImageCache(os.getenv('IMAGE_CACHE_DIR', 'data/images'),
+               max_bytes=int(os.getenv('IMAGE_CACHE_MAX_MB', 256)) * 2**20),
+    widths=[int(width) for width in os.getenv('IMAGE_WIDTHS', '60,120,240,480').split(',')]
+)
+IMAGE_MAX_SOURCE_BYTES = int(os.getenv('IMAGE_MAX_SOURCE_MB', 10)) * 2**20
+# Подписанные ссылки на картинки в списках товаров; без секрета - поиск товара по id
+image_links = image_links_from_env()
+# Без версии в адресе картинка товара может смениться: кэшируем на сутки
+IMAGE_CACHE_CONTROL = 'public, max-age=86400'
+
+# Подсказки адресов: уже геокодированные адреса и адреса магазинов.
+# Частоты лежат в SQLite, индекс воркера периодически пересобирается из нее
+address_index = AddressSuggestIndex()
+ADDRESS_SUGGEST_REFRESH_INTERVAL = float(os.getenv('ADDRESS_SUGGEST_REFRESH_INTERVAL', 300))
+
+def build_address_index() -> AddressSuggestIndex:
+    """Индекс подсказок из кэша геокодера и справочника магазинов"""
+    index = AddressSuggestIndex()
+    index.add_weighted(geocode_cache.address_weights())
+    index.add_many(filter(None, map(store_address, store_directory.index.stores)))
+    return index
+
+async def run_address_index_refresh(interval: float):
+    """Фоновая задача: подхватывать адреса и частоты, записанные другими воркерами"""
+    global address_index
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            address_index = await asyncio.to_thread(build_address_index)
+        except Exception as e:
+            logger.error(f"Error rebuilding address index: {e}")
+
+# Выставляется, если ответ отдан из устаревшего кэша
+upstream_stale: ContextVar[bool] = ContextVar('upstream_stale', default=False)
 
 class FiveKaAPI:
     """Класс для работы с API 5ka.ru"""
     
-    def __init__(self):
+    def __init__(self, cache: Optional[TieredCache] = None, cache_ttls: Optional[Dict[str, int]] = None):
         self.base_url = "https://5ka.ru"
         self.api_base = "https://5ka.ru/api"
         self.session = None
+        self.cache = cache or TieredCache(
+            max_size=int(os.getenv('CACHE_MAX_SIZE', 2048)),
+            redis_url=os.getenv('REDIS_URL')
+        )
+        self.cache_ttls = CACHE_TTLS if cache_ttls is None else cache_ttls
+        self.singleflight = SingleFlight()
+        self._revalidating: Dict[str, asyncio.Task] = {}
+        self._prefetching: Dict[str, asyncio.Task] = {}
+        # Ключи страниц, загруженных заранее: для подсчета попаданий
+        self.prefetched = LRUCache(max_size=1024)
+        self.prefetches = 0
+        self.prefetch_hits = 0
+        self.bulk_stats = {'local': 0, 'cached': 0, 'upstream': 0}
+        self.negative_cache = LRUCache(max_size=1024)
+        self.limits = None
+        self.http2 = False
+        self.in_flight = 0
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.limiters: Dict[str, AdaptiveLimiter] = {}
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
             'Accept': 'application/json, text/plain, */*',
@@ -73,20 +309,194 @@ class FiveKaAPI:
             'Sec-Fetch-Site': 'same-origin',
         }
     
+    def _create_client(self) -> httpx.AsyncClient:
+        """HTTP клиент с настроенным пулом соединений и таймаутами"""
+        http2 = UPSTREAM_HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("UPSTREAM_HTTP2=true, но пакет h2 не установлен - используем HTTP/1.1")
+                http2 = False
+        
+        self.limits = httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY
+        )
+        self.http2 = http2
+        return httpx.AsyncClient(
+            headers=self.headers,
+            timeout=httpx.Timeout(
+                connect=UPSTREAM_CONNECT_TIMEOUT,
+                read=UPSTREAM_READ_TIMEOUT,
+                write=UPSTREAM_WRITE_TIMEOUT,
+                pool=UPSTREAM_POOL_TIMEOUT
+            ),
+            limits=self.limits,
+            http2=http2,
+            follow_redirects=True
+        )
+    
+    async def start(self):
+        """Открыть HTTP клиент при старте приложения"""
+        if not self.session:
+            self.session = self._create_client()
+    
+    async def close(self):
+        """Закрыть HTTP клиент и соединение с Redis при остановке приложения"""
+        if self.session:
+            await self.session.aclose()
+            self.session = None
+        await self.cache.close()
+    
     async def get_client(self):
         """Получить HTTP клиент"""
         if not self.session:
-            self.session = httpx.AsyncClient(
-                headers=self.headers,
-                timeout=30.0,
-                follow_redirects=True
-            )
+            self.session = self._create_client()
         return self.session
     
+    def pool_stats(self) -> Dict[str, Any]:
+        """Состояние пула соединений для /api/health"""
+        stats = {
+            'in_flight': self.in_flight,
+            'http2': self.http2,
+            'max_connections': UPSTREAM_MAX_CONNECTIONS,
+            'max_keepalive': UPSTREAM_MAX_KEEPALIVE,
+        }
+        # У httpx нет публичного API для пула, читаем состояние httpcore
+        pool = getattr(getattr(self.session, '_transport', None), '_pool', None)
+        if pool is not None:
+            connections = list(getattr(pool, 'connections', []))
+            active = sum(1 for connection in connections if not connection.is_idle())
+            requests = list(getattr(pool, '_requests', []))
+            stats.update({
+                'connections': len(connections),
+                'active_connections': active,
+                'idle_connections': len(connections) - active,
+                'waiting': sum(1 for request in requests if getattr(request, 'connection', None) is None),
+            })
+        return stats
+    
+    async def _fetch_json(self, endpoint: str, url: str, params: Optional[Dict[str, Any]] = None):
+        """GET к API 5ka.ru. Возвращает (status_code, data)"""
+        status_code, payload = await self._fetch(endpoint, url, params)
+        return status_code, payload.data if payload is not None else None
+    
+    async def _fetch(self, endpoint: str, url: str, params: Optional[Dict[str, Any]] = None):
+        """GET к API 5ka.ru через кэш и single-flight. Возвращает (status_code, UpstreamPayload)"""
+        ttl = self.cache_ttls.get(endpoint, 0)
+        key = make_cache_key(url, params)
+        stale = MISS
+        
+        if ttl:
+            cached, is_stale = await self.cache.get_entry(key)
+            if cached is not MISS and not is_stale:
+                return 200, cached
+            if cached is not MISS:
+                stale = cached
+        
+        async def fetch():
+            breaker, limiter = self._guards(endpoint)
+            # При разомкнутом breaker отказываем сразу, не вставая в очередь лимитера;
+            # сверх лимита ждем слота ограниченное время
+            permit = breaker.allow_request()
+            if permit is None:
+                raise UpstreamUnavailable(endpoint, 'circuit breaker разомкнут')
+            if not await limiter.acquire(LIMITER_WAIT_TIMEOUT):
+                breaker.cancel(permit)
+                raise UpstreamUnavailable(endpoint, 'лимит одновременных запросов')
+            
+            client = await self.get_client()
+            self.in_flight += 1
+            started = time.monotonic()
+            success = False
+            try:
+                response = await client.get(url, params=params)
+                success = response.status_code < 500
+            except httpx.HTTPError as e:
+                raise UpstreamUnavailable(endpoint, type(e).__name__) from e
+            finally:
+                latency = time.monotonic() - started
+                self.in_flight -= 1
+                limiter.release(success, latency)
+                breaker.record(success, latency, permit)
+            
+            if response.status_code != 200:
+                # Короткий негативный кэш, чтобы не долбить упавший апстрим
+                self.negative_cache.set(key, response.status_code, NEGATIVE_CACHE_TTL)
+                if response.status_code >= 500:
+                    raise UpstreamUnavailable(endpoint, f"HTTP {response.status_code}")
+                return response.status_code, None
+            
+            payload = UpstreamPayload(response.content)
+            if ttl:
+                await self.cache.set(key, payload, ttl, STALE_CACHE_TTL)
+            return 200, payload
+        
+        if stale is not MISS:
+            # Отдаем последний удачный ответ сразу, обновляем в фоне
+            self._revalidate(key, fetch)
+            upstream_stale.set(True)
+            return 200, stale
+        
+        negative = self.negative_cache.get(key)
+        if negative is not MISS:
+            if negative >= 500:
+                raise UpstreamUnavailable(endpoint, f"HTTP {negative}")
+            return negative, None
+        
+        # Одинаковые одновременные запросы ждут один и тот же ответ
+        return await self.singleflight.do(key, fetch)
+    
+    def _guards(self, endpoint: str):
+        """Circuit breaker и лимитер для эндпоинта"""
+        if endpoint not in self.breakers:
+            self.breakers[endpoint] = CircuitBreaker(
+                endpoint,
+                error_rate=BREAKER_ERROR_RATE,
+                slow_call_seconds=BREAKER_SLOW_CALL_SECONDS,
+                open_seconds=BREAKER_OPEN_SECONDS
+            )
+            self.limiters[endpoint] = AdaptiveLimiter(
+                endpoint,
+                initial_limit=LIMITER_INITIAL,
+                max_limit=LIMITER_MAX,
+                latency_target=LIMITER_LATENCY_TARGET
+            )
+        return self.breakers[endpoint], self.limiters[endpoint]
+    
+    def resilience_stats(self) -> Dict[str, Any]:
+        """Состояние circuit breaker'ов и лимитеров для /api/health"""
+        return {
+            endpoint: {
+                'circuit': self.breakers[endpoint].stats(),
+                'concurrency': self.limiters[endpoint].stats(),
+            }
+            for endpoint in self.breakers
+        }
+    
+    def _revalidate(self, key: str, fetch):
+        """Фоновое обновление устаревшей записи кэша"""
+        async def refresh():
+            try:
+                await self.singleflight.do(key, fetch)
+            except Exception as e:
+                logger.warning(f"Background refresh failed for {key}: {e}")
+        
+        if key in self._revalidating:
+            return
+        task = asyncio.create_task(refresh())
+        self._revalidating[key] = task
+        task.add_done_callback(lambda _: self._revalidating.pop(key, None))
+    
     async def search_address(self, address: str):
         """Поиск адреса и получение информации о магазинах"""
         try:
-            client = await self.get_client()
+            # Тот же адрес в другом написании уже геокодировали
+            cached = await geocode_cache.get(address)
+            if cached is not MISS:
+                return cached
             
             # Ищем адрес через API геокодирования
             geocode_url = f"{self.api_base}/geocode"
@@ -95,39 +505,56 @@ class FiveKaAPI:
                 'limit': 10
             }
             
-            response = await client.get(geocode_url, params=params)
+            status_code, data = await self._fetch_json('geocode', geocode_url, params)
             
-            if response.status_code == 200:
-                data = response.json()
+            if status_code == 200:
+                # Пустой ответ не кэшируем: адрес могут исправить или геокодер починят
+                if data and not upstream_stale.get():
+                    await geocode_cache.set(address, data)
                 return data
             else:
-                logger.error(f"Geocode API error: {response.status_code}")
+                logger.error(f"Geocode API error: {status_code}")
                 return None
                 
+        except UpstreamUnavailable:
+            raise
         except Exception as e:
             logger.error(f"Error searching address: {e}")
             return None
     
+    async def fetch_stores(self, lat: float, lon: float, radius: float):
+        """Магазины вокруг точки из 5ka.ru, мимо справочника; None при ошибке"""
+        stores_url = f"{self.api_base}/stores"
+        params = {
+            'lat': lat,
+            'lon': lon,
+            'radius': int(radius)
+        }
+        
+        status_code, data = await self._fetch_json('stores', stores_url, params)
+        
+        if status_code != 200:
+            logger.error(f"Stores API error: {status_code}")
+            return None
+        return extract_stores(data)
+    
     async def get_stores_by_location(self, lat: float, lon: float, radius: int = 5000):
         """Получить магазины по координатам"""
         try:
-            client = await self.get_client()
+            # Область уже есть в локальном справочнике - отвечаем из памяти
+            stores = store_directory.query(lat, lon, radius)
+            if stores is not None:
+                return stores
             
-            stores_url = f"{self.api_base}/stores"
-            params = {
-                'lat': lat,
-                'lon': lon,
-                'radius': radius
-            }
-            
-            response = await client.get(stores_url, params=params)
-            
-            if response.status_code == 200:
-                return response.json()
-            else:
-                logger.error(f"Stores API error: {response.status_code}")
+            stores = await self.fetch_stores(lat, lon, radius)
+            if stores is None:
                 return []
+            address_index.add_many(filter(None, map(store_address, stores)), weight=0)
+            await asyncio.to_thread(store_directory.merge_and_save, lat, lon, radius, stores)
+            return stores
                 
+        except UpstreamUnavailable:
+            raise
         except Exception as e:
             logger.error(f"Error getting stores: {e}")
             return []
@@ -135,410 +562,284 @@ class FiveKaAPI:
     async def get_categories(self, store_id: Optional[str] = None):
         """Получить категории товаров"""
         try:
-            client = await self.get_client()
-            
             categories_url = f"{self.api_base}/categories"
             params = {}
             if store_id:
                 params['store_id'] = store_id
             
-            response = await client.get(categories_url, params=params)
+            status_code, data = await self._fetch_json('categories', categories_url, params)
             
-            if response.status_code == 200:
-                return response.json()
+            if status_code == 200:
+                return data
             else:
-                logger.error(f"Categories API error: {response.status_code}")
+                logger.error(f"Categories API error: {status_code}")
                 return []
                 
+        except UpstreamUnavailable:
+            raise
         except Exception as e:
             logger.error(f"Error getting categories: {e}")
             return []
     
-    async def search_products(self, query: str = None, category_id: int = None, 
-                            store_id: str = None, page: int = 1, limit: int = 20):
-        """Поиск товаров"""
+    async def _products_chunk(self, params: Dict[str, Any]):
+        """Одна страница 5ka.ru: (status_code, UpstreamPayload, stale)"""
+        status_code, payload = await self._fetch('products', f"{self.api_base}/products", params)
+        return status_code, payload, upstream_stale.get()
+    
+    def _chunk_params(self, page: int, query: Optional[str], category_id: Optional[int],
+                      store_id: Optional[str]) -> Dict[str, Any]:
+        params = {'page': page, 'limit': PRODUCTS_CHUNK_SIZE}
+        if query:
+            params['q'] = query
+        if category_id:
+            params['category_id'] = category_id
+        if store_id:
+            params['store_id'] = store_id
+        return params
+    
+    def _prefetch(self, params: Dict[str, Any]):
+        """Запросить страницу 5ka.ru в фоне, чтобы следующий скролл попал в кэш"""
+        key = make_cache_key(f"{self.api_base}/products", params)
+        if key in self._prefetching or self.prefetched.get(key) is not MISS:
+            return
+        
+        async def prefetch():
+            try:
+                status_code, _ = await self._fetch('products', f"{self.api_base}/products", params)
+                if status_code == 200:
+                    self.prefetched.set(key, True, self.cache_ttls.get('products', 0))
+            except Exception as e:
+                logger.warning(f"Prefetch failed for {key}: {e}")
+        
+        self.prefetches += 1
+        task = asyncio.create_task(prefetch())
+        self._prefetching[key] = task
+        task.add_done_callback(lambda _: self._prefetching.pop(key, None))
+    
+    async def search_products(self, query: str = None, category_id: int = None,
+                            store_id: str = None, offset: int = 0, limit: int = 20,
+                            min_price: float = None, max_price: float = None,
+                            promo: bool = None, sort: str = 'relevance'):
+        """Страница товаров с offset: (данные, offset следующей страницы или None, исходные байты 5ka.ru или None).
+        
+        Байты возвращаются, только если страница - ровно один ответ 5ka.ru
+        и ее можно отдать клиенту без разбора.
+        """
         try:
-            client = await self.get_client()
+            # Сначала локальный каталог (поиск, категория, фильтры), 5ka.ru - только если не нашли.
+            # Цены и наличие в каталоге не привязаны к магазину: запрос по магазину - сразу в 5ka.ru
+            found = None
+            if not store_id:
+                found = product_search.search(
+                    query, category_id, limit=limit, offset=offset,
+                    min_price=min_price, max_price=max_price, promo=promo, sort=sort
+                )
+            if found is not None:
+                next_offset = offset + len(found['products'])
+                return found, next_offset if next_offset < found['total'] else None, None
             
-            products_url = f"{self.api_base}/products"
-            params = {
-                'page': page,
-                'limit': limit
-            }
+            # 5ka.ru - страницами по PRODUCTS_CHUNK_SIZE, большой limit собираем из нескольких
+            pages = chunk_pages(offset, limit, PRODUCTS_CHUNK_SIZE)
+            chunks = await asyncio.gather(*(
+                self._products_chunk(self._chunk_params(page, query, category_id, store_id))
+                for page in pages
+            ))
+            if any(stale for _, _, stale in chunks):
+                upstream_stale.set(True)
             
-            if query:
-                params['q'] = query
-            if category_id:
-                params['category_id'] = category_id
-            if store_id:
-                params['store_id'] = store_id
+            products: List[Dict[str, Any]] = []
+            total = None
+            has_more = False
+            for page, (status_code, payload, _) in zip(pages, chunks):
+                if status_code != 200:
+                    logger.error(f"Products API error: {status_code}")
+                    break
+                key = make_cache_key(f"{self.api_base}/products",
+                                     self._chunk_params(page, query, category_id, store_id))
+                if self.prefetched.get(key) is not MISS:
+                    self.prefetch_hits += 1
+                    self.prefetched.delete(key)
+                items, chunk_total = page_items(payload.data)
+                total = chunk_total if total is None else total
+                products.extend(items)
+                has_more = len(items) >= PRODUCTS_CHUNK_SIZE
+                if not has_more:
+                    break
+            else:
+                if total is not None:
+                    has_more = offset + limit < total
             
-            response = await client.get(products_url, params=params)
+            start = offset % PRODUCTS_CHUNK_SIZE
+            products = products[start:start + limit]
+            if not products:
+                return {'products': [], 'total': total or 0}, None, None
+            next_offset = offset + len(products) if has_more else None
             
-            if response.status_code == 200:
-                return response.json()
-            else:
-                logger.error(f"Products API error: {response.status_code}")
-                return {'products': [], 'total': 0}
+            if has_more and self.cache_ttls.get('products'):
+                # Пока клиент смотрит страницу N, страница N+1 уже едет в кэш
+                for page in chunk_pages(offset + limit, limit, PRODUCTS_CHUNK_SIZE):
+                    self._prefetch(self._chunk_params(page, query, category_id, store_id))
+            
+            if min_price is not None or max_price is not None or promo is not None or sort != 'relevance':
+                # 5ka.ru фильтров не знает: отбираем и сортируем полученную страницу
+                # по тем же правилам, что и локальный каталог. total - число подходящих на ней
+                total, products = ProductCatalog(products).query(
+                    None, min_price, max_price, promo, sort, 0, len(products)
+                )
+                return {'products': products, 'total': total}, next_offset, None
+            
+            # Байты как есть - только если ответ 5ka.ru уже в нашей форме {"products", "total"};
+            # иначе форма ответа зависела бы от limit
+            raw = None
+            if len(chunks) == 1 and start == 0 and limit == PRODUCTS_CHUNK_SIZE:
+                data = chunks[0][1].data
+                if isinstance(data, dict) and isinstance(data.get('products'), list) and 'total' in data:
+                    raw = chunks[0][1].raw
+            return {'products': products, 'total': total if total is not None else len(products)}, next_offset, raw
                 
+        except UpstreamUnavailable:
+            raise
         except Exception as e:
             logger.error(f"Error searching products: {e}")
-            return {'products': [], 'total': 0}
+            return {'products': [], 'total': 0}, None, None
     
-    async def get_product_details(self, product_id: str):
+    async def get_product_details(self, product_id: str, store_id: Optional[str] = None):
         """Получить детальную информацию о товаре"""
         try:
-            client = await self.get_client()
-            
             product_url = f"{self.api_base}/products/{product_id}"
-            response = await client.get(product_url)
+            params = {'store_id': store_id} if store_id else None
+            status_code, data = await self._fetch_json('product', product_url, params)
             
-            if response.status_code == 200:
-                return response.json()
+            if status_code == 200:
+                return data
             else:
-                logger.error(f"Product details API error: {response.status_code}")
+                logger.error(f"Product details API error: {status_code}")
                 return None
                 
+        except UpstreamUnavailable:
+            raise
         except Exception as e:
             logger.error(f"Error getting product details: {e}")
             return None
 
+    async def fetch_image(self, url: str) -> Optional[bytes]:
+        """Скачать картинку целиком, если она не больше IMAGE_MAX_SOURCE_BYTES"""
+        client = await self.get_client()
+        async with client.stream('GET', url) as response:
+            if response.status_code != 200:
+                logger.error(f"Image fetch error {response.status_code}: {url}")
+                return None
+            chunks = []
+            size = 0
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+                if size > IMAGE_MAX_SOURCE_BYTES:
+                    logger.error(f"Image too large: {url}")
+                    return None
+                chunks.append(chunk)
+        return b''.join(chunks)
+    
+    async def get_products_bulk(self, product_ids: List[str], store_id: Optional[str] = None):
+        """Детали товаров одним вызовом: {product_id: товар или None}.
+        
+        Без магазина товары берутся из локального каталога; остальные - из кэша
+        ответов, и только промахи идут в 5ka.ru, не больше BULK_CONCURRENCY сразу.
+        """
+        products: Dict[str, Optional[Dict[str, Any]]] = {}
+        missing = []
+        catalog = product_search.index.catalog
+        for product_id in dict.fromkeys(map(str, product_ids)):
+            # Локальный каталог общий для всех магазинов: цены конкретного магазина в нем нет
+            product = catalog.get(product_id) if store_id is None else None
+            if product is not None:
+                products[product_id] = product
+                self.bulk_stats['local'] += 1
+            else:
+                missing.append(product_id)
+        
+        params = {'store_id': store_id} if store_id else None
+        ttl = self.cache_ttls.get('product', 0)
+        semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+        
+        async def lookup(product_id: str):
+            if ttl:
+                cached, is_stale = await self.cache.get_entry(
+                    make_cache_key(f"{self.api_base}/products/{product_id}", params)
+                )
+                if cached is not MISS and not is_stale:
+                    self.bulk_stats['cached'] += 1
+                    return cached.data
+            async with semaphore:
+                self.bulk_stats['upstream'] += 1
+                return await self.get_product_details(product_id, store_id)
+        
+        for product_id, product in zip(missing, await asyncio.gather(*map(lookup, missing))):
+            products[product_id] = product if isinstance(product, dict) else None
+        return products
+
 # Инициализация API клиента
 fiveka_api = FiveKaAPI()
 
 # Эндпоинты API
 
+@app.exception_handler(UpstreamUnavailable)
+async def upstream_unavailable(request: Request, exc: UpstreamUnavailable):
+    """5ka.ru не ответил: явная ошибка вместо пустого списка"""
+    logger.warning(f"Upstream unavailable: {exc}")
+    return FastJSONResponse(
+        {'detail': '5ka.ru временно недоступен, попробуйте позже', 'reason': exc.reason},
+        status_code=503,
+        headers={'Retry-After': str(UPSTREAM_RETRY_AFTER)}
+    )
+
+# Оболочка Mini App собирается один раз при старте воркера
+miniapp_shell = ShellPage.build(FRONTEND_DIR / 'miniapp')
+app.mount("/static", ImmutableStaticFiles(directory=STATIC_DIR), name="static")
+
 @app.get("/")
-async def root():
+async def root(request: Request):
     """Главная страница с Telegram Mini App"""
-    html_content = """
-    <!DOCTYPE html>
-    <html lang="ru">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>5ka Mini App</title>
-        <script src="https://telegram.org/js/telegram-web-app.js"></script>
-        <style>
-            * {
-                margin: 0;
-                padding: 0;
-                box-sizing: border-box;
-            }
-            body {
-                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-                background: var(--tg-theme-bg-color, #ffffff);
-                color: var(--tg-theme-text-color, #000000);
-                padding: 20px;
-            }
-            .container {
-                max-width: 400px;
-                margin: 0 auto;
-            }
-            .form-group {
-                margin-bottom: 20px;
-            }
-            label {
-                display: block;
-                margin-bottom: 8px;
-                font-weight: 500;
-            }
-            input, textarea {
-                width: 100%;
-                padding: 12px;
-                border: 1px solid #ddd;
-                border-radius: 8px;
-                font-size: 16px;
-            }
-            button {
-                width: 100%;
-                padding: 12px;
-                background: var(--tg-theme-button-color, #007AFF);
-                color: var(--tg-theme-button-text-color, #ffffff);
-                border: none;
-                border-radius: 8px;
-                font-size: 16px;
-                cursor: pointer;
-            }
-            button:hover {
-                opacity: 0.8;
-            }
-            .loading {
-                display: none;
-                text-align: center;
-                padding: 20px;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>🛒 5ka Mini App</h1>
-            
-            <div id="address-form">
-                <div class="form-group">
-                    <label for="address">Адрес доставки:</label>
-                    <input type="text" id="address" placeholder="Введите ваш адрес" required>
-                </div>
-                
-                <div class="form-group">
-                    <label for="comment">Комментарий (необязательно):</label>
-                    <textarea id="comment" placeholder="Комментарий к заказу" rows="3"></textarea>
-                </div>
-                
-                <button onclick="submitAddress()">Найти магазины</button>
-            </div>
-            
-            <div id="loading" class="loading">
-                <p>Загрузка...</p>
-            </div>
-            
-            <div id="content" style="display: none;">
-                <!-- Здесь будет отображаться каталог товаров -->
-            </div>
-        </div>
-
-        <script>
-            // Инициализация Telegram Web App
-            const tg = window.Telegram.WebApp;
-            tg.ready();
-            
-            // Применение темы Telegram
-            document.body.style.backgroundColor = tg.themeParams.bg_color || '#ffffff';
-            document.body.style.color = tg.themeParams.text_color || '#000000';
-            
-            async function submitAddress() {
-                const address = document.getElementById('address').value;
-                const comment = document.getElementById('comment').value;
-                
-                if (!address.trim()) {
-                    tg.showAlert('Пожалуйста, введите адрес');
-                    return;
-                }
-                
-                document.getElementById('address-form').style.display = 'none';
-                document.getElementById('loading').style.display = 'block';
-                
-                try {
-                    const response = await fetch('/api/set-address', {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json',
-                        },
-                        body: JSON.stringify({
-                            address: address,
-                            comment: comment,
-                            user_id: tg.initDataUnsafe?.user?.id || 'demo_user'
-                        })
-                    });
-                    
-                    const result = await response.json();
-                    
-                    if (result.success) {
-                        await loadCatalog();
-                    } else {
-                        tg.showAlert('Ошибка: ' + result.message);
-                        showAddressForm();
-                    }
-                } catch (error) {
-                    console.error('Error:', error);
-                    tg.showAlert('Произошла ошибка при обработке запроса');
-                    showAddressForm();
-                }
-            }
-            
-            async function loadCatalog() {
-                try {
-                    const response = await fetch('/api/categories');
-                    const categories = await response.json();
-                    
-                    document.getElementById('loading').style.display = 'none';
-                    document.getElementById('content').style.display = 'block';
-                    
-                    displayCategories(categories);
-                } catch (error) {
-                    console.error('Error loading catalog:', error);
-                    tg.showAlert('Ошибка загрузки каталога');
-                }
-            }
-            
-            function displayCategories(categories) {
-                const content = document.getElementById('content');
-                let html = '<h2>Выберите категорию:</h2>';
-                
-                categories.forEach(category => {
-                    html += `
-                        <div style="padding: 10px; margin: 10px 0; border: 1px solid #ddd; border-radius: 8px; cursor: pointer;" 
-                             onclick="loadProducts(${category.id}, '${category.name}')">
-                            <h3>${category.name}</h3>
-                            <p style="color: #666; font-size: 14px;">${category.description || ''}</p>
-                        </div>
-                    `;
-                });
-                
-                content.innerHTML = html;
-            }
-            
-            async function loadProducts(categoryId, categoryName) {
-                document.getElementById('loading').style.display = 'block';
-                document.getElementById('content').style.display = 'none';
-                
-                try {
-                    const response = await fetch(`/api/products?category_id=${categoryId}&limit=20`);
-                    const data = await response.json();
-                    
-                    document.getElementById('loading').style.display = 'none';
-                    document.getElementById('content').style.display = 'block';
-                    
-                    displayProducts(data.products, categoryName);
-                } catch (error) {
-                    console.error('Error loading products:', error);
-                    tg.showAlert('Ошибка загрузки товаров');
-                }
-            }
-            
-            function displayProducts(products, categoryName) {
-                const content = document.getElementById('content');
-                let html = `
-                    <div style="margin-bottom: 20px;">
-                        <button onclick="loadCatalog()" style="width: auto; padding: 8px 16px; margin-right: 10px;">← Назад</button>
-                        <h2>${categoryName}</h2>
-                    </div>
-                `;
-                
-                products.forEach(product => {
-                    html += `
-                        <div style="padding: 15px; margin: 10px 0; border: 1px solid #ddd; border-radius: 8px;">
-                            <div style="display: flex; align-items: center;">
-                                ${product.image ? `<img src="${product.image}" style="width: 60px; height: 60px; object-fit: cover; border-radius: 4px; margin-right: 15px;">` : ''}
-                                <div style="flex: 1;">
-                                    <h3 style="margin-bottom: 5px;">${product.name}</h3>
-                                    <p style="color: #666; font-size: 14px; margin-bottom: 10px;">${product.description || ''}</p>
-                                    <div style="display: flex; justify-content: space-between; align-items: center;">
-                                        <span style="font-size: 18px; font-weight: bold; color: #007AFF;">${product.price} ₽</span>
-                                        <button onclick="addToCart('${product.id}', '${product.name}', ${product.price})" 
-                                                style="width: auto; padding: 8px 16px; font-size: 14px;">
-                                            В корзину
-                                        </button>
-                                    </div>
-                                </div>
-                            </div>
-                        </div>
-                    `;
-                });
-                
-                content.innerHTML = html;
-            }
-            
-            async function addToCart(productId, productName, price) {
-                try {
-                    const response = await fetch('/api/cart/add', {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json',
-                        },
-                        body: JSON.stringify({
-                            user_id: tg.initDataUnsafe?.user?.id || 'demo_user',
-                            product_id: productId,
-                            name: productName,
-                            price: price,
-                            quantity: 1
-                        })
-                    });
-                    
-                    const result = await response.json();
-                    
-                    if (result.success) {
-                        tg.showAlert('Товар добавлен в корзину!');
-                        tg.MainButton.setText(`Корзина (${result.cart_count})`);
-                        tg.MainButton.show();
-                        tg.MainButton.onClick(() => showCart());
-                    } else {
-                        tg.showAlert('Ошибка добавления в корзину');
-                    }
-                } catch (error) {
-                    console.error('Error adding to cart:', error);
-                    tg.showAlert('Ошибка добавления в корзину');
-                }
-            }
-            
-            async function showCart() {
-                try {
-                    const userId = tg.initDataUnsafe?.user?.id || 'demo_user';
-                    const response = await fetch(`/api/cart/${userId}`);
-                    const cart = await response.json();
-                    
-                    let html = '<h2>Корзина</h2>';
-                    
-                    if (cart.items && cart.items.length > 0) {
-                        cart.items.forEach(item => {
-                            html += `
-                                <div style="padding: 10px; margin: 10px 0; border: 1px solid #ddd; border-radius: 8px;">
-                                    <div style="display: flex; justify-content: space-between; align-items: center;">
-                                        <div>
-                                            <h4>${item.name}</h4>
-                                            <p>Количество: ${item.quantity}</p>
-                                        </div>
-                                        <div style="text-align: right;">
-                                            <p style="font-weight: bold;">${item.price * item.quantity} ₽</p>
-                                        </div>
-                                    </div>
-                                </div>
-                            `;
-                        });
-                        
-                        html += `
-                            <div style="margin-top: 20px; padding: 15px; background: #f5f5f5; border-radius: 8px;">
-                                <h3>Итого: ${cart.total_price} ₽</h3>
-                                <button onclick="checkout()" style="margin-top: 10px;">Оформить заказ</button>
-                            </div>
-                        `;
-                    } else {
-                        html += '<p>Корзина пуста</p>';
-                    }
-                    
-                    document.getElementById('content').innerHTML = html;
-                } catch (error) {
-                    console.error('Error loading cart:', error);
-                    tg.showAlert('Ошибка загрузки корзины');
-                }
-            }
-            
-            function showAddressForm() {
-                document.getElementById('address-form').style.display = 'block';
-                document.getElementById('loading').style.display = 'none';
-                document.getElementById('content').style.display = 'none';
-            }
-            
-            function checkout() {
-                tg.showAlert('Функция оформления заказа будет добавлена позже');
-            }
-        </script>
-    </body>
-    </html>
-    """
-    return HTMLResponse(content=html_content)
+    return miniapp_shell.response(request)
+
+@app.post("/api/auth")
+async def auth(request: dict):
+    """Вход по Telegram initData: токен сессии для остальных запросов"""
+    if session_auth is None:
+        raise HTTPException(status_code=503, detail='Авторизация Telegram не настроена')
+    try:
+        user, token, expires = session_auth.login(str(request.get('init_data') or ''))
+    except AuthError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    return {'token': token, 'user_id': str(user['id']), 'expires_at': expires}
 
 @app.post("/api/set-address")
-async def set_address(request: dict):
+async def set_address(request: dict, http_request: Request):
     """Установить адрес пользователя"""
+    user_id = request_user(http_request, request)
     try:
-        user_id = request.get('user_id', 'demo_user')
         address = request.get('address')
         comment = request.get('comment', '')
+        store_id = request.get('store_id')
         
         if not address:
             return {'success': False, 'message': 'Адрес не указан'}
         
         # Поиск адреса и магазинов
         address_data = await fiveka_api.search_address(address)
+        if address_data:
+            # Частые адреса поднимаются в подсказках выше; счетчик общий для воркеров
+            address_index.add(address)
+            await asyncio.to_thread(geocode_cache.record_use, address)
         
         # Сохраняем данные пользователя
-        user_sessions[user_id] = {
+        await session_store.set(user_id, {
             'address': address,
             'comment': comment,
             'address_data': address_data,
+            # Магазин, по которому пересчитываются цены корзины
+            'store_id': str(store_id) if store_id else None,
             'timestamp': datetime.now().isoformat()
-        }
+        })
         
         return {'success': True, 'message': 'Адрес установлен'}
         
@@ -546,12 +847,27 @@ async def set_address(request: dict):
         logger.error(f"Error setting address: {e}")
         return {'success': False, 'message': 'Ошибка обработки адреса'}
 
+@app.get("/api/address/suggest")
+async def suggest_address(q: str = Query('', max_length=200), limit: int = Query(5, ge=1, le=20)):
+    """Подсказки адреса по мере ввода, без обращения к 5ka.ru"""
+    return {'suggestions': address_index.suggest(q, limit)}
+
+def mark_stale(response: Response):
+    """Пометить ответ, отданный из устаревшего кэша"""
+    if upstream_stale.get():
+        response.headers['X-Cache'] = 'STALE'
+        return True
+    return False
+
 @app.get("/api/categories")
-async def get_categories():
+async def get_categories(response: Response):
     """Получить категории товаров"""
     try:
         categories = await fiveka_api.get_categories()
+        mark_stale(response)
         return categories
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error getting categories: {e}")
         return []
@@ -560,89 +876,286 @@ async def get_categories():
 async def get_products(
     query: Optional[str] = None,
     category_id: Optional[int] = None,
-    page: int = 1,
-    limit: int = 20
+    store_id: Optional[str] = None,
+    page: int = Query(1, ge=1),
+    limit: int = Query(20, ge=1),
+    cursor: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    promo: Optional[bool] = None,
+    sort: str = Query('relevance', pattern=f"^({'|'.join(SORT_KEYS)})$")
 ):
-    """Получить товары"""
+    """Получить товары; следующая страница - по next_cursor из ответа"""
+    limit = min(limit, PRODUCTS_MAX_LIMIT)
+    fingerprint = query_fingerprint(
+        query=query, category_id=category_id, store_id=store_id,
+        min_price=min_price, max_price=max_price, promo=promo, sort=sort
+    )
+    if cursor:
+        try:
+            offset = decode_cursor(cursor, fingerprint)
+        except CursorError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        offset = (page - 1) * limit
+    
     try:
-        products = await fiveka_api.search_products(
+        products, next_offset, raw = await fiveka_api.search_products(
             query=query,
             category_id=category_id,
-            page=page,
-            limit=limit
+            store_id=store_id,
+            offset=offset,
+            limit=limit,
+            min_price=min_price,
+            max_price=max_price,
+            promo=promo,
+            sort=sort
         )
-        return products
+        next_cursor = encode_cursor(next_offset, fingerprint) if next_offset is not None else None
+        if image_links is not None:
+            products = {**products, 'products': image_links.with_thumbnails(products['products'])}
+            # Ссылки на картинки дописываются в каждый товар: байты 5ka.ru как есть не подходят
+            raw = None
+        if upstream_stale.get():
+            return FastJSONResponse({**products, 'next_cursor': next_cursor, 'stale': True},
+                                    headers={'X-Cache': 'STALE'})
+        if raw is not None:
+            # Ответ 5ka.ru уходит клиенту как есть, без повторной сериализации: дописываем только курсор
+            body = append_field(raw, 'next_cursor', next_cursor)
+            if body is not None:
+                return RawJSONResponse(body)
+        return FastJSONResponse({**products, 'next_cursor': next_cursor})
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error getting products: {e}")
-        return {'products': [], 'total': 0}
+        return {'products': [], 'total': 0, 'next_cursor': None}
+
+def product_offer(product_id: str, product: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Цена и наличие товара в ответе /api/products/bulk"""
+    if product is None:
+        return {'id': product_id, 'available': False, 'price': None, 'old_price': None, 'product': None}
+    price, old_price = product_prices(product)
+    return {
+        'id': product_id,
+        'available': price is not None and product_available(product),
+        'price': price,
+        'old_price': old_price,
+        'product': product,
+    }
+
+@app.post("/api/products/bulk")
+async def get_products_bulk(request: dict):
+    """Детали, цены и наличие списка товаров в магазине одним запросом"""
+    product_ids = request.get('product_ids') or request.get('ids') or []
+    store_id = request.get('store_id')
+    if not isinstance(product_ids, list) or len(product_ids) > BULK_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f'product_ids должен быть списком не длиннее {BULK_MAX_IDS}')
+    
+    products = await fiveka_api.get_products_bulk(product_ids, str(store_id) if store_id else None)
+    return FastJSONResponse({
+        'store_id': store_id,
+        'products': [product_offer(product_id, product) for product_id, product in products.items()],
+    })
+
+async def render_image(source_url: str, width: int, fmt: str) -> Optional[bytes]:
+    """Вариант картинки: оригинал берется из кэша или скачивается один раз"""
+    source_name = image_proxy.source_name(source_url)
+    original = await asyncio.to_thread(image_proxy.cache.get, source_name)
+    if original is None:
+        original = await fiveka_api.fetch_image(source_url)
+        if original is None:
+            return None
+        await asyncio.to_thread(image_proxy.cache.put, source_name, original)
+    # Pillow отпускает GIL при уменьшении и кодировании: в потоке не блокируем event loop
+    return await asyncio.to_thread(image_proxy.render, source_url, original, width, fmt)
+
+@app.get("/img/{product_id}")
+async def product_image(request: Request, product_id: str,
+                        w: Optional[int] = Query(None, ge=1, le=4096), v: Optional[str] = None,
+                        src: Optional[str] = None, sig: Optional[str] = None):
+    """Картинка товара шириной не меньше w в WebP/JPEG; с верной v (версией адреса) или подписью - кэшируется навсегда"""
+    signed = bool(src and sig and image_links is not None and image_links.verify(product_id, src, sig))
+    if signed:
+        # Адрес оригинала из подписанной ссылки: товар искать не нужно
+        source_url = src
+    else:
+        product = product_search.index.catalog.get(product_id) or await fiveka_api.get_product_details(product_id)
+        source_url = product_image_url(product) if isinstance(product, dict) else None
+    if source_url is None:
+        raise HTTPException(status_code=404, detail='У товара нет картинки')
+    if not PILLOW_AVAILABLE:
+        return RedirectResponse(source_url)
+    
+    width = snap_width(w, image_proxy.widths)
+    fmt = choose_format(request.headers.get('accept'))
+    name = image_proxy.variant_name(source_url, width, fmt)
+    etag = f'"{name}"'
+    # Навсегда кэшируем только ссылку, которая точно указывает на этот адрес картинки:
+    # устаревшая или случайная v иначе закрепила бы в кэше чужую версию
+    immutable = signed or (v is not None and hmac.compare_digest(v, image_version(source_url)))
+    headers = {
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL if immutable else IMAGE_CACHE_CONTROL,
+        'ETag': etag,
+        'Vary': 'Accept',
+    }
+    if etag_matches(request.headers.get('if-none-match'), {etag}):
+        return Response(status_code=304, headers=headers)
+    
+    data = await asyncio.to_thread(image_proxy.cache.get, name)
+    if data is None:
+        try:
+            data = await fiveka_api.singleflight.do(f"img:{name}", lambda: render_image(source_url, width, fmt))
+        except Exception as e:
+            logger.error(f"Error rendering image {product_id}: {e}")
+            data = None
+        if data is None:
+            raise HTTPException(status_code=502, detail='Картинка недоступна')
+    return Response(data, media_type=FORMATS[fmt][1], headers=headers)
 
 @app.post("/api/cart/add")
-async def add_to_cart(request: dict):
+async def add_to_cart(request: dict, http_request: Request):
     """Добавить товар в корзину"""
+    user_id = request_user(http_request, request)
     try:
-        user_id = request.get('user_id', 'demo_user')
         product_id = request.get('product_id')
         name = request.get('name')
         price = request.get('price')
         quantity = request.get('quantity', 1)
         
-        if user_id not in user_carts:
-            user_carts[user_id] = {
-                'items': [],
-                'total_price': 0
-            }
-        
-        cart = user_carts[user_id]
-        
-        # Проверяем, есть ли уже этот товар в корзине
-        existing_item = None
-        for item in cart['items']:
-            if item['product_id'] == product_id:
-                existing_item = item
-                break
-        
-        if existing_item:
-            existing_item['quantity'] += quantity
-        else:
-            cart['items'].append({
+        def change(cart):
+            operations = parse_operations(cart, [{
+                'op': 'add',
                 'product_id': product_id,
                 'name': name,
                 'price': price,
                 'quantity': quantity
-            })
+            }])
+            apply_operations(cart, operations, time.time())
         
-        # Пересчитываем общую стоимость
-        cart['total_price'] = sum(item['price'] * item['quantity'] for item in cart['items'])
+        # Чтение и запись корзины - одна атомарная операция хранилища
+        cart, _ = await cart_store.update(user_id, change)
         
         return {
             'success': True,
-            'cart_count': len(cart['items']),
-            'total_price': cart['total_price']
+            'cart_count': cart_count(cart),
+            'total_price': cart_total(cart)
         }
         
+    except CartError as e:
+        return {'success': False, 'message': str(e)}
     except Exception as e:
         logger.error(f"Error adding to cart: {e}")
         return {'success': False, 'message': 'Ошибка добавления в корзину'}
 
-@app.get("/api/cart/{user_id}")
-async def get_cart(user_id: str):
-    """Получить корзину пользователя"""
+@app.post("/api/cart/set")
+async def set_cart_quantity(request: dict, http_request: Request):
+    """Изменить количество товара в корзине (0 - удалить)"""
+    user_id = request_user(http_request, request)
     try:
-        if user_id not in user_carts:
-            return {'items': [], 'total_price': 0}
         
-        return user_carts[user_id]
+        def change(cart):
+            operations = parse_operations(cart, [{**request, 'op': 'set'}])
+            apply_operations(cart, operations, time.time())
+        
+        cart, _ = await cart_store.update(user_id, change)
+        
+        return {
+            'success': True,
+            'cart_count': cart_count(cart),
+            'total_price': cart_total(cart)
+        }
+        
+    except CartError as e:
+        return {'success': False, 'message': str(e)}
+    except Exception as e:
+        logger.error(f"Error setting cart quantity: {e}")
+        return {'success': False, 'message': 'Ошибка изменения корзины'}
+
+@app.post("/api/cart/remove")
+async def remove_from_cart(request: dict, http_request: Request):
+    """Удалить товар из корзины"""
+    user_id = request_user(http_request, request)
+    try:
+        product_id = request.get('product_id')
+        
+        cart, _ = await cart_store.update(user_id, lambda cart: remove_item(cart, product_id))
+        
+        return {
+            'success': True,
+            'cart_count': cart_count(cart),
+            'total_price': cart_total(cart)
+        }
+        
+    except Exception as e:
+        logger.error(f"Error removing from cart: {e}")
+        return {'success': False, 'message': 'Ошибка удаления из корзины'}
+
+@app.post("/api/cart/batch")
+async def batch_cart(request: dict, http_request: Request):
+    """Применить пакет операций add/set/remove к корзине"""
+    user_id = request_user(http_request, request)
+    try:
+        operations = request.get('operations') or []
+        
+        if not isinstance(operations, list) or len(operations) > MAX_CART_BATCH:
+            return {'success': False, 'message': f'Пакет должен быть списком не длиннее {MAX_CART_BATCH} операций'}
+        
+        def change(cart):
+            # Сначала проверяем весь пакет, затем применяем - либо все, либо ничего
+            apply_operations(cart, parse_operations(cart, operations), time.time())
+        
+        cart, _ = await cart_store.update(user_id, change)
+        
+        return {'success': True, 'cart': cart_response(cart)}
+        
+    except CartError as e:
+        return {'success': False, 'message': str(e)}
+    except Exception as e:
+        logger.error(f"Error applying cart batch: {e}")
+        return {'success': False, 'message': 'Ошибка изменения корзины'}
+
+async def reprice_cart(user_id: str, cart: Dict[str, Any], store_id: Optional[str]) -> Dict[str, Any]:
+    """Пересчитать цены корзины, если они устарели"""
+    if not cart_count(cart) or time.time() - cart.get('priced_at', 0) < CART_REPRICE_AGE:
+        return cart
+    if store_id is None:
+        session = await session_store.get(user_id) or {}
+        store_id = session.get('store_id')
+    
+    products = await fiveka_api.get_products_bulk(list(cart['items']), store_id)
+    offers = {
+        product_id: product_offer(product_id, product)
+        for product_id, product in products.items() if product is not None
+    }
+    cart, changed = await cart_store.update(user_id, lambda cart: reprice(cart, offers, time.time()))
+    if changed:
+        logger.info(f"Cart {user_id} repriced: {changed} prices changed")
+    return cart
+
+@app.get("/api/cart/{user_id}")
+async def get_cart(user_id: str, http_request: Request, store_id: Optional[str] = None):
+    """Получить корзину пользователя; устаревшие цены пересчитываются по магазину"""
+    path_user(http_request, user_id)
+    try:
+        cart = await cart_store.get(user_id)
+        try:
+            cart = await reprice_cart(user_id, cart, store_id)
+        except Exception as e:
+            # Корзину отдаем и со старыми ценами
+            logger.warning(f"Error repricing cart {user_id}: {e}")
+        return cart_response(cart)
         
     except Exception as e:
         logger.error(f"Error getting cart: {e}")
         return {'items': [], 'total_price': 0}
 
 @app.delete("/api/cart/{user_id}")
-async def clear_cart(user_id: str):
+async def clear_cart(user_id: str, http_request: Request):
     """Очистить корзину"""
+    path_user(http_request, user_id)
     try:
-        if user_id in user_carts:
-            del user_carts[user_id]
+        await cart_store.clear(user_id)
         
         return {'success': True, 'message': 'Корзина очищена'}
         
@@ -656,8 +1169,27 @@ async def health_check():
     return {
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'active_sessions': len(user_sessions),
-        'active_carts': len(user_carts)
+        'active_sessions': await session_store.count(),
+        'active_carts': await cart_store.count(),
+        'cache': fiveka_api.cache.stats(),
+        'negative_cache_size': len(fiveka_api.negative_cache),
+        'upstream': fiveka_api.singleflight.stats(),
+        'upstream_pool': fiveka_api.pool_stats(),
+        'upstream_endpoints': fiveka_api.resilience_stats(),
+        'products_bulk': fiveka_api.bulk_stats,
+        'images': image_proxy.stats(),
+        'products_prefetch': {
+            'started': fiveka_api.prefetches,
+            'hits': fiveka_api.prefetch_hits,
+            'in_flight': len(fiveka_api._prefetching),
+        },
+        'store_index': store_directory.stats(),
+        'geocode_cache': geocode_cache.stats(),
+        'address_suggest': address_index.stats(),
+        'product_search': product_search.stats(),
+        'catalog_crawler': catalog_crawler.stats() if catalog_crawler is not None else None,
+        'telegram_webhook': bot_webhook.stats() if bot_webhook is not None else None,
+        'telegram_auth': session_auth.stats() if session_auth is not None else None
     }
 
 if __name__ == "__main__":
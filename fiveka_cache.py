@@ -0,0 +1,254 @@
+"""Кэширование ответов API 5ka.ru: локальный LRU, общий уровень в Redis
+и объединение одинаковых одновременных запросов"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import urlencode
+
+import fast_json
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Redis необязателен, работаем только с локальным кэшем
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+# Маркер промаха: None и [] тоже валидные ответы API
+MISS = object()
+
+# Свободный текст поиска: только его нормализуем в ключе кэша
+QUERY_PARAMS = frozenset({'q', 'query'})
+
+
+def make_cache_key(endpoint: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """Ключ кэша из имени эндпоинта и нормализованных параметров запроса"""
+    normalized = []
+    for name, value in (params or {}).items():
+        if value is None or value == '':
+            continue
+        if name in QUERY_PARAMS and isinstance(value, str):
+            # "Молоко  " и "молоко" - один и тот же запрос; коды магазинов,
+            # категорий и прочие параметры сравниваем побайтно
+            value = ' '.join(value.split()).casefold()
+        normalized.append((str(name), str(value)))
+    normalized.sort()
+    return f"5ka:{endpoint}:{urlencode(normalized)}"
+
+
+class UpstreamPayload:
+    """Ответ 5ka.ru: исходные байты и разобранный JSON.
+
+    Байты можно отдать клиенту как есть, без повторной сериализации.
+    """
+
+    __slots__ = ('raw', 'data')
+
+    def __init__(self, raw: bytes, data: Any = MISS):
+        self.raw = raw
+        # Разбираем сразу: битый JSON не должен попасть в кэш
+        self.data = fast_json.loads(raw) if data is MISS else data
+
+
+def encode_value(value: Any) -> bytes:
+    """Сериализация значения для Redis"""
+    if isinstance(value, UpstreamPayload):
+        return b'P' + value.raw
+    return b'J' + fast_json.dumps(value)
+
+
+def decode_value(raw: bytes) -> Any:
+    kind, body = raw[:1], raw[1:]
+    if kind == b'P':
+        return UpstreamPayload(body)
+    return fast_json.loads(body)
+
+
+class LRUCache:
+    """In-process LRU с TTL на каждую запись.
+
+    Запись живет ttl + stale_ttl секунд: первые ttl она свежая, затем
+    еще stale_ttl ее можно отдавать как устаревшую (stale-while-revalidate).
+    """
+
+    def __init__(self, max_size: int = 2048):
+        self.max_size = max_size
+        self._data: "OrderedDict[str, Tuple[float, float, Any]]" = OrderedDict()
+        self.evictions = 0
+
+    def get_entry(self, key: str) -> Any:
+        """(value, fresh) или MISS"""
+        entry = self._data.get(key)
+        if entry is None:
+            return MISS
+        fresh_until, expires_at, value = entry
+        now = time.monotonic()
+        if expires_at <= now:
+            del self._data[key]
+            return MISS
+        self._data.move_to_end(key)
+        return value, fresh_until > now
+
+    def get(self, key: str) -> Any:
+        entry = self.get_entry(key)
+        if entry is MISS or not entry[1]:
+            return MISS
+        return entry[0]
+
+    def set(self, key: str, value: Any, ttl: float, stale_ttl: float = 0):
+        now = time.monotonic()
+        self._data[key] = (now + ttl, now + ttl + stale_ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TieredCache:
+    """Двухуровневый кэш: LRU в процессе + общий Redis для всех воркеров"""
+
+    # Сколько секунд не трогать Redis после ошибки соединения
+    REDIS_RETRY_DELAY = 30.0
+
+    def __init__(self, max_size: int = 2048, redis_url: Optional[str] = None, redis_client=None):
+        self.local = LRUCache(max_size)
+        self.redis = redis_client
+        if self.redis is None and redis_url:
+            if aioredis is None:
+                logger.warning("REDIS_URL задан, но пакет redis не установлен - только локальный кэш")
+            else:
+                self.redis = aioredis.from_url(redis_url)
+        self._redis_disabled_until = 0.0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.redis_hits = 0
+        self.redis_errors = 0
+
+    def _redis_available(self) -> bool:
+        return self.redis is not None and time.monotonic() >= self._redis_disabled_until
+
+    def _redis_failed(self, e: Exception):
+        self.redis_errors += 1
+        self._redis_disabled_until = time.monotonic() + self.REDIS_RETRY_DELAY
+        logger.warning(f"Redis cache error: {e}")
+
+    async def get_entry(self, key: str) -> Tuple[Any, bool]:
+        """(value, stale) из кэша; (MISS, False) при промахе"""
+        entry = self.local.get_entry(key)
+        if entry is not MISS:
+            value, fresh = entry
+            if fresh:
+                self.hits += 1
+                return value, False
+            stale_value = value
+        else:
+            stale_value = MISS
+
+        if self._redis_available():
+            try:
+                raw = await self.redis.get(key)
+            except Exception as e:
+                self._redis_failed(e)
+                raw = None
+            if raw is not None:
+                # Другой воркер мог уже обновить запись
+                meta, _, body = raw.partition(b'\n')
+                fresh_until, expires_at = (float(part) for part in meta.split(b' '))
+                now = time.time()
+                ttl = fresh_until - now
+                stale_ttl = expires_at - max(now, fresh_until)
+                if ttl > 0:
+                    value = decode_value(body)
+                    self.local.set(key, value, ttl, stale_ttl)
+                    self.hits += 1
+                    self.redis_hits += 1
+                    return value, False
+                if stale_value is MISS and stale_ttl > 0:
+                    stale_value = decode_value(body)
+                    self.local.set(key, stale_value, 0, stale_ttl)
+
+        if stale_value is not MISS:
+            self.stale_hits += 1
+            return stale_value, True
+
+        self.misses += 1
+        return MISS, False
+
+    async def get(self, key: str) -> Any:
+        """Свежее значение из кэша или MISS"""
+        value, stale = await self.get_entry(key)
+        return MISS if stale else value
+
+    async def set(self, key: str, value: Any, ttl: float, stale_ttl: float = 0):
+        """Сохранить значение в оба уровня: ttl секунд свежее, еще stale_ttl - устаревшее"""
+        self.local.set(key, value, ttl, stale_ttl)
+
+        if self._redis_available():
+            now = time.time()
+            # "<fresh_until> <expires_at>\n<значение>"
+            meta = f"{now + ttl} {now + ttl + stale_ttl}\n".encode('ascii')
+            try:
+                await self.redis.set(key, meta + encode_value(value), ex=max(1, int(ttl + stale_ttl)))
+            except Exception as e:
+                self._redis_failed(e)
+
+    async def close(self):
+        if self.redis is not None:
+            await self.redis.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики для /api/health"""
+        total = self.hits + self.stale_hits + self.misses
+        return {
+            'size': len(self.local),
+            'max_size': self.local.max_size,
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'hit_rate': round((self.hits + self.stale_hits) / total, 4) if total else 0.0,
+            'evictions': self.local.evictions,
+            'redis_enabled': self.redis is not None,
+            'redis_hits': self.redis_hits,
+            'redis_errors': self.redis_errors,
+        }
+
+
+class SingleFlight:
+    """Одновременные вызовы с одним ключом разделяют один запрос к апстриму"""
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            self.calls += 1
+            # Отдельная задача: отмена первого вызывающего не обрывает запрос остальным
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._inflight),
+        }
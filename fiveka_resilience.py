@@ -0,0 +1,227 @@
+"""Защита от деградации API 5ka.ru: circuit breaker и адаптивный лимит конкурентности"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class UpstreamUnavailable(Exception):
+    """5ka.ru сейчас не отвечает: сработал circuit breaker, лимит или апстрим вернул 5xx"""
+
+    def __init__(self, endpoint: str, reason: str):
+        super().__init__(f"{endpoint}: {reason}")
+        self.endpoint = endpoint
+        self.reason = reason
+
+
+class CircuitBreaker:
+    """Circuit breaker по скользящему окну последних вызовов.
+
+    Размыкается, когда в окне слишком много ошибок или слишком медленных
+    ответов. После open_seconds пропускает несколько пробных запросов
+    (half-open) и по их результату замыкается или снова размыкается.
+    """
+
+    def __init__(self, name: str, window_size: int = 20, min_calls: int = 10,
+                 error_rate: float = 0.5, slow_call_seconds: float = 3.0,
+                 slow_call_rate: float = 0.8, open_seconds: float = 30.0,
+                 half_open_calls: int = 3):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+
+        # (ошибка, медленный) для последних window_size вызовов
+        self._window = deque(maxlen=window_size)
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._half_open_in_flight = 0
+        self._half_open_successes = 0
+        # Номер текущего half-open: пробы прошлых периодов его счетчики не трогают
+        self._half_open_generation = 0
+        self.rejected = 0
+        self.state_changes = 0
+        self.last_state_change: Optional[str] = None
+
+    def _set_state(self, state: str):
+        logger.warning(f"Circuit breaker '{self.name}': {self.state} -> {state}")
+        self.state = state
+        self.state_changes += 1
+        self.last_state_change = datetime.now().isoformat()
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        elif state == HALF_OPEN:
+            self._half_open_generation += 1
+            self._half_open_in_flight = 0
+            self._half_open_successes = 0
+        else:
+            self._window.clear()
+
+    def allow_request(self) -> Optional[int]:
+        """Пропуск в апстрим для record: None - отказ, 0 - обычный вызов, иначе номер пробного периода"""
+        if self.state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._set_state(HALF_OPEN)
+
+        if self.state == CLOSED:
+            return 0
+        if self.state == HALF_OPEN and self._half_open_in_flight < self.half_open_calls:
+            self._half_open_in_flight += 1
+            return self._half_open_generation
+
+        self.rejected += 1
+        return None
+
+    def cancel(self, permit: int):
+        """Вызов с пропуском так и не состоялся: освободить место пробы"""
+        if permit and self.state == HALF_OPEN and permit == self._half_open_generation:
+            self._half_open_in_flight -= 1
+
+    def record(self, success: bool, latency: float, permit: int = 0):
+        """Учесть результат вызова с пропуском permit от allow_request"""
+        slow = latency >= self.slow_call_seconds
+
+        if permit:
+            # Проба: результат решает судьбу только своего half-open
+            if self.state != HALF_OPEN or permit != self._half_open_generation:
+                return
+            self._half_open_in_flight -= 1
+            if not success or slow:
+                self._set_state(OPEN)
+            else:
+                self._half_open_successes += 1
+                if self._half_open_successes >= self.half_open_calls:
+                    self._set_state(CLOSED)
+            return
+
+        if self.state != CLOSED:
+            return
+
+        self._window.append((not success, slow))
+        calls = len(self._window)
+        if calls < self.min_calls:
+            return
+        errors = sum(1 for failed, _ in self._window if failed)
+        slow_calls = sum(1 for _, is_slow in self._window if is_slow)
+        if errors / calls >= self.error_rate or slow_calls / calls >= self.slow_call_rate:
+            self._set_state(OPEN)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'rejected': self.rejected,
+            'state_changes': self.state_changes,
+            'last_state_change': self.last_state_change,
+        }
+
+
+class AdaptiveLimiter:
+    """Лимит одновременных запросов к апстриму в стиле AIMD.
+
+    Пока ответы успешные и не медленнее обычного, лимит растет примерно на
+    единицу за "окно" из limit запросов. Ошибка умножает лимит на backoff,
+    медленный ответ - мягко, на slow_backoff; одновременные сигналы одного
+    окна считаются одним снижением. Медленный - дольше latency_target и
+    дольше tolerance обычных задержек (минимума последних успешных), чтобы
+    привычная задержка 5ka.ru не опускала лимит. Запросы сверх лимита
+    ждут своей очереди не дольше timeout.
+    """
+
+    def __init__(self, name: str, initial_limit: float = 20, min_limit: float = 1,
+                 max_limit: float = 200, latency_target: float = 1.0, backoff: float = 0.5,
+                 slow_backoff: float = 0.9, tolerance: float = 2.0, latency_window: int = 100):
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.slow_backoff = slow_backoff
+        self.tolerance = tolerance
+        self._latencies = deque(maxlen=latency_window)
+        self._since_decrease = self.limit
+        self._waiters: deque = deque()
+        self.in_flight = 0
+        self.waited = 0
+        self.rejected = 0
+
+    async def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Занять слот; False, если за timeout слот не освободился"""
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return True
+        self.waited += 1
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return True
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                return True
+            self.rejected += 1
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Слот уже отдан, а запрос отменен - возвращаем
+                self.cancel()
+            raise
+        finally:
+            if not waiter.done() or waiter.cancelled():
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(True)
+
+    def cancel(self):
+        """Вернуть слот, если запрос так и не был отправлен"""
+        self.in_flight -= 1
+        self._wake()
+
+    def _decrease(self, factor: float):
+        if self._since_decrease < self.limit:
+            return
+        self._since_decrease = 0
+        self.limit = max(self.min_limit, self.limit * factor)
+
+    def release(self, success: bool, latency: float):
+        self.in_flight -= 1
+        self._since_decrease += 1
+        if not success:
+            self._decrease(self.backoff)
+        else:
+            self._latencies.append(latency)
+            usual = min(self._latencies)
+            if latency > max(self.latency_target, usual * self.tolerance):
+                self._decrease(self.slow_backoff)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._wake()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'limit': round(self.limit, 2),
+            'in_flight': self.in_flight,
+            'waiting': len(self._waiters),
+            'waited': self.waited,
+            'rejected': self.rejected,
+        }
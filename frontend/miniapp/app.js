@@ -0,0 +1,412 @@
+// Инициализация Telegram Web App
+const tg = window.Telegram.WebApp;
+tg.ready();
+
+// Применение темы Telegram
+document.body.style.backgroundColor = tg.themeParams.bg_color || '#ffffff';
+document.body.style.color = tg.themeParams.text_color || '#000000';
+
+// Сессия: сервер проверяет подпись initData один раз и выдает токен,
+// дальше запросы к корзине и адресу идут с ним. Без токена бота на
+// сервере вход недоступен, и пользователь остается demo_user
+let sessionToken = null;
+let sessionUserId = 'demo_user';
+let sessionPromise = null;
+
+function startSession() {
+    sessionPromise = fetch('/api/auth', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ init_data: tg.initData || '' })
+    }).then(async response => {
+        if (!response.ok) {
+            return;
+        }
+        const session = await response.json();
+        sessionToken = session.token;
+        sessionUserId = session.user_id;
+    }).catch(error => console.error('Error starting session:', error));
+    return sessionPromise;
+}
+
+async function apiFetch(url, options = {}) {
+    await (sessionPromise || startSession());
+    const send = () => fetch(url, {
+        ...options,
+        headers: {
+            ...(options.headers || {}),
+            ...(sessionToken ? { 'Authorization': `Bearer ${sessionToken}` } : {}),
+        }
+    });
+    let response = await send();
+    if (response.status === 401) {
+        // Токен истек: входим заново и повторяем запрос
+        sessionToken = null;
+        await startSession();
+        response = await send();
+    }
+    return response;
+}
+
+startSession();
+
+// Подсказки адреса на каждое нажатие: ответ приходит из памяти сервера,
+// устаревший запрос отменяем, чтобы не перетереть подсказки к новому вводу
+let suggestController = null;
+
+async function suggestAddress() {
+    const query = document.getElementById('address').value;
+    const list = document.getElementById('address-suggestions');
+
+    if (suggestController) {
+        suggestController.abort();
+    }
+    if (query.trim().length < 2) {
+        list.innerHTML = '';
+        return;
+    }
+
+    suggestController = new AbortController();
+    try {
+        const response = await fetch('/api/address/suggest?q=' + encodeURIComponent(query), {
+            signal: suggestController.signal
+        });
+        const result = await response.json();
+        list.innerHTML = '';
+        result.suggestions.forEach(address => {
+            const option = document.createElement('option');
+            option.value = address;
+            list.appendChild(option);
+        });
+    } catch (error) {
+        if (error.name !== 'AbortError') {
+            console.error('Error loading suggestions:', error);
+        }
+    }
+}
+
+document.getElementById('address').addEventListener('input', suggestAddress);
+
+async function submitAddress() {
+    const address = document.getElementById('address').value;
+    const comment = document.getElementById('comment').value;
+
+    if (!address.trim()) {
+        tg.showAlert('Пожалуйста, введите адрес');
+        return;
+    }
+
+    document.getElementById('address-form').style.display = 'none';
+    document.getElementById('loading').style.display = 'block';
+
+    try {
+        const response = await apiFetch('/api/set-address', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                address: address,
+                comment: comment
+            })
+        });
+
+        const result = await response.json();
+
+        if (result.success) {
+            await loadCatalog();
+        } else {
+            tg.showAlert('Ошибка: ' + result.message);
+            showAddressForm();
+        }
+    } catch (error) {
+        console.error('Error:', error);
+        tg.showAlert('Произошла ошибка при обработке запроса');
+        showAddressForm();
+    }
+}
+
+async function loadCatalog() {
+    try {
+        const response = await fetch('/api/categories');
+        const categories = await response.json();
+
+        document.getElementById('loading').style.display = 'none';
+        document.getElementById('content').style.display = 'block';
+
+        displayCategories(categories);
+    } catch (error) {
+        console.error('Error loading catalog:', error);
+        tg.showAlert('Ошибка загрузки каталога');
+    }
+}
+
+function displayCategories(categories) {
+    const content = document.getElementById('content');
+    let html = '<h2>Выберите категорию:</h2>';
+
+    categories.forEach(category => {
+        html += `
+            <div style="padding: 10px; margin: 10px 0; border: 1px solid #ddd; border-radius: 8px; cursor: pointer;"
+                 onclick="loadProducts(${category.id}, '${category.name}')">
+                <h3>${category.name}</h3>
+                <p style="color: #666; font-size: 14px;">${category.description || ''}</p>
+            </div>
+        `;
+    });
+
+    content.innerHTML = html;
+}
+
+// Следующая страница категории: курсор из прошлого ответа; сервер уже
+// подгрузил ее в кэш, пока показывалась текущая
+const PRODUCTS_PAGE_SIZE = 20;
+let productsCategory = null;
+let productsCursor = null;
+
+async function loadProducts(categoryId, categoryName) {
+    document.getElementById('loading').style.display = 'block';
+    document.getElementById('content').style.display = 'none';
+
+    try {
+        const response = await fetch(`/api/products?category_id=${categoryId}&limit=${PRODUCTS_PAGE_SIZE}`);
+        const data = await response.json();
+
+        document.getElementById('loading').style.display = 'none';
+        document.getElementById('content').style.display = 'block';
+
+        productsCategory = categoryId;
+        productsCursor = data.next_cursor;
+        displayProducts(data.products, categoryName);
+    } catch (error) {
+        console.error('Error loading products:', error);
+        tg.showAlert('Ошибка загрузки товаров');
+    }
+}
+
+async function loadMoreProducts() {
+    const button = document.getElementById('load-more');
+    button.disabled = true;
+
+    try {
+        const response = await fetch(`/api/products?category_id=${productsCategory}` +
+            `&limit=${PRODUCTS_PAGE_SIZE}&cursor=${encodeURIComponent(productsCursor)}`);
+        const data = await response.json();
+
+        productsCursor = data.next_cursor;
+        document.getElementById('product-list').insertAdjacentHTML('beforeend', renderProducts(data.products));
+        button.style.display = productsCursor ? 'block' : 'none';
+    } catch (error) {
+        console.error('Error loading products:', error);
+        tg.showAlert('Ошибка загрузки товаров');
+    } finally {
+        button.disabled = false;
+    }
+}
+
+function displayProducts(products, categoryName) {
+    const content = document.getElementById('content');
+    content.innerHTML = `
+        <div style="margin-bottom: 20px;">
+            <button onclick="loadCatalog()" style="width: auto; padding: 8px 16px; margin-right: 10px;">← Назад</button>
+            <h2>${categoryName}</h2>
+        </div>
+        <div id="product-list">${renderProducts(products)}</div>
+        <button id="load-more" onclick="loadMoreProducts()"
+                style="display: ${productsCursor ? 'block' : 'none'};">Показать еще</button>
+    `;
+}
+
+// Картинки идут через /img/ уменьшенными; v - хэш адреса оригинала,
+// поэтому ответ можно кэшировать навсегда, а новая картинка придет по новому адресу
+const THUMBNAIL_WIDTH = 60 * Math.min(Math.ceil(window.devicePixelRatio || 1), 3);
+
+function imageVersion(url) {
+    let hash = 5381;
+    for (let i = 0; i < url.length; i++) {
+        hash = ((hash * 33) ^ url.charCodeAt(i)) >>> 0;
+    }
+    return hash.toString(36);
+}
+
+function thumbnailUrl(product) {
+    // Подписанная сервером ссылка несет адрес оригинала: товар не ищется заново
+    if (product.thumbnail) {
+        return `${product.thumbnail}&w=${THUMBNAIL_WIDTH}`;
+    }
+    return `/img/${encodeURIComponent(product.id)}?w=${THUMBNAIL_WIDTH}&v=${imageVersion(product.image)}`;
+}
+
+function renderProducts(products) {
+    let html = '';
+    products.forEach(product => {
+        html += `
+            <div style="padding: 15px; margin: 10px 0; border: 1px solid #ddd; border-radius: 8px;">
+                <div style="display: flex; align-items: center;">
+                    ${product.image ? `<img src="${thumbnailUrl(product)}" width="60" height="60" loading="lazy" decoding="async" style="width: 60px; height: 60px; object-fit: cover; border-radius: 4px; margin-right: 15px;">` : ''}
+                    <div style="flex: 1;">
+                        <h3 style="margin-bottom: 5px;">${product.name}</h3>
+                        <p style="color: #666; font-size: 14px; margin-bottom: 10px;">${product.description || ''}</p>
+                        <div style="display: flex; justify-content: space-between; align-items: center;">
+                            <span style="font-size: 18px; font-weight: bold; color: #007AFF;">${product.price} ₽</span>
+                            <button onclick="addToCart('${product.id}', '${product.name}', ${product.price})"
+                                    style="width: auto; padding: 8px 16px; font-size: 14px;">
+                                В корзину
+                            </button>
+                        </div>
+                    </div>
+                </div>
+            </div>
+        `;
+    });
+
+    return html;
+}
+
+// Нажатия "В корзину" копятся и уходят одним пакетом в /api/cart/batch
+const CART_BATCH_DELAY = 300;
+let pendingCartOps = new Map();
+let cartFlushTimer = null;
+let cartFlushPromise = Promise.resolve();
+// Товары, которые уже лежат в корзине на сервере
+let cartProductIds = new Set();
+
+// Позиции корзины: повторное нажатие на товар из корзины новую не добавляет
+function cartItemCount() {
+    let count = cartProductIds.size;
+    pendingCartOps.forEach((operation, productId) => {
+        if (!cartProductIds.has(String(productId))) {
+            count += 1;
+        }
+    });
+    return count;
+}
+
+function setCartItems(items) {
+    cartProductIds = new Set(items.map(item => String(item.product_id)));
+}
+
+function addToCart(productId, productName, price) {
+    const pending = pendingCartOps.get(productId);
+    if (pending) {
+        pending.quantity += 1;
+    } else {
+        pendingCartOps.set(productId, {
+            op: 'add',
+            product_id: productId,
+            name: productName,
+            price: price,
+            quantity: 1
+        });
+    }
+
+    if (tg.HapticFeedback) {
+        tg.HapticFeedback.impactOccurred('light');
+    }
+    updateCartButton(cartItemCount());
+
+    clearTimeout(cartFlushTimer);
+    cartFlushTimer = setTimeout(flushCart, CART_BATCH_DELAY);
+}
+
+function flushCart() {
+    clearTimeout(cartFlushTimer);
+    if (pendingCartOps.size === 0) {
+        return cartFlushPromise;
+    }
+
+    const operations = Array.from(pendingCartOps.values());
+    pendingCartOps = new Map();
+
+    // Пакеты отправляются строго по очереди
+    cartFlushPromise = cartFlushPromise.then(async () => {
+        try {
+            const response = await apiFetch('/api/cart/batch', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({
+                    operations: operations
+                })
+            });
+
+            const result = await response.json();
+
+            if (result.success) {
+                setCartItems(result.cart.items);
+                updateCartButton(cartItemCount());
+            } else {
+                tg.showAlert('Ошибка добавления в корзину');
+            }
+        } catch (error) {
+            console.error('Error adding to cart:', error);
+            tg.showAlert('Ошибка добавления в корзину');
+        }
+    });
+    return cartFlushPromise;
+}
+
+function updateCartButton(count) {
+    tg.MainButton.setText(`Корзина (${count})`);
+    tg.MainButton.show();
+}
+
+tg.MainButton.onClick(() => showCart());
+
+async function showCart() {
+    try {
+        await flushCart();
+
+        const response = await apiFetch(`/api/cart/${sessionUserId}`);
+        const cart = await response.json();
+
+        setCartItems(cart.items || []);
+
+        let html = '<h2>Корзина</h2>';
+
+        if (cart.items && cart.items.length > 0) {
+            cart.items.forEach(item => {
+                html += `
+                    <div style="padding: 10px; margin: 10px 0; border: 1px solid #ddd; border-radius: 8px;">
+                        <div style="display: flex; justify-content: space-between; align-items: center;">
+                            <div>
+                                <h4>${item.name}</h4>
+                                <p>Количество: ${item.quantity}</p>
+                            </div>
+                            <div style="text-align: right;">
+                                <p style="font-weight: bold;">${item.price * item.quantity} ₽</p>
+                            </div>
+                        </div>
+                    </div>
+                `;
+            });
+
+            html += `
+                <div style="margin-top: 20px; padding: 15px; background: #f5f5f5; border-radius: 8px;">
+                    <h3>Итого: ${cart.total_price} ₽</h3>
+                    <button onclick="checkout()" style="margin-top: 10px;">Оформить заказ</button>
+                </div>
+            `;
+        } else {
+            html += '<p>Корзина пуста</p>';
+        }
+
+        document.getElementById('content').innerHTML = html;
+    } catch (error) {
+        console.error('Error loading cart:', error);
+        tg.showAlert('Ошибка загрузки корзины');
+    }
+}
+
+function showAddressForm() {
+    document.getElementById('address-form').style.display = 'block';
+    document.getElementById('loading').style.display = 'none';
+    document.getElementById('content').style.display = 'none';
+}
+
+function checkout() {
+    tg.showAlert('Функция оформления заказа будет добавлена позже');
+}
@@ -0,0 +1,19 @@
+// Инициализация Telegram Web App
+if (window.Telegram && window.Telegram.WebApp) {
+    const tg = window.Telegram.WebApp;
+    tg.ready();
+    console.log('Telegram WebApp initialized');
+
+    // Применяем тему Telegram
+    document.body.style.backgroundColor = tg.themeParams.bg_color || '#ffffff';
+    document.body.style.color = tg.themeParams.text_color || '#000000';
+}
+
+function searchStores() {
+    const address = document.getElementById('address').value;
+    if (address) {
+        alert('Поиск магазинов для адреса: ' + address);
+    } else {
+        alert('Введите адрес для поиска');
+    }
+}
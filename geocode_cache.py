@@ -0,0 +1,216 @@
+"""Кэш результатов геокодирования по нормализованному адресу.
+
+"Москва, ул. Тверская, д.15" и "москва улица тверская дом 15" дают один
+ключ, поэтому повторная отправка адреса в другом написании не ходит в 5ka.ru.
+Горячие адреса лежат в LRU в памяти, все остальные - в SQLite на диске.
+"""
+
+import asyncio
+import json
+import logging
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import local_db
+from fiveka_cache import MISS
+
+logger = logging.getLogger(__name__)
+
+# Сокращения в адресах -> полная форма
+ADDRESS_ABBREVIATIONS = {
+    'г': 'город',
+    'гор': 'город',
+    'обл': 'область',
+    'р-н': 'район',
+    'мкр': 'микрорайон',
+    'мкрн': 'микрорайон',
+    'ул': 'улица',
+    'пр': 'проспект',
+    'пр-т': 'проспект',
+    'просп': 'проспект',
+    'пер': 'переулок',
+    'пл': 'площадь',
+    'ш': 'шоссе',
+    'наб': 'набережная',
+    'б-р': 'бульвар',
+    'бул': 'бульвар',
+    'туп': 'тупик',
+    'проезд': 'проезд',
+    'д': 'дом',
+    'к': 'корпус',
+    'корп': 'корпус',
+    'стр': 'строение',
+    'кв': 'квартира',
+}
+
+_SEPARATORS = re.compile(r'[\s,.;:()"«»]+')
+# "д.15" и "15к2" -> "д 15", "15 к 2"
+_LETTER_DIGIT = re.compile(r'(?<=[^\W\d_])(?=\d)|(?<=\d)(?=[^\W\d_])')
+
+
+def normalize_address(address: str) -> str:
+    """Канонический вид адреса для ключа кэша"""
+    text = address.casefold().replace('ё', 'е')
+    tokens = []
+    for token in _SEPARATORS.split(text):
+        if not token:
+            continue
+        for part in _LETTER_DIGIT.sub(' ', token).split():
+            tokens.append(ADDRESS_ABBREVIATIONS.get(part, part))
+    return ' '.join(tokens)
+
+
+class GeocodeCache:
+    """LRU в памяти поверх таблицы SQLite"""
+
+    def __init__(self, db_path: Optional[Path] = None, max_size: int = 10000,
+                 max_age: float = 30 * 24 * 3600):
+        self.max_size = max_size
+        self.max_age = max_age
+        self._memory: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._connection = local_db.connect(db_path)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS geocode_cache ('
+                ' normalized TEXT PRIMARY KEY,'
+                ' address TEXT NOT NULL,'
+                ' data TEXT NOT NULL,'
+                ' updated_at REAL NOT NULL)'
+            )
+            # Сколько раз адрес выбирали: общий для всех воркеров вес подсказок
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS address_uses ('
+                ' normalized TEXT PRIMARY KEY,'
+                ' uses INTEGER NOT NULL)'
+            )
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _remember(self, key: str, updated_at: float, data: Any):
+        self._memory[key] = (updated_at, data)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key: str):
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT updated_at, data FROM geocode_cache WHERE normalized = ?', (key,)
+            ).fetchone()
+        return row
+
+    def _write_disk(self, rows: Iterable[Tuple[str, str, str, float]]):
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO geocode_cache (normalized, address, data, updated_at) '
+                'VALUES (?, ?, ?, ?)',
+                rows
+            )
+
+    async def get(self, address: str) -> Any:
+        """Результат геокодирования или MISS"""
+        key = normalize_address(address)
+        oldest = time.time() - self.max_age
+
+        entry = self._memory.get(key)
+        if entry is not None and entry[0] >= oldest:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return entry[1]
+
+        row = await asyncio.to_thread(self._read_disk, key)
+        if row is not None and row[0] >= oldest:
+            data = json.loads(row[1])
+            self._remember(key, row[0], data)
+            self.disk_hits += 1
+            return data
+
+        self.misses += 1
+        return MISS
+
+    async def set(self, address: str, data: Any):
+        """Запомнить удачный результат геокодирования"""
+        key = normalize_address(address)
+        updated_at = time.time()
+        self._remember(key, updated_at, data)
+        await asyncio.to_thread(
+            self._write_disk, [(key, address, json.dumps(data, ensure_ascii=False), updated_at)]
+        )
+
+    def warm_from_file(self, path: Path) -> int:
+        """Загрузить адреса из JSON Lines {"address": ..., "data": ...} или JSON-словаря"""
+        path = Path(path)
+        text = path.read_text(encoding='utf-8')
+        if path.suffix == '.json':
+            entries = [{'address': address, 'data': data} for address, data in json.loads(text).items()]
+        else:
+            entries = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+        updated_at = time.time()
+        rows = []
+        for entry in entries:
+            if not entry.get('data'):
+                continue
+            key = normalize_address(entry['address'])
+            rows.append((key, entry['address'], json.dumps(entry['data'], ensure_ascii=False), updated_at))
+            self._remember(key, updated_at, entry['data'])
+        self._write_disk(rows)
+        logger.info(f"Geocode cache warmed with {len(rows)} addresses from {path}")
+        return len(rows)
+
+    def addresses(self) -> List[str]:
+        """Все адреса, которые удалось геокодировать (для подсказок)"""
+        with self._lock:
+            rows = self._connection.execute('SELECT address FROM geocode_cache').fetchall()
+        return [row[0] for row in rows]
+
+    def record_use(self, address: str):
+        """Пользователь выбрал адрес: поднять его в подсказках всех воркеров"""
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT INTO address_uses (normalized, uses) VALUES (?, 1) '
+                'ON CONFLICT(normalized) DO UPDATE SET uses = uses + 1',
+                (normalize_address(address),)
+            )
+
+    def address_weights(self) -> List[Tuple[str, int]]:
+        """(адрес, вес) для подсказок: 1 за геокодирование плюс число выборов"""
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT c.address, 1 + COALESCE(u.uses, 0) FROM geocode_cache c '
+                'LEFT JOIN address_uses u ON u.normalized = c.normalized'
+            ).fetchall()
+        return [(address, weight) for address, weight in rows]
+
+    def close(self):
+        self._connection.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики для /api/health"""
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {
+            'memory_size': len(self._memory),
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': round(hits / total, 4) if total else 0.0,
+        }
+
+
+if __name__ == "__main__":
+    # python geocode_cache.py addresses.jsonl - прогреть кэш из файла
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 2:
+        print("Использование: python geocode_cache.py <addresses.jsonl|addresses.json>")
+        sys.exit(1)
+    cache = GeocodeCache()
+    cache.warm_from_file(Path(sys.argv[1]))
+    cache.close()
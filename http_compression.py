@@ -0,0 +1,132 @@
+"""Сжатие HTTP-ответов: выбор кодировки по Accept-Encoding, gzip и brotli"""
+
+import gzip
+from typing import Dict, Iterable, Optional
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен, тогда отдаем gzip
+    brotli = None
+
+GZIP = 'gzip'
+BROTLI = 'br'
+
+# Кодировки в порядке предпочтения сервера
+SUPPORTED_ENCODINGS = (BROTLI, GZIP) if brotli is not None else (GZIP,)
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """Accept-Encoding -> {кодировка: q}"""
+    accepted = {}
+    for part in (header or '').split(','):
+        token, _, params = part.strip().partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token] = q
+    return accepted
+
+
+def choose_encoding(header: Optional[str], available: Iterable[str] = SUPPORTED_ENCODINGS) -> Optional[str]:
+    """Лучшая кодировка из available, которую принимает клиент, или None"""
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get('*', 0.0)
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = accepted.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    """Сжать тело ответа; level=None - максимальное сжатие для статики"""
+    if encoding == BROTLI:
+        return brotli.compress(body, quality=11 if level is None else level)
+    if encoding == GZIP:
+        return gzip.compress(body, compresslevel=9 if level is None else level, mtime=0)
+    raise ValueError(f"Неподдерживаемая кодировка: {encoding}")
+
+
+# Типы ответов, которые имеет смысл сжимать
+COMPRESSIBLE_TYPES = ('application/json', 'text/', 'application/javascript')
+
+
+class CompressionMiddleware:
+    """ASGI middleware: сжимает ответы brotli/gzip по Accept-Encoding.
+
+    Сжимаются только ответы, целиком пришедшие одним куском, размером от
+    minimum_size байт и с подходящим Content-Type; стриминг и уже сжатые
+    ответы проходят как есть.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.levels = {GZIP: gzip_level, BROTLI: brotli_quality}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = None
+        for name, value in scope.get('headers', []):
+            if name == b'accept-encoding':
+                accept_encoding = value.decode('latin-1')
+                break
+        encoding = choose_encoding(accept_encoding)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+
+        async def send_compressed(message):
+            nonlocal start_message
+            if message['type'] == 'http.response.start':
+                # Заголовки придержим до первого куска тела
+                start_message = message
+                return
+            if message['type'] != 'http.response.body' or start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            body = message.get('body', b'')
+            headers = list(start['headers'])
+            if message.get('more_body', False) or not self._should_compress(headers, body):
+                await send(start)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding, self.levels[encoding])
+            headers = [(name, value) for name, value in headers if name != b'content-length']
+            headers += [
+                (b'content-encoding', encoding.encode('latin-1')),
+                (b'content-length', str(len(compressed)).encode('latin-1')),
+                (b'vary', b'Accept-Encoding'),
+            ]
+            await send({**start, 'headers': headers})
+            await send({**message, 'body': compressed})
+
+        await self.app(scope, receive, send_compressed)
+
+    def _should_compress(self, headers, body: bytes) -> bool:
+        if len(body) < self.minimum_size:
+            return False
+        content_type = b''
+        for name, value in headers:
+            if name == b'content-encoding':
+                return False
+            if name == b'content-type':
+                content_type = value
+        content_type = content_type.decode('latin-1')
+        return any(content_type.startswith(prefix) for prefix in COMPRESSIBLE_TYPES)
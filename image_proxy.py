@@ -0,0 +1,291 @@
+"""Уменьшенные картинки товаров.
+
+Картинка с 5ka.ru скачивается один раз, уменьшается Pillow до одной из
+фиксированных ширин и перекодируется в WebP (или JPEG для браузеров без
+WebP). Оригинал и все варианты лежат в дисковом LRU-кэше с ограничением
+по суммарному размеру. Имена файлов в кэше - от хэша адреса оригинала,
+поэтому новая картинка товара не смешивается со старой. Адрес оригинала
+приходит в подписанной ссылке (ImageLinks), без запроса товара в 5ka.ru.
+"""
+
+import base64
+import hashlib
+import hmac
+import io
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow необязателен: без него отправляем на оригинал
+    Image = None
+
+PILLOW_AVAILABLE = Image is not None
+
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def image_digest(url: str) -> str:
+    return hashlib.blake2b(url.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def image_version(url: str) -> str:
+    """Версия адреса картинки, как ее считает фронтенд (imageVersion в app.js).
+
+    djb2 с xor по кодам UTF-16, 32 бита без знака, в base36.
+    """
+    value = 5381
+    data = url.encode('utf-16-le')
+    for i in range(0, len(data), 2):
+        value = ((value * 33) ^ (data[i] | data[i + 1] << 8)) & 0xFFFFFFFF
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    version = ''
+    while True:
+        value, digit = divmod(value, 36)
+        version = digits[digit] + version
+        if not value:
+            return version
+
+
+def product_image_url(product: Dict[str, Any]) -> Optional[str]:
+    """Адрес картинки товара из ответа 5ka.ru или каталога"""
+    for key in ('image', 'image_url', 'img_link'):
+        value = product.get(key)
+        if isinstance(value, str) and value.startswith(('http://', 'https://')):
+            return value
+    images = product.get('images')
+    if isinstance(images, list) and images:
+        first = images[0]
+        if isinstance(first, dict):
+            first = first.get('url') or first.get('src')
+        if isinstance(first, str) and first.startswith(('http://', 'https://')):
+            return first
+    return None
+
+
+def snap_width(width: Optional[int], widths: Tuple[int, ...]) -> int:
+    """Ближайшая разрешенная ширина не меньше запрошенной: вариантов конечное число"""
+    if not width:
+        return widths[0]
+    for allowed in widths:
+        if allowed >= width:
+            return allowed
+    return widths[-1]
+
+
+def choose_format(accept: Optional[str]) -> str:
+    return 'webp' if accept and 'image/webp' in accept else 'jpeg'
+
+
+def resize_image(data: bytes, width: int, fmt: str) -> bytes:
+    """Уменьшить картинку до ширины width (не увеличивая) и перекодировать"""
+    pil_format, _, options = FORMATS[fmt]
+    with Image.open(io.BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source)
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+        if fmt == 'jpeg' or image.mode not in ('RGB', 'RGBA'):
+            # В JPEG нет прозрачности: подкладываем белый фон
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            else:
+                image = image.convert('RGB')
+        output = io.BytesIO()
+        image.save(output, pil_format, **options)
+    return output.getvalue()
+
+
+class ImageCache:
+    """Дисковый LRU: файлы в каталоге, суммарный размер не больше max_bytes.
+
+    Каталог общий для всех воркеров, поэтому размер и порядок вытеснения
+    берутся из него самого: время изменения файла - время последнего
+    обращения. Между сканированиями воркер учитывает только свои записи;
+    каталог пересканируется, когда по этой оценке лимит превышен, и не
+    реже раза в scan_interval секунд.
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int = 256 * 2**20, scan_interval: float = 30.0,
+                 low_watermark: float = 0.9):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.scan_interval = scan_interval
+        # Вытесняем с запасом, чтобы не сканировать каталог на каждой записи
+        self.low_watermark = low_watermark
+        self._lock = threading.Lock()
+        self._scanned_at = 0.0
+        self.files = 0
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.scans = 0
+        self._evict()
+
+    def _entries(self):
+        entries = []
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if entry.name.startswith('.'):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, entry.name, stat.st_size))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _evict(self):
+        """Пересчитать размер по каталогу и удалить самые давно не читавшиеся файлы"""
+        entries = sorted(self._entries())
+        size = sum(entry[2] for entry in entries)
+        files = len(entries)
+        evicted = 0
+        if size > self.max_bytes:
+            target = self.max_bytes * self.low_watermark
+            for _, name, file_size in entries[:-1]:
+                if size <= target:
+                    break
+                try:
+                    (self.cache_dir / name).unlink()
+                except FileNotFoundError:
+                    pass
+                # Файл мог удалить другой воркер: в любом случае его больше нет
+                size -= file_size
+                files -= 1
+                evicted += 1
+        with self._lock:
+            self.size = size
+            self.files = files
+            self.evictions += evicted
+            self.scans += 1
+            self._scanned_at = time.monotonic()
+
+    def get(self, name: str) -> Optional[bytes]:
+        path = self.cache_dir / name
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            # Файл мог удалить другой воркер при вытеснении
+            with self._lock:
+                self.misses += 1
+            return None
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, name: str, data: bytes):
+        """Записать файл атомарно и вытеснить самые старые, если не помещаемся"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self.cache_dir / name
+        tmp = path.with_name(f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self.size += len(data)
+            self.files += 1
+            due = self.size > self.max_bytes or time.monotonic() - self._scanned_at > self.scan_interval
+        if due:
+            self._evict()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'files': self.files,
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'scans': self.scans,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class ImageLinks:
+    """Ссылки /img/ с адресом оригинала и подписью.
+
+    Адрес картинки едет в самой ссылке, поэтому серверу не нужно искать
+    товар; подпись не дает проксировать через /img/ произвольные адреса.
+    Секрет должен быть одинаковым во всех воркерах.
+    """
+
+    def __init__(self, secret: str):
+        self._key = secret.encode('utf-8')
+
+    def sign(self, product_id: str, source_url: str) -> str:
+        digest = hmac.new(self._key, f"{product_id}\n{source_url}".encode('utf-8'), hashlib.sha256).digest()[:12]
+        return base64.urlsafe_b64encode(digest).decode('ascii')
+
+    def verify(self, product_id: str, source_url: str, signature: str) -> bool:
+        return hmac.compare_digest(self.sign(product_id, source_url), signature)
+
+    def link(self, product_id: str, source_url: str) -> str:
+        """/img/<id>?src=...&sig=...; ширину клиент дописывает сам"""
+        return (f"/img/{quote(str(product_id), safe='')}?src={quote(source_url, safe='')}"
+                f"&sig={self.sign(str(product_id), source_url)}")
+
+    def with_thumbnails(self, products: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Копии товаров с полем thumbnail у тех, у кого есть картинка"""
+        result = []
+        for product in products:
+            source_url = product_image_url(product) if product.get('id') is not None else None
+            if source_url is not None:
+                product = {**product, 'thumbnail': self.link(product['id'], source_url)}
+            result.append(product)
+        return result
+
+
+def image_links_from_env() -> Optional[ImageLinks]:
+    """ImageLinks с секретом IMAGE_URL_SECRET (по умолчанию - из SESSION_SECRET или токена бота)"""
+    secret = os.getenv('IMAGE_URL_SECRET') or os.getenv('SESSION_SECRET')
+    if not secret:
+        token = os.getenv('TELEGRAM_BOT_TOKEN')
+        if not token:
+            return None
+        secret = hashlib.sha256(f"images:{token}".encode('utf-8')).hexdigest()
+    return ImageLinks(secret)
+
+
+class ImageProxy:
+    """Варианты картинок: из дискового кэша или из оригинала, скачанного один раз"""
+
+    def __init__(self, cache: ImageCache, widths: Iterable[int] = (60, 120, 240, 480)):
+        self.cache = cache
+        self.widths = tuple(sorted(set(widths)))
+        self.resized = 0
+
+    def variant_name(self, source_url: str, width: int, fmt: str) -> str:
+        return f"{image_digest(source_url)}-{width}.{fmt}"
+
+    def source_name(self, source_url: str) -> str:
+        return f"{image_digest(source_url)}.src"
+
+    def render(self, source_url: str, original: bytes, width: int, fmt: str) -> bytes:
+        """Уменьшить оригинал и положить вариант в кэш"""
+        data = resize_image(original, width, fmt)
+        self.cache.put(self.variant_name(source_url, width, fmt), data)
+        self.resized += 1
+        return data
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.cache.stats(), 'resized': self.resized, 'pillow': PILLOW_AVAILABLE}
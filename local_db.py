@@ -0,0 +1,29 @@
+"""Локальная SQLite-база приложения (кэш геокодера, снимки каталога)"""
+
+import os
+import sqlite3
+from pathlib import Path
+
+DEFAULT_SQLITE_PATH = './fiveka.db'
+
+
+def sqlite_path(database_url: str = None) -> Path:
+    """Путь к файлу SQLite из DATABASE_URL=sqlite:///./fiveka.db.
+
+    Если DATABASE_URL указывает на другую СУБД, берем SQLITE_PATH
+    или ./fiveka.db - локальные кэши всегда живут в SQLite.
+    """
+    database_url = database_url if database_url is not None else os.getenv('DATABASE_URL', '')
+    if database_url.startswith('sqlite:///'):
+        return Path(database_url[len('sqlite:///'):])
+    return Path(os.getenv('SQLITE_PATH', DEFAULT_SQLITE_PATH))
+
+
+def connect(path: Path = None) -> sqlite3.Connection:
+    """Соединение с WAL: читатели из разных воркеров не блокируют писателя"""
+    path = Path(path) if path is not None else sqlite_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(str(path), timeout=10, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    return connection
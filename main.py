@@ -1,10 +1,64 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import FastAPI, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+import asyncio
+import httpx
 import uvicorn
 import os
 
-app = FastAPI(title="5ka Telegram Mini App", version="1.0.0")
+from webapp_shell import FRONTEND_DIR, STATIC_DIR, ImmutableStaticFiles, ShellPage
+from store_index import StoreDirectory, http_store_fetcher, parse_areas
+from telegram_webhook import webhook_from_env
+
+# Магазины, если снимок справочника еще не создан
+DEFAULT_STORES = [
+    {
+        "id": "1",
+        "name": "Пятёрочка на Тверской",
+        "address": "ул. Тверская, 15",
+        "coordinates": [37.6176, 55.7558],
+        "working_hours": "08:00-23:00"
+    },
+    {
+        "id": "2",
+        "name": "Пятёрочка на Арбате",
+        "address": "ул. Арбат, 25",
+        "coordinates": [37.6001, 55.7522],
+        "working_hours": "08:00-22:00"
+    }
+]
+
+# Справочник магазинов в памяти, перечитывается из снимка на диске
+store_directory = StoreDirectory(
+    os.getenv("STORES_SNAPSHOT", "data/stores.json"),
+    default_stores=DEFAULT_STORES
+)
+STORES_REFRESH_INTERVAL = float(os.getenv("STORES_REFRESH_INTERVAL", 300))
+# Области, которые фоново перезапрашиваются у 5ka.ru, и как часто (секунды)
+STORES_REFRESH_AREAS = parse_areas(os.getenv("STORES_REFRESH_AREAS", "55.7558,37.6176,30000"))
+STORES_REFRESH_AGE = float(os.getenv("STORES_REFRESH_AGE", 6 * 3600))
+FIVEKA_API_URL = os.getenv("FIVEKA_API_URL", "https://5ka.ru/api")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    client = httpx.AsyncClient(timeout=10, headers={"Accept": "application/json"})
+    refresh_task = asyncio.create_task(store_directory.run_refresh(
+        STORES_REFRESH_INTERVAL, fetch=http_store_fetcher(client, FIVEKA_API_URL),
+        areas=STORES_REFRESH_AREAS, refresh_age=STORES_REFRESH_AGE
+    ))
+    if bot_webhook is not None:
+        await bot_webhook.start()
+    yield
+    if bot_webhook is not None:
+        await bot_webhook.stop()
+    refresh_task.cancel()
+    await client.aclose()
+
+
+app = FastAPI(title="5ka Telegram Mini App", version="1.0.0", lifespan=lifespan)
 
 # CORS для Telegram Mini App
 app.add_middleware(
@@ -15,97 +69,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Telegram-бот в режиме webhook: обновления принимает это же приложение
+bot_webhook = webhook_from_env()
+if bot_webhook is not None:
+    bot_webhook.mount(app)
+
+
+# Страница собирается один раз при старте воркера
+status_shell = ShellPage.build(FRONTEND_DIR / 'status')
+app.mount("/static", ImmutableStaticFiles(directory=STATIC_DIR), name="static")
+
 
 @app.get("/")
-async def root():
-    html_content = '''
-    <!DOCTYPE html>
-    <html lang="ru">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>5ka Mini App</title>
-        <script src="https://telegram.org/js/telegram-web-app.js"></script>
-        <style>
-            body { 
-                font-family: -apple-system, BlinkMacSystemFont, sans-serif;
-                margin: 0; padding: 20px;
-                background: var(--tg-theme-bg-color, #ffffff);
-                color: var(--tg-theme-text-color, #000000);
-            }
-            .container { max-width: 400px; margin: 0 auto; }
-            h1 { text-align: center; color: #007AFF; }
-            .status { 
-                padding: 15px; background: #f0f8ff; 
-                border-radius: 8px; margin: 20px 0; 
-            }
-            button {
-                width: 100%;
-                padding: 12px;
-                background: #007AFF;
-                color: white;
-                border: none;
-                border-radius: 8px;
-                font-size: 16px;
-                cursor: pointer;
-                margin: 10px 0;
-            }
-            input {
-                width: 100%;
-                padding: 12px;
-                border: 1px solid #ddd;
-                border-radius: 8px;
-                margin: 10px 0;
-                box-sizing: border-box;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>🛒 5ka Mini App</h1>
-            <div class="status">
-                <h3>✅ Сервер работает!</h3>
-                <p>📱 Telegram Mini App готов к работе</p>
-
-                <div style="margin-top: 20px;">
-                    <h4>🏪 Поиск магазинов:</h4>
-                    <input type="text" id="address" placeholder="Введите адрес" />
-                    <button onclick="searchStores()">Найти магазины</button>
-                </div>
-
-                <div style="margin-top: 20px;">
-                    <h4>📚 Ссылки:</h4>
-                    <p>📋 <a href="/docs" target="_blank">API Документация</a></p>
-                    <p>🔧 <a href="/api/health" target="_blank">Health Check</a></p>
-                </div>
-            </div>
-        </div>
-
-        <script>
-            // Инициализация Telegram Web App
-            if (window.Telegram && window.Telegram.WebApp) {
-                const tg = window.Telegram.WebApp;
-                tg.ready();
-                console.log('Telegram WebApp initialized');
-
-                // Применяем тему Telegram
-                document.body.style.backgroundColor = tg.themeParams.bg_color || '#ffffff';
-                document.body.style.color = tg.themeParams.text_color || '#000000';
-            }
-
-            function searchStores() {
-                const address = document.getElementById('address').value;
-                if (address) {
-                    alert('Поиск магазинов для адреса: ' + address);
-                } else {
-                    alert('Введите адрес для поиска');
-                }
-            }
-        </script>
-    </body>
-    </html>
-    '''
-    return HTMLResponse(content=html_content)
+async def root(request: Request):
+    return status_shell.response(request)
 
 
 @app.get("/api/health")
@@ -118,24 +95,21 @@ async def health_check():
 
 
 @app.get("/api/stores")
-async def get_stores():
-    # Заглушка для магазинов
+async def get_stores(
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lon: Optional[float] = Query(None, ge=-180, le=180),
+    radius: float = Query(5000, gt=0, le=100000),
+    limit: int = Query(20, ge=1, le=100)
+):
+    # Без координат - просто первые магазины справочника
+    if lat is None or lon is None:
+        return {"stores": store_directory.index.stores[:limit]}
+
+    nearest = store_directory.index.nearest(lat, lon, limit=limit, radius=radius)
     return {
         "stores": [
-            {
-                "id": "1",
-                "name": "Пятёрочка на Тверской",
-                "address": "ул. Тверская, 15",
-                "coordinates": [37.6176, 55.7558],
-                "working_hours": "08:00-23:00"
-            },
-            {
-                "id": "2",
-                "name": "Пятёрочка на Арбате",
-                "address": "ул. Арбат, 25",
-                "coordinates": [37.6001, 55.7522],
-                "working_hours": "08:00-22:00"
-            }
+            {**store, "distance": round(distance)}
+            for distance, store in nearest
         ]
     }
 
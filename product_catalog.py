@@ -0,0 +1,431 @@
+"""Компактное колоночное представление каталога товаров.
+
+Вместо списка словарей из response.json() товары хранятся по колонкам:
+числа - в array (8 байт на значение вместо объекта float/int и слота
+словаря), строки одной колонки - одним UTF-8 буфером с таблицей смещений,
+повторяющиеся названия категорий - номерами в таблице значений. Фильтры и
+сортировка идут по колонкам; с numpy - векторно поверх тех же буферов.
+
+Каталог сохраняется в бинарный файл из тех же колонок фиксированной ширины
+(save) и открывается через mmap без копирования (open): воркеры uvicorn
+делят одни и те же страницы файла в page cache.
+"""
+
+import math
+import mmap
+import os
+import struct
+import sys
+from array import array
+from pathlib import Path
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # numpy необязателен, тогда фильтры на чистом Python
+    np = None
+
+NO_CATEGORY = -1
+# Цена неизвестна: при сортировке по цене такие товары оказываются в конце
+NO_PRICE = math.inf
+
+SORT_KEYS = ('relevance', 'price', '-price', 'name', 'discount')
+
+# Формат файла: MAGIC, порядок байт, число секций, таблица секций
+# (имя, смещение, длина), затем секции, выровненные по 8 байт
+CATALOG_MAGIC = b'5KACAT01'
+_HEADER = struct.Struct('<8s8sI')
+_SECTION = struct.Struct('<32sQQ')
+# Секции файла: атрибут каталога (через точку - вложенный) и тип элементов
+CATALOG_SECTIONS = (
+    ('prices', 'd'),
+    ('old_prices', 'd'),
+    ('category_ids', 'q'),
+    ('promo', 'B'),
+    ('id_order', 'I'),
+    ('category_keys', 'q'),
+    ('category_order', 'I'),
+    ('category_starts', 'I'),
+    ('ids.offsets', 'I'),
+    ('ids.data', 'B'),
+    ('names.offsets', 'I'),
+    ('names.data', 'B'),
+    ('descriptions.offsets', 'I'),
+    ('descriptions.data', 'B'),
+    ('images.offsets', 'I'),
+    ('images.data', 'B'),
+    ('category_names.codes', 'I'),
+    ('category_names.values.offsets', 'I'),
+    ('category_names.values.data', 'B'),
+)
+
+
+def _number(value: Any) -> Optional[float]:
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(number) else number
+
+
+def product_prices(product: Dict[str, Any]):
+    """(текущая цена, обычная цена или None) из любого из встречающихся форматов"""
+    price = _number(product.get('price'))
+    old_price = _number(product.get('old_price') or product.get('regular_price'))
+    prices = product.get('current_prices')
+    if isinstance(prices, dict):
+        promo = _number(prices.get('price_promo__min'))
+        regular = _number(prices.get('price_reg__min'))
+        if price is None:
+            price = promo if promo is not None else regular
+        if old_price is None and promo is not None:
+            old_price = regular
+    return price, old_price
+
+
+def product_available(product: Dict[str, Any]) -> bool:
+    """Есть ли товар в продаже; без явных признаков считаем, что есть"""
+    for key in ('available', 'is_available', 'in_stock'):
+        if key in product:
+            return bool(product[key])
+    for key in ('stock', 'quantity', 'balance'):
+        amount = _number(product.get(key))
+        if amount is not None:
+            return amount > 0
+    return True
+
+
+def _category_id(product: Dict[str, Any]) -> int:
+    try:
+        return int(product.get('category_id'))
+    except (TypeError, ValueError):
+        return NO_CATEGORY
+
+
+class StringColumn:
+    """Строки одним UTF-8 буфером: строка i - data[offsets[i]:offsets[i + 1]]"""
+
+    __slots__ = ('data', 'offsets')
+
+    def __init__(self, values: Iterable[str] = (), data=None, offsets=None):
+        if data is not None:
+            self.data = data
+            self.offsets = offsets
+            return
+        buffer = bytearray()
+        self.offsets = array('I', [0])
+        for value in values:
+            buffer += value.encode('utf-8')
+            self.offsets.append(len(buffer))
+        self.data = bytes(buffer)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return str(self.data[self.offsets[i]:self.offsets[i + 1]], 'utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def nbytes(self) -> int:
+        return len(self.data) + self.offsets.itemsize * len(self.offsets)
+
+
+class CodedColumn:
+    """Повторяющиеся строки: номер значения на строку плюс таблица различных значений"""
+
+    __slots__ = ('codes', 'values')
+
+    def __init__(self, codes, values: StringColumn):
+        self.codes = codes
+        self.values = values
+
+    @classmethod
+    def build(cls, items: Iterable[str]) -> 'CodedColumn':
+        numbers: Dict[str, int] = {}
+        codes = array('I', (numbers.setdefault(item, len(numbers)) for item in items))
+        return cls(codes, StringColumn(numbers))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i: int) -> str:
+        return self.values[self.codes[i]]
+
+    def nbytes(self) -> int:
+        return self.codes.itemsize * len(self.codes) + self.values.nbytes()
+
+
+class ProductCatalog:
+    """Неизменяемый каталог: строка i - i-й товар во всех колонках.
+
+    Колонки - array или memoryview поверх файла, отображенного в память
+    (см. save и open): во втором случае все воркеры делят одни страницы.
+    """
+
+    def __init__(self, products: Iterable[Dict[str, Any]] = ()):
+        ids, names, descriptions, images, categories = [], [], [], [], []
+        self.prices = array('d')
+        # 0 - у товара нет обычной (зачеркнутой) цены
+        self.old_prices = array('d')
+        self.category_ids = array('q')
+        self.promo = array('B')
+
+        seen = set()
+        for product in products:
+            if product.get('id') is None:
+                continue
+            product_id = str(product['id'])
+            if product_id in seen:
+                continue
+            seen.add(product_id)
+            price, old_price = product_prices(product)
+            category = product.get('category_name') or product.get('category') or ''
+            if isinstance(category, dict):
+                category = category.get('name') or ''
+
+            ids.append(product_id)
+            names.append(product.get('name') or '')
+            descriptions.append(product.get('description') or '')
+            images.append(product.get('image') or product.get('image_url') or '')
+            categories.append(str(category))
+            self.prices.append(price if price is not None else NO_PRICE)
+            self.old_prices.append(old_price or 0.0)
+            self.category_ids.append(_category_id(product))
+            self.promo.append(1 if old_price is not None and price is not None and old_price > price else 0)
+
+        self.ids = StringColumn(ids)
+        self.names = StringColumn(names)
+        self.descriptions = StringColumn(descriptions)
+        self.images = StringColumn(images)
+        self.category_names = CodedColumn.build(categories)
+
+        # Строки по возрастанию id - для поиска товара по id двоичным поиском
+        self.id_order = array('I', sorted(range(len(ids)), key=ids.__getitem__))
+        # Строки, сгруппированные по категориям: category_order[starts[k]:starts[k + 1]]
+        # - строки категории category_keys[k]
+        rows: Dict[int, List[int]] = {}
+        for i, category_id in enumerate(self.category_ids):
+            rows.setdefault(category_id, []).append(i)
+        self.category_keys = array('q', sorted(rows))
+        self.category_order = array('I')
+        self.category_starts = array('I', [0])
+        for category_id in self.category_keys:
+            self.category_order.extend(rows[category_id])
+            self.category_starts.append(len(self.category_order))
+        self._index_categories()
+
+    def _index_categories(self):
+        # Срезы memoryview - без копирования строк категории
+        order = memoryview(self.category_order)
+        starts = self.category_starts
+        self._category_rows = {
+            category_id: order[starts[k]:starts[k + 1]]
+            for k, category_id in enumerate(self.category_keys)
+        }
+
+    def save(self, path: Path):
+        """Записать каталог в файл атомарно: во временный файл и rename.
+
+        Читатели, уже открывшие старый файл через mmap, продолжают видеть
+        его целиком, пока не переоткроют каталог.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        buffers = []
+        for name, _ in CATALOG_SECTIONS:
+            column = self
+            for part in name.split('.'):
+                column = getattr(column, part)
+            buffers.append(memoryview(column).cast('B'))
+
+        position = _HEADER.size + _SECTION.size * len(buffers)
+        table = []
+        for (name, _), buffer in zip(CATALOG_SECTIONS, buffers):
+            position += -position % 8
+            table.append(_SECTION.pack(name.encode('ascii'), position, len(buffer)))
+            position += len(buffer)
+
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp, 'wb') as f:
+            f.write(_HEADER.pack(CATALOG_MAGIC, sys.byteorder.encode('ascii'), len(buffers)))
+            f.writelines(table)
+            for buffer in buffers:
+                f.write(b'\0' * (-f.tell() % 8))
+                f.write(buffer)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    @classmethod
+    def open(cls, path: Path) -> 'ProductCatalog':
+        """Каталог поверх файла, отображенного в память только для чтения"""
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        magic, byteorder, count = _HEADER.unpack_from(view)
+        if magic != CATALOG_MAGIC:
+            raise ValueError(f"{path}: не файл каталога")
+        if byteorder.rstrip(b'\0').decode('ascii') != sys.byteorder:
+            raise ValueError(f"{path}: каталог записан с другим порядком байт")
+
+        sections = {}
+        for k in range(count):
+            name, offset, length = _SECTION.unpack_from(view, _HEADER.size + _SECTION.size * k)
+            sections[name.rstrip(b'\0').decode('ascii')] = view[offset:offset + length]
+
+        typecodes = dict(CATALOG_SECTIONS)
+
+        def column(name):
+            return sections[name].cast(typecodes[name])
+
+        def strings(prefix):
+            return StringColumn(data=column(f"{prefix}.data"), offsets=column(f"{prefix}.offsets"))
+
+        catalog = cls.__new__(cls)
+        for name in ('prices', 'old_prices', 'category_ids', 'promo', 'id_order',
+                     'category_keys', 'category_order', 'category_starts'):
+            setattr(catalog, name, column(name))
+        catalog.ids = strings('ids')
+        catalog.names = strings('names')
+        catalog.descriptions = strings('descriptions')
+        catalog.images = strings('images')
+        catalog.category_names = CodedColumn(column('category_names.codes'), strings('category_names.values'))
+        catalog._index_categories()
+        return catalog
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row_of(self, product_id) -> Optional[int]:
+        product_id = str(product_id)
+        order = self.id_order
+        position = bisect_left(order, product_id, key=self.ids.__getitem__)
+        if position < len(order) and self.ids[order[position]] == product_id:
+            return order[position]
+        return None
+
+    def row(self, i: int) -> Dict[str, Any]:
+        """Товар в формате ответа API"""
+        price = self.prices[i]
+        product = {
+            'id': self.ids[i],
+            'name': self.names[i],
+            'price': None if price == NO_PRICE else price,
+            'category_id': None if self.category_ids[i] == NO_CATEGORY else self.category_ids[i],
+            'category_name': self.category_names[i],
+            'promo': bool(self.promo[i]),
+        }
+        if self.old_prices[i]:
+            product['old_price'] = self.old_prices[i]
+        description = self.descriptions[i]
+        if description:
+            product['description'] = description
+        image = self.images[i]
+        if image:
+            product['image'] = image
+        return product
+
+    def rows(self, positions: Iterable[int]) -> List[Dict[str, Any]]:
+        return [self.row(i) for i in positions]
+
+    def get(self, product_id) -> Optional[Dict[str, Any]]:
+        i = self.row_of(product_id)
+        return None if i is None else self.row(i)
+
+    def filter(self, category_id: Optional[int] = None, min_price: Optional[float] = None,
+               max_price: Optional[float] = None, promo: Optional[bool] = None,
+               positions: Optional[Sequence[int]] = None) -> Sequence[int]:
+        """Номера строк, подходящих под все условия (среди positions, если заданы), в исходном порядке"""
+        if positions is None and category_id is not None:
+            positions = self._category_rows.get(category_id, array('I'))
+            category_id = None
+        if positions is None:
+            positions = range(len(self))
+
+        if np is not None:
+            selected = np.asarray(positions, dtype=np.int64)
+            if category_id is not None:
+                selected = selected[np.frombuffer(self.category_ids, dtype=np.int64)[selected] == category_id]
+            if min_price is not None or max_price is not None:
+                prices = np.frombuffer(self.prices, dtype=np.float64)[selected]
+                mask = np.ones(len(selected), dtype=bool)
+                if min_price is not None:
+                    mask &= prices >= min_price
+                if max_price is not None:
+                    mask &= prices <= max_price
+                selected = selected[mask]
+            if promo is not None:
+                selected = selected[np.frombuffer(self.promo, dtype=np.uint8)[selected] == int(promo)]
+            return selected
+
+        # Каждое условие - отдельный проход list comprehension по колонке
+        selected = positions
+        if category_id is not None:
+            category_ids = self.category_ids
+            selected = [i for i in selected if category_ids[i] == category_id]
+        if promo is not None:
+            flags = self.promo
+            flag = int(promo)
+            selected = [i for i in selected if flags[i] == flag]
+        if min_price is not None:
+            prices = self.prices
+            selected = [i for i in selected if prices[i] >= min_price]
+        if max_price is not None:
+            prices = self.prices
+            selected = [i for i in selected if prices[i] <= max_price]
+        return selected
+
+    def sort(self, positions: Sequence[int], key: str = 'relevance') -> Sequence[int]:
+        """Упорядочить строки; relevance - оставить порядок как есть"""
+        if key == 'relevance':
+            return positions
+        if key == 'name':
+            names = self.names
+            return sorted(positions, key=lambda i: names[i].casefold())
+
+        if np is not None:
+            positions = np.asarray(positions, dtype=np.int64)
+            prices = np.frombuffer(self.prices, dtype=np.float64)[positions]
+            if key == 'discount':
+                old_prices = np.frombuffer(self.old_prices, dtype=np.float64)[positions]
+                values = np.where(old_prices > prices, prices - old_prices, 0.0)
+            elif key == '-price':
+                values = np.where(prices == NO_PRICE, NO_PRICE, -prices)
+            else:
+                values = prices
+            return positions[np.argsort(values, kind='stable')]
+
+        prices = self.prices
+        if key == 'discount':
+            old_prices = self.old_prices
+            flags = self.promo
+            return sorted(positions, key=lambda i: prices[i] - old_prices[i] if flags[i] else 0.0)
+        if key == '-price':
+            ordered = sorted(positions, key=prices.__getitem__, reverse=True)
+            # Товары без цены - в конце, как и при сортировке по возрастанию
+            unknown = [i for i in ordered if prices[i] == NO_PRICE]
+            return [i for i in ordered if prices[i] != NO_PRICE] + unknown if unknown else ordered
+        return sorted(positions, key=prices.__getitem__)
+
+    def query(self, category_id: Optional[int] = None, min_price: Optional[float] = None,
+              max_price: Optional[float] = None, promo: Optional[bool] = None,
+              sort: str = 'relevance', offset: int = 0, limit: int = 20,
+              positions: Optional[Sequence[int]] = None):
+        """(число подходящих, товары страницы)"""
+        selected = self.filter(category_id, min_price, max_price, promo, positions)
+        selected = self.sort(selected, sort)
+        return len(selected), self.rows(int(i) for i in selected[offset:offset + limit])
+
+    def nbytes(self) -> int:
+        """Размер колонок в байтах"""
+        size = sum(
+            column.itemsize * len(column)
+            for column in (self.prices, self.old_prices, self.category_ids, self.promo, self.id_order,
+                           self.category_keys, self.category_order, self.category_starts)
+        )
+        columns = (self.ids, self.names, self.descriptions, self.images, self.category_names)
+        return size + sum(column.nbytes() for column in columns)
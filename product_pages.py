@@ -0,0 +1,72 @@
+"""Курсорная пагинация списка товаров.
+
+Курсор - непрозрачная строка: смещение следующей страницы и отпечаток
+запроса (поиск, категория, магазин, фильтры, сортировка). С курсором от
+другого запроса страница не отдается. 5ka.ru запрашивается страницами
+фиксированного размера (чанками): большой limit собирается из нескольких
+чанков, а ключи кэша у соседних страниц совпадают, что бы ни просил клиент.
+"""
+
+import base64
+import hashlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import fast_json
+
+
+class CursorError(ValueError):
+    """Курсор испорчен или выдан для другого запроса"""
+
+
+def query_fingerprint(**query: Any) -> str:
+    """Короткий отпечаток параметров запроса"""
+    encoded = fast_json.dumps(sorted(query.items()))
+    return hashlib.blake2b(encoded, digest_size=6).hexdigest()
+
+
+def encode_cursor(offset: int, fingerprint: str) -> str:
+    raw = fast_json.dumps({'o': offset, 'f': fingerprint})
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor: str, fingerprint: str) -> int:
+    """Смещение из курсора; CursorError, если курсор не от этого запроса"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        state = fast_json.loads(raw)
+        offset = state['o']
+        owner = state['f']
+    except Exception as e:
+        raise CursorError('Некорректный курсор') from e
+    if owner != fingerprint or not isinstance(offset, int) or offset < 0:
+        raise CursorError('Курсор выдан для другого запроса')
+    return offset
+
+
+def chunk_pages(offset: int, limit: int, chunk_size: int) -> range:
+    """Номера страниц 5ka.ru (с 1) по chunk_size товаров, покрывающих [offset, offset + limit)"""
+    first = offset // chunk_size
+    last = (offset + limit - 1) // chunk_size
+    return range(first + 1, last + 2)
+
+
+def page_items(data: Any) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """(товары, total) из ответа 5ka.ru; total - None, если апстрим его не прислал"""
+    if isinstance(data, list):
+        return data, None
+    if isinstance(data, dict):
+        for key in ('products', 'results', 'items'):
+            if isinstance(data.get(key), list):
+                total = data.get('total', data.get('count'))
+                return data[key], total if isinstance(total, int) else None
+    return [], None
+
+
+def append_field(raw: bytes, name: str, value: Any) -> Optional[bytes]:
+    """Дописать поле в JSON-объект, не разбирая его; None, если raw - не объект"""
+    body = raw.strip()
+    if not body.startswith(b'{') or not body.endswith(b'}'):
+        return None
+    field = fast_json.dumps(name) + b':' + fast_json.dumps(value)
+    inner = body[1:-1].strip()
+    return b'{' + inner + (b',' if inner else b'') + field + b'}'
@@ -0,0 +1,268 @@
+"""Локальный полнотекстовый поиск товаров.
+
+Инвертированный индекс по основам слов из названий и категорий товаров.
+Основы получаются легким стеммером (отсечение русских окончаний), ё и е
+не различаются. Слово запроса, которого нет в словаре, заменяется
+похожими словами по триграммам ("малоко" -> "молоко"), недописанное
+последнее слово - словами с таким началом.
+"""
+
+import asyncio
+import heapq
+import json
+import logging
+import math
+import re
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from product_catalog import ProductCatalog
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r'[^\W_]+')
+_CYRILLIC = re.compile(r'[а-я]')
+
+# Окончания, от длинных к коротким
+_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ях', 'ах', 'ов', 'ев',
+    'ей', 'ой', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ую', 'юю', 'ом', 'ем',
+    'ых', 'их', 'ам', 'ям', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+_MIN_STEM = 3
+
+# Вес слова в зависимости от поля, где оно встретилось
+NAME_WEIGHT = 2.0
+CATEGORY_WEIGHT = 1.0
+# Вес замен слова запроса: по началу слова и по триграммам
+PREFIX_WEIGHT = 0.8
+FUZZY_MIN_SIMILARITY = 0.4
+MAX_EXPANSIONS = 20
+
+
+def fold(text: str) -> str:
+    return text.casefold().replace('ё', 'е')
+
+
+def stem(word: str) -> str:
+    """Основа русского слова: без окончания, но не короче _MIN_STEM букв"""
+    if not _CYRILLIC.search(word):
+        return word
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= _MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Основы слов текста"""
+    return [stem(word) for word in _WORD.findall(fold(text))]
+
+
+def trigrams(term: str) -> set:
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ProductSearchIndex:
+    """Неизменяемый индекс по строкам ProductCatalog"""
+
+    def __init__(self, catalog: ProductCatalog):
+        self.catalog = catalog
+        postings: Dict[str, Dict[int, float]] = {}
+        # Названия категорий повторяются: разбираем каждое один раз
+        category_terms: Dict[str, List[str]] = {}
+
+        for position in range(len(catalog)):
+            category = catalog.category_names[position]
+            if category not in category_terms:
+                category_terms[category] = tokenize(category)
+            for terms, weight in ((tokenize(catalog.names[position]), NAME_WEIGHT),
+                                  (category_terms[category], CATEGORY_WEIGHT)):
+                for term in terms:
+                    entry = postings.setdefault(term, {})
+                    entry[position] = max(entry.get(position, 0.0), weight)
+
+        count = len(catalog)
+        # term -> (idf, позиции товаров, веса)
+        self.postings: Dict[str, Tuple[float, array, array]] = {
+            term: (math.log(1 + count / len(entry)), array('I', entry.keys()), array('f', entry.values()))
+            for term, entry in postings.items()
+        }
+        self.vocabulary = sorted(self.postings)
+        self._trigrams: Dict[str, List[str]] = {}
+        for term in self.vocabulary:
+            for gram in trigrams(term):
+                self._trigrams.setdefault(gram, []).append(term)
+
+    def __len__(self):
+        return len(self.catalog)
+
+    def _prefixed(self, prefix: str) -> List[str]:
+        start = bisect_left(self.vocabulary, prefix)
+        terms = []
+        for term in self.vocabulary[start:start + MAX_EXPANSIONS]:
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+        return terms
+
+    def _similar(self, term: str) -> List[Tuple[str, float]]:
+        """Слова словаря, похожие на term по триграммам (коэффициент Дайса)"""
+        grams = trigrams(term)
+        common: Dict[str, int] = {}
+        for gram in grams:
+            for candidate in self._trigrams.get(gram, ()):
+                common[candidate] = common.get(candidate, 0) + 1
+        scored = []
+        for candidate, shared in common.items():
+            similarity = 2 * shared / (len(grams) + len(trigrams(candidate)))
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                scored.append((candidate, similarity))
+        return heapq.nlargest(MAX_EXPANSIONS, scored, key=lambda item: item[1])
+
+    def expand(self, word: str, is_last: bool) -> Dict[str, float]:
+        """Слова словаря, которыми заменяется слово запроса, с весами"""
+        term = stem(word)
+        expansions: Dict[str, float] = {}
+        if term in self.postings:
+            expansions[term] = 1.0
+        if is_last:
+            # Запрос набирается по буквам: последнее слово может быть недописано
+            for candidate in self._prefixed(word):
+                expansions.setdefault(candidate, PREFIX_WEIGHT)
+        if not expansions:
+            for candidate, similarity in self._similar(term):
+                expansions[candidate] = similarity * PREFIX_WEIGHT
+        return expansions
+
+    def search(self, query: str) -> Dict[int, float]:
+        """{строка каталога: релевантность}; товар должен подходить под каждое слово запроса"""
+        words = _WORD.findall(fold(query))
+        if not words:
+            return {}
+
+        # Слова от самого редкого: дальше считаем очки только уже найденным товарам
+        expanded = [self.expand(word, i == len(words) - 1) for i, word in enumerate(words)]
+        expanded.sort(key=lambda terms: sum(len(self.postings[term][1]) for term in terms))
+
+        scores: Optional[Dict[int, float]] = None
+        for terms in expanded:
+            word_scores: Dict[int, float] = {}
+            for term, expansion_weight in terms.items():
+                idf, positions, weights = self.postings[term]
+                for position, weight in zip(positions, weights):
+                    if scores is not None and position not in scores:
+                        continue
+                    score = idf * weight * expansion_weight
+                    if score > word_scores.get(position, 0.0):
+                        word_scores[position] = score
+            if scores is not None:
+                for position, score in word_scores.items():
+                    word_scores[position] = score + scores[position]
+            scores = word_scores
+            if not scores:
+                return {}
+        return scores
+
+
+class CatalogSearch:
+    """Актуальные ProductCatalog и ProductSearchIndex с перезагрузкой из файла-снимка"""
+
+    def __init__(self, snapshot_path: Optional[Path] = None):
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else None
+        self.index = ProductSearchIndex(ProductCatalog())
+        self._mtime = None
+        self.reloads = 0
+        self.local_hits = 0
+        self.local_misses = 0
+
+    def load(self) -> bool:
+        """Перестроить индекс, если снимок изменился"""
+        if self.snapshot_path is None:
+            return False
+        try:
+            mtime = self.snapshot_path.stat().st_mtime
+        except FileNotFoundError:
+            return False
+        if mtime == self._mtime:
+            return False
+
+        if self.snapshot_path.suffix == '.json':
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+            products = snapshot.get('products', []) if isinstance(snapshot, dict) else snapshot
+            catalog = ProductCatalog(products)
+        else:
+            # Бинарный каталог отображается в память: страницы общие для всех воркеров
+            catalog = ProductCatalog.open(self.snapshot_path)
+        self.replace_catalog(catalog)
+        self._mtime = mtime
+        return True
+
+    def replace(self, products: Iterable[Dict[str, Any]]):
+        self.replace_catalog(ProductCatalog(products))
+
+    def replace_catalog(self, catalog: ProductCatalog):
+        # Индекс строится целиком и подменяется одной операцией
+        self.index = ProductSearchIndex(catalog)
+        self.reloads += 1
+        logger.info(f"Product search index built: {len(self.index)} products, "
+                    f"{len(self.index.vocabulary)} terms")
+
+    def search(self, query: Optional[str] = None, category_id: Optional[int] = None,
+               page: int = 1, limit: int = 20, min_price: Optional[float] = None,
+               max_price: Optional[float] = None, promo: Optional[bool] = None,
+               sort: str = 'relevance', offset: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Страница результатов или None, если локально ничего не нашлось.
+
+        offset, если задан, заменяет page.
+        """
+        index = self.index
+        catalog = index.catalog
+        if offset is None:
+            offset = (max(page, 1) - 1) * limit
+        filtered = min_price is not None or max_price is not None or promo is not None
+
+        if query:
+            scores = index.search(query)
+            if not filtered and category_id is None and sort == 'relevance':
+                total = len(scores)
+                ranked = heapq.nsmallest(offset + limit, scores.items(), key=lambda item: (-item[1], item[0]))
+                products = catalog.rows(position for position, _ in ranked[offset:])
+            else:
+                ranked = sorted(scores, key=lambda position: (-scores[position], position))
+                total, products = catalog.query(
+                    category_id, min_price, max_price, promo, sort, offset, limit, positions=ranked
+                )
+        elif category_id is not None:
+            # Просмотр категории целиком из локального каталога
+            total, products = catalog.query(category_id, min_price, max_price, promo, sort, offset, limit)
+        else:
+            return None
+
+        if not total:
+            self.local_misses += 1
+            return None
+        self.local_hits += 1
+        return {'products': products, 'total': total}
+
+    async def run_refresh(self, interval: float):
+        """Фоновая задача: подхватывать новый снимок каталога"""
+        while True:
+            try:
+                await asyncio.to_thread(self.load)
+            except Exception as e:
+                logger.error(f"Error reloading product search index: {e}")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'products': len(self.index),
+            'terms': len(self.index.vocabulary),
+            'reloads': self.reloads,
+            'local_hits': self.local_hits,
+            'local_misses': self.local_misses,
+        }
@@ -1,6 +1,7 @@
 # run.py
 import asyncio
 import uvicorn
+import os
 import subprocess
 import sys
 from pathlib import Path
@@ -24,10 +25,12 @@ def run_fastapi_server():
 
 if __name__ == "__main__":
     print("🚀 Запуск 5ka Telegram Mini App...")
-    print("📱 Telegram бот запускается...")
-
-    # Запускаем бота
-    run_telegram_bot()
+    # В режиме webhook бот работает внутри FastAPI
+    if os.getenv("TELEGRAM_WEBHOOK", "false").lower() == "true":
+        print("📱 Режим webhook: обновления Telegram принимает FastAPI")
+    else:
+        print("📱 Telegram бот запускается...")
+        run_telegram_bot()
 
     print("🌐 FastAPI сервер запускается на http://localhost:8000")
     print("📋 Документация API: http://localhost:8000/docs")
@@ -91,6 +91,8 @@ class FiveKaAppManager:
     def start_fastapi(self) -> subprocess.Popen:
         """Запуск FastAPI сервера"""
         logger.info("🌐 Запуск FastAPI сервера...")
+        # Число воркеров видят и они сами: лимит отправок бота делится между ними
+        workers = '1' if self.is_development else os.getenv('WEB_CONCURRENCY', '4')
         
         if self.is_development:
             cmd = [
@@ -107,12 +109,13 @@ class FiveKaAppManager:
                 "main:app", 
                 "--host", "0.0.0.0", 
                 "--port", "8000",
-                "--workers", "4"
+                "--workers", workers
             ]
         
         process = subprocess.Popen(
             cmd,
             cwd=self.base_dir,
+            env={**os.environ, 'WEB_CONCURRENCY': workers},
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
             universal_newlines=True
@@ -154,6 +157,27 @@ class FiveKaAppManager:
             logger.error("❌ Не удалось запустить Telegram бота")
             return None
     
+    def start_catalog_crawler(self) -> subprocess.Popen:
+        """Запуск фонового обхода каталога"""
+        logger.info("📦 Запуск обхода каталога...")
+        
+        process = subprocess.Popen(
+            [sys.executable, str(self.base_dir / 'catalog_crawler.py')],
+            cwd=self.base_dir,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True
+        )
+        
+        time.sleep(1)
+        
+        if process.poll() is None:
+            logger.info("✅ Обход каталога запущен")
+            return process
+        else:
+            logger.error("❌ Не удалось запустить обход каталога")
+            return None
+    
     def start_development(self):
         """Запуск в режиме разработки"""
         logger.info("🚀 Запуск в режиме разработки...")
@@ -163,10 +187,19 @@ class FiveKaAppManager:
         if fastapi_process:
             self.processes.append(fastapi_process)
         
-        # Запуск Telegram бота
-        bot_process = self.start_telegram_bot()
-        if bot_process:
-            self.processes.append(bot_process)
+        # Запуск Telegram бота; в режиме webhook его обновления принимает FastAPI
+        if os.getenv('TELEGRAM_WEBHOOK', 'false').lower() == 'true':
+            logger.info("📱 Режим webhook: отдельный процесс бота не запускается")
+        else:
+            bot_process = self.start_telegram_bot()
+            if bot_process:
+                self.processes.append(bot_process)
+        
+        # Обход каталога отдельным процессом, чтобы не зависеть от числа воркеров API
+        if os.getenv('CATALOG_CRAWLER', 'off').lower() == 'process':
+            crawler_process = self.start_catalog_crawler()
+            if crawler_process:
+                self.processes.append(crawler_process)
         
         if self.processes:
             logger.info("🎉 Приложение запущено!")
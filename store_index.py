@@ -0,0 +1,371 @@
+"""Локальный справочник магазинов с пространственным индексом.
+
+Координаты магазинов хранятся в компактных массивах array('d'), индексы
+магазинов разложены по ячейкам равномерной сетки. Поиск ближайших и
+поиск в радиусе обходят кольца ячеек вокруг точки запроса и
+останавливаются, как только дальше заведомо нет более близких магазинов.
+"""
+
+import asyncio
+import heapq
+import json
+import logging
+import math
+import os
+import time
+from array import array
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: снимок пишет один процесс, блокировка не нужна
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEGREE = 111320.0
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Расстояние между точками в метрах"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def store_coordinates(store: Dict[str, Any]) -> Optional[Tuple[float, float]]:
+    """(lat, lon) магазина из любого из встречающихся форматов"""
+    for lat_key, lon_key in (('lat', 'lon'), ('latitude', 'longitude'), ('lat', 'lng')):
+        if store.get(lat_key) is not None and store.get(lon_key) is not None:
+            return float(store[lat_key]), float(store[lon_key])
+    coordinates = store.get('coordinates')
+    if isinstance(coordinates, (list, tuple)) and len(coordinates) == 2:
+        # GeoJSON-порядок: [lon, lat]
+        return float(coordinates[1]), float(coordinates[0])
+    return None
+
+
+def store_key(store: Dict[str, Any]) -> str:
+    """Идентификатор магазина для дедупликации"""
+    for key in ('id', 'sap_code', 'store_id'):
+        if store.get(key) is not None:
+            return str(store[key])
+    coordinates = store_coordinates(store)
+    return f"{coordinates[0]:.6f},{coordinates[1]:.6f}" if coordinates else json.dumps(store, sort_keys=True)
+
+
+def parse_areas(value: str) -> List[Tuple[float, float, float]]:
+    """Области "lat,lon,radius;lat,lon,radius" из переменной окружения"""
+    areas = []
+    for area in filter(None, (part.strip() for part in value.split(';'))):
+        lat, lon, radius = (float(number) for number in area.split(','))
+        areas.append((lat, lon, radius))
+    return areas
+
+
+def http_store_fetcher(client, api_url: str) -> Callable[[float, float, float], Awaitable[Optional[List[Dict[str, Any]]]]]:
+    """fetch(lat, lon, radius) для run_refresh поверх httpx-клиента: магазины или None при ошибке"""
+    async def fetch(lat: float, lon: float, radius: float):
+        response = await client.get(f"{api_url.rstrip('/')}/stores",
+                                    params={'lat': lat, 'lon': lon, 'radius': int(radius)})
+        if response.status_code != 200:
+            logger.error(f"Stores API error: {response.status_code}")
+            return None
+        return extract_stores(response.json())
+    return fetch
+
+
+def extract_stores(data: Any) -> List[Dict[str, Any]]:
+    """Список магазинов из ответа API (список или объект-обертка)"""
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict):
+        for key in ('stores', 'results', 'items'):
+            if isinstance(data.get(key), list):
+                return data[key]
+    return []
+
+
+class StoreIndex:
+    """Неизменяемый снимок магазинов с сеточным индексом"""
+
+    def __init__(self, stores: Iterable[Dict[str, Any]], cell_size_deg: float = 0.05):
+        self.cell_size = cell_size_deg
+        self.stores: List[Dict[str, Any]] = []
+        self.lats = array('d')
+        self.lons = array('d')
+        buckets: Dict[Tuple[int, int], List[int]] = {}
+
+        for store in stores:
+            coordinates = store_coordinates(store)
+            if coordinates is None:
+                continue
+            position = len(self.stores)
+            self.stores.append(store)
+            self.lats.append(coordinates[0])
+            self.lons.append(coordinates[1])
+            buckets.setdefault(self._cell(*coordinates), []).append(position)
+
+        self.grid: Dict[Tuple[int, int], array] = {
+            cell: array('I', positions) for cell, positions in buckets.items()
+        }
+        if self.grid:
+            rows = [row for row, _ in self.grid]
+            cols = [col for _, col in self.grid]
+            self._bounds = (min(rows), max(rows), min(cols), max(cols))
+        else:
+            self._bounds = None
+
+    def __len__(self):
+        return len(self.stores)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_size)), int(math.floor(lon / self.cell_size))
+
+    def _ring(self, row: int, col: int, ring: int):
+        """Ячейки на границе квадрата радиуса ring вокруг (row, col)"""
+        if ring == 0:
+            yield row, col
+            return
+        for d in range(-ring, ring + 1):
+            yield row - ring, col + d
+            yield row + ring, col + d
+        for d in range(-ring + 1, ring):
+            yield row + d, col - ring
+            yield row + d, col + ring
+
+    def _max_ring(self, row: int, col: int) -> int:
+        min_row, max_row, min_col, max_col = self._bounds
+        return max(abs(row - min_row), abs(row - max_row), abs(col - min_col), abs(col - max_col))
+
+    def nearest(self, lat: float, lon: float, limit: int = 10,
+                radius: Optional[float] = None) -> List[Tuple[float, Dict[str, Any]]]:
+        """До limit ближайших магазинов (в пределах radius метров): [(метры, магазин)]"""
+        if not self.stores or limit <= 0:
+            return []
+
+        row, col = self._cell(lat, lon)
+        max_ring = self._max_ring(row, col)
+        # max-heap через отрицательные расстояния
+        best: List[Tuple[float, int]] = []
+
+        def consider(positions):
+            for position in positions:
+                distance = haversine_m(lat, lon, self.lats[position], self.lons[position])
+                if radius is not None and distance > radius:
+                    continue
+                if len(best) < limit:
+                    heapq.heappush(best, (-distance, position))
+                elif distance < -best[0][0]:
+                    heapq.heapreplace(best, (-distance, position))
+
+        for ring in range(max_ring + 1):
+            # Любая точка в кольце ring и дальше не ближе (ring - 1) ячеек
+            edge_lat = min(abs(lat) + ring * self.cell_size, 89.9)
+            cell_m = self.cell_size * METERS_PER_DEGREE * math.cos(math.radians(edge_lat))
+            bound = max(ring - 1, 0) * cell_m
+            if radius is not None and bound > radius:
+                break
+            if len(best) == limit and -best[0][0] <= bound:
+                break
+            if (2 * ring + 1) ** 2 > 4 * len(self.grid):
+                # Колец больше, чем занятых ячеек: дешевле досмотреть оставшиеся ячейки разом
+                for (cell_row, cell_col), positions in self.grid.items():
+                    if max(abs(cell_row - row), abs(cell_col - col)) >= ring:
+                        consider(positions)
+                break
+            for cell in self._ring(row, col, ring):
+                positions = self.grid.get(cell)
+                if positions is not None:
+                    consider(positions)
+
+        return [(-distance, self.stores[position]) for distance, position in sorted(best, reverse=True)]
+
+    def within(self, lat: float, lon: float, radius: float,
+               limit: Optional[int] = None) -> List[Tuple[float, Dict[str, Any]]]:
+        """Магазины в радиусе radius метров, от ближнего к дальнему"""
+        return self.nearest(lat, lon, limit=limit or len(self.stores), radius=radius)
+
+
+class StoreDirectory:
+    """Актуальный StoreIndex с периодической перезагрузкой из файла-снимка.
+
+    В снимке кроме магазинов хранятся "покрытые" круги (lat, lon, radius,
+    время): запрос внутри такого круга можно отвечать из памяти, не
+    обращаясь к 5ka.ru. run_refresh с fetch сам перезапрашивает у 5ka.ru
+    заданные области и покрытые круги, которые старше refresh_age. Снимок
+    общий для воркеров: запись идет под файловой блокировкой, после
+    перечитывания чужих изменений.
+    """
+
+    def __init__(self, snapshot_path: Optional[Path] = None, max_age: float = 24 * 3600,
+                 default_stores: Optional[List[Dict[str, Any]]] = None):
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else None
+        self.max_age = max_age
+        self.default_stores = default_stores or []
+        self.index = StoreIndex(self.default_stores)
+        self.coverage: List[List[float]] = []
+        self._mtime = None
+        self.reloads = 0
+        self.upstream_refreshes = 0
+        self.upstream_errors = 0
+        self.local_hits = 0
+        self.local_misses = 0
+
+    def load(self) -> bool:
+        """Перечитать снимок, если файл изменился"""
+        if self.snapshot_path is None:
+            return False
+        try:
+            mtime = self.snapshot_path.stat().st_mtime
+        except FileNotFoundError:
+            return False
+        if mtime == self._mtime:
+            return False
+
+        with open(self.snapshot_path, encoding='utf-8') as f:
+            snapshot = json.load(f)
+        self.index = StoreIndex(snapshot.get('stores', []))
+        self.coverage = snapshot.get('coverage', [])
+        self._mtime = mtime
+        self.reloads += 1
+        logger.info(f"Store index loaded: {len(self.index)} stores from {self.snapshot_path}")
+        return True
+
+    def save(self):
+        """Записать снимок атомарно: во временный файл и rename"""
+        if self.snapshot_path is None:
+            return
+        self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.snapshot_path.with_name(f".{self.snapshot_path.name}.{os.getpid()}.tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'stores': self.index.stores, 'coverage': self.coverage}, f, ensure_ascii=False)
+        os.replace(tmp, self.snapshot_path)
+        self._mtime = self.snapshot_path.stat().st_mtime
+
+    @contextmanager
+    def _file_lock(self):
+        """Эксклюзивная блокировка снимка между процессами"""
+        if self.snapshot_path is None or fcntl is None:
+            yield
+            return
+        self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.snapshot_path.with_name(f".{self.snapshot_path.name}.lock"), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def merge_and_save(self, lat: float, lon: float, radius: float, stores: List[Dict[str, Any]]):
+        """merge и save без потери чужих записей: под блокировкой сначала перечитываем снимок"""
+        with self._file_lock():
+            self.load()
+            self.merge(lat, lon, radius, stores)
+            self.save()
+
+    def replace(self, stores: List[Dict[str, Any]], coverage: Optional[List[List[float]]] = None):
+        """Подменить справочник целиком (например, после полного обхода)"""
+        self.index = StoreIndex(stores)
+        self.coverage = coverage or []
+
+    def merge(self, lat: float, lon: float, radius: float, stores: List[Dict[str, Any]]):
+        """Добавить ответ апстрима для круга (lat, lon, radius).
+
+        Ответ - полный список магазинов круга: те, что лежат в круге, но в
+        ответ не попали, закрылись и удаляются.
+        """
+        fresh = {store_key(store): store for store in stores}
+        merged = {}
+        for store in self.index.stores:
+            key = store_key(store)
+            if key not in fresh:
+                coordinates = store_coordinates(store)
+                if coordinates is not None and haversine_m(lat, lon, *coordinates) <= radius:
+                    continue
+            merged[key] = store
+        merged.update(fresh)
+        self.index = StoreIndex(merged.values())
+        # Выкидываем устаревшие круги и круги, целиком лежащие внутри нового
+        oldest = time.time() - self.max_age
+        self.coverage = [
+            circle for circle in self.coverage
+            if circle[3] >= oldest and haversine_m(lat, lon, circle[0], circle[1]) + circle[2] > radius
+        ]
+        self.coverage.append([lat, lon, float(radius), time.time()])
+
+    def is_covered(self, lat: float, lon: float, radius: float, max_age: Optional[float] = None) -> bool:
+        """Лежит ли круг запроса целиком внутри свежего покрытого круга"""
+        oldest = time.time() - (self.max_age if max_age is None else max_age)
+        for covered_lat, covered_lon, covered_radius, updated_at in self.coverage:
+            if updated_at < oldest:
+                continue
+            if haversine_m(lat, lon, covered_lat, covered_lon) + radius <= covered_radius:
+                return True
+        return False
+
+    def query(self, lat: float, lon: float, radius: float,
+              limit: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+        """Магазины в радиусе из памяти или None, если область не покрыта снимком"""
+        if not self.is_covered(lat, lon, radius):
+            self.local_misses += 1
+            return None
+        self.local_hits += 1
+        return [store for _, store in self.index.within(lat, lon, radius, limit)]
+
+    def due_areas(self, areas: Iterable[Tuple[float, float, float]], refresh_age: float) -> List[Tuple[float, float, float]]:
+        """Области, которые пора перезапросить: заданные и покрытые, обновленные раньше refresh_age"""
+        due = [area for area in areas if not self.is_covered(*area, max_age=refresh_age)]
+        oldest = time.time() - refresh_age
+        for lat, lon, radius, updated_at in self.coverage:
+            if updated_at < oldest and (lat, lon, radius) not in due:
+                due.append((lat, lon, radius))
+        return due
+
+    async def refresh_from_upstream(self, fetch, areas: Iterable[Tuple[float, float, float]], refresh_age: float):
+        for lat, lon, radius in self.due_areas(areas, refresh_age):
+            try:
+                stores = await fetch(lat, lon, radius)
+            except Exception as e:
+                stores = None
+                logger.error(f"Error fetching stores around {lat},{lon}: {e}")
+            if not stores:
+                # Пустой ответ не записываем: иначе область на max_age останется без магазинов
+                self.upstream_errors += 1
+                continue
+            await asyncio.to_thread(self.merge_and_save, lat, lon, radius, stores)
+            self.upstream_refreshes += 1
+            logger.info(f"Stores refreshed around {lat},{lon} r={radius:.0f}: {len(stores)} stores")
+
+    async def run_refresh(self, interval: float, fetch=None,
+                          areas: Iterable[Tuple[float, float, float]] = (), refresh_age: float = 6 * 3600):
+        """Фоновая задача: подхватывать снимок других процессов и, с fetch, обновлять его из 5ka.ru"""
+        areas = list(areas)
+        while True:
+            try:
+                await asyncio.to_thread(self.load)
+            except Exception as e:
+                logger.error(f"Error reloading store index: {e}")
+            if fetch is not None:
+                try:
+                    await self.refresh_from_upstream(fetch, areas, refresh_age)
+                except Exception as e:
+                    logger.error(f"Error refreshing stores from upstream: {e}")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'stores': len(self.index),
+            'covered_areas': len(self.coverage),
+            'reloads': self.reloads,
+            'upstream_refreshes': self.upstream_refreshes,
+            'upstream_errors': self.upstream_errors,
+            'local_hits': self.local_hits,
+            'local_misses': self.local_misses,
+        }
@@ -0,0 +1,146 @@
+"""Проверка пользователя Mini App по Telegram initData.
+
+initData подписан ботом: HMAC-SHA256 от отсортированных полей с ключом
+HMAC-SHA256("WebAppData", токен бота). Его проверяем один раз, при входе
+(POST /api/auth), и выдаем короткоживущий токен сессии
+"<user_id>.<expires>.<подпись>". Дальше запросы несут токен в заголовке
+Authorization: подпись у него короткая и одинаковая во всех воркерах, а
+уже проверенные токены воркер помнит, и повторная проверка - поиск в словаре.
+"""
+
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qsl
+
+import fast_json
+from fiveka_cache import MISS, LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Допустимое расхождение часов с Telegram: auth_date из будущего дальше этого - подделка
+MAX_CLOCK_SKEW = 60
+
+
+class AuthError(ValueError):
+    """initData или токен сессии не прошли проверку"""
+
+
+def verify_init_data(init_data: str, secret_key: bytes, max_age: float, now: Optional[float] = None) -> Dict[str, Any]:
+    """Пользователь из initData; AuthError, если подпись не сходится или данные устарели"""
+    try:
+        fields = dict(parse_qsl(init_data, keep_blank_values=True, strict_parsing=True))
+    except ValueError as e:
+        raise AuthError('Некорректный initData') from e
+    received = fields.pop('hash', '')
+    check_string = '\n'.join(f"{key}={value}" for key, value in sorted(fields.items()))
+    expected = hmac.new(secret_key, check_string.encode('utf-8'), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected, received):
+        raise AuthError('Неверная подпись initData')
+    try:
+        auth_date = int(fields['auth_date'])
+        user = fast_json.loads(fields['user'])
+        user_id = user['id']
+    except Exception as e:
+        raise AuthError('В initData нет пользователя') from e
+    now = now if now is not None else time.time()
+    if now - auth_date > max_age:
+        raise AuthError('initData устарел')
+    if auth_date - now > MAX_CLOCK_SKEW:
+        raise AuthError('initData из будущего')
+    return {**user, 'id': user_id}
+
+
+class SessionAuth:
+    """Вход по initData и проверка токенов сессии с кэшем проверенных"""
+
+    def __init__(self, bot_token: str, ttl: float = 3600, max_age: float = 24 * 3600,
+                 secret: Optional[str] = None, cache_size: int = 10000):
+        self.ttl = ttl
+        self.max_age = max_age
+        self._init_key = hmac.new(b'WebAppData', bot_token.encode('utf-8'), hashlib.sha256).digest()
+        # Секрет по умолчанию выводится из токена бота: одинаковый во всех воркерах
+        self._session_key = (secret or hashlib.sha256(f"session:{bot_token}".encode('utf-8')).hexdigest()).encode('utf-8')
+        self._verified = LRUCache(cache_size)
+        self.logins = 0
+        self.login_failures = 0
+        self.login_seconds = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.token_seconds = 0.0
+
+    def _sign(self, payload: str) -> str:
+        digest = hmac.new(self._session_key, payload.encode('utf-8'), hashlib.sha256).digest()[:18]
+        return base64.urlsafe_b64encode(digest).decode('ascii')
+
+    def login(self, init_data: str) -> Tuple[Dict[str, Any], str, int]:
+        """(пользователь, токен, срок действия) по initData"""
+        started = time.perf_counter()
+        try:
+            user = verify_init_data(init_data, self._init_key, self.max_age)
+        except AuthError:
+            self.login_failures += 1
+            raise
+        finally:
+            self.login_seconds += time.perf_counter() - started
+        self.logins += 1
+        expires = int(time.time() + self.ttl)
+        payload = f"{user['id']}.{expires}"
+        return user, f"{payload}.{self._sign(payload)}", expires
+
+    def authenticate(self, token: str) -> str:
+        """user_id из токена сессии; AuthError, если токен чужой или истек"""
+        user_id = self._verified.get(token)
+        if user_id is not MISS:
+            self.hits += 1
+            return user_id
+        self.misses += 1
+        started = time.perf_counter()
+        try:
+            user_id, expires, signature = token.rsplit('.', 2)
+            remaining = int(expires) - time.time()
+        except ValueError:
+            remaining = 0
+            signature = user_id = ''
+        valid = remaining > 0 and hmac.compare_digest(signature, self._sign(f"{user_id}.{expires}"))
+        self.token_seconds += time.perf_counter() - started
+        if not valid:
+            self.rejected += 1
+            raise AuthError('Сессия недействительна или истекла')
+        # Запись живет не дольше самого токена
+        self._verified.set(token, user_id, remaining)
+        return user_id
+
+    def stats(self) -> Dict[str, Any]:
+        checks = self.hits + self.misses
+        return {
+            'logins': self.logins,
+            'login_failures': self.login_failures,
+            'login_verify_us': round(self.login_seconds / (self.logins + self.login_failures) * 1e6, 1)
+            if self.logins + self.login_failures else 0.0,
+            'token_checks': checks,
+            'token_hits': self.hits,
+            'token_rejected': self.rejected,
+            'token_hit_rate': round(self.hits / checks, 4) if checks else 0.0,
+            'token_verify_us': round(self.token_seconds / self.misses * 1e6, 1) if self.misses else 0.0,
+            'cached_tokens': len(self._verified),
+        }
+
+
+def auth_from_env() -> Optional[SessionAuth]:
+    """SessionAuth по переменным окружения или None без токена бота"""
+    token = os.getenv('TELEGRAM_BOT_TOKEN')
+    if not token:
+        logger.warning("TELEGRAM_BOT_TOKEN не задан - пользователь Mini App не проверяется")
+        return None
+    return SessionAuth(
+        token,
+        ttl=float(os.getenv('SESSION_TOKEN_TTL', 3600)),
+        max_age=float(os.getenv('INIT_DATA_MAX_AGE', 24 * 3600)),
+        secret=os.getenv('SESSION_SECRET') or None
+    )
@@ -1,19 +1,54 @@
 
 
+import asyncio
 import os
-from telegram import Update, WebAppInfo, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update
 from telegram.ext import Application, CommandHandler, ContextTypes
 import logging
 
+from bot_rate_limit import SendQueueLimiter, send_budget_from_env
+from bot_replies import BotReplies
+from bot_users import BotUserStore
+from telegram_webhook import handler_update_types, webhook_enabled
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Сколько обновлений обрабатывается одновременно
+TELEGRAM_CONCURRENT_UPDATES = int(os.getenv("TELEGRAM_CONCURRENT_UPDATES", 64))
+# Лимиты исходящих сообщений: на бота в секунду, в личный чат в секунду, в группу в минуту
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", 30))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", 1))
+TELEGRAM_GROUP_RATE_PER_MINUTE = float(os.getenv("TELEGRAM_GROUP_RATE_PER_MINUTE", 20))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", 3))
+
 
 class TelegramBot:
-    def __init__(self, token: str, webapp_url: str):
+    def __init__(self, token: str, webapp_url: str, api_url: str = None, users: BotUserStore = None):
         self.token = token
         self.webapp_url = webapp_url
-        self.application = Application.builder().token(token).build()
+        # Получатели рассылок: все, кто запускал бота
+        self.users = users or BotUserStore()
+        # Тексты и клавиатуры ответов собираются один раз
+        self.replies = BotReplies(webapp_url)
+        self.rate_limiter = SendQueueLimiter(
+            global_rate=TELEGRAM_GLOBAL_RATE,
+            private_rate=TELEGRAM_CHAT_RATE,
+            group_rate=TELEGRAM_GROUP_RATE_PER_MINUTE / 60,
+            max_retries=TELEGRAM_MAX_RETRIES,
+            # Лимит на бота общий для всех воркеров и рассылки
+            global_bucket=send_budget_from_env(TELEGRAM_GLOBAL_RATE)
+        )
+        builder = (
+            Application.builder()
+            .token(token)
+            .concurrent_updates(TELEGRAM_CONCURRENT_UPDATES)
+            .rate_limiter(self.rate_limiter)
+        )
+        if api_url:
+            # Свой сервер Bot API (или локальный фейк для тестов)
+            builder = builder.base_url(f"{api_url.rstrip('/')}/bot")
+        self.application = builder.build()
         self.setup_handlers()
 
     def setup_handlers(self):
@@ -23,60 +58,26 @@ class TelegramBot:
 
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
-        webapp = WebAppInfo(url=self.webapp_url)
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("🛒 Открыть магазин", web_app=webapp)]
-        ])
-
-        welcome_text = f"""
-🎉 Добро пожаловать в 5ka Mini App, {user.first_name}!
-
-🛍️ Что можно делать:
-- Найти ближайшие магазины Пятёрочка
-- Просматривать каталог товаров  
-- Добавлять товары в корзину
-- Оформлять заказы
-
-Нажмите кнопку ниже, чтобы начать покупки!
-        """
-
-        await update.message.reply_text(welcome_text, reply_markup=keyboard)
+        try:
+            await asyncio.to_thread(self.users.record, update.effective_chat.id, user.first_name, user.language_code)
+        except Exception as e:
+            logger.error(f"Error recording bot user: {e}")
+        text, keyboard = self.replies.start(user.first_name, user.language_code)
+        await update.message.reply_text(text, reply_markup=keyboard)
 
     async def shop_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        webapp = WebAppInfo(url=self.webapp_url)
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("🛒 Перейти в магазин", web_app=webapp)]
-        ])
-
-        await update.message.reply_text(
-            "🛍️ Нажмите кнопку для перехода в магазин:",
-            reply_markup=keyboard
-        )
+        replies = self.replies.for_language(update.effective_user.language_code)
+        await update.message.reply_text(replies.shop_text, reply_markup=replies.shop_keyboard)
 
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        help_text = """
-📖 Помощь по использованию 5ka Mini App
-
-**Команды:**
-/start - Запуск бота и приветствие
-/shop - Быстрый доступ к магазину  
-/help - Эта справка
-
-**Как пользоваться:**
-1. Нажмите "Открыть магазин"
-2. Введите ваш адрес
-3. Выберите ближайший магазин
-4. Добавляйте товары в корзину
-5. Оформите заказ
-
-По вопросам пишите разработчику.
-        """
-        await update.message.reply_text(help_text)
+        replies = self.replies.for_language(update.effective_user.language_code)
+        await update.message.reply_text(replies.help_text)
 
     def run(self):
         logger.info("🤖 Запуск Telegram бота...")
         logger.info(f"📱 Webapp URL: {self.webapp_url}")
-        self.application.run_polling()
+        # Только типы обновлений, на которые есть обработчики
+        self.application.run_polling(allowed_updates=handler_update_types(self.application))
 
 
 if __name__ == "__main__":
@@ -98,8 +99,12 @@ if __name__ == "__main__":
         print("WEBAPP_URL=http://localhost:8000")
         exit(1)
 
+    if webhook_enabled():
+        print("ℹ️ TELEGRAM_WEBHOOK=true: обновления принимает FastAPI, отдельный процесс бота не нужен")
+        exit(0)
+
     try:
-        bot = TelegramBot(BOT_TOKEN, WEBAPP_URL)
+        bot = TelegramBot(BOT_TOKEN, WEBAPP_URL, api_url=os.getenv("TELEGRAM_API_URL"))
         bot.run()
     except Exception as e:
         print(f"❌ Ошибка запуска бота: {e}")
@@ -5,6 +5,8 @@ from telegram import Update, WebAppInfo, InlineKeyboardButton, InlineKeyboardMar
 from telegram.ext import Application, CommandHandler, ContextTypes
 import logging
 
+from telegram_webhook import handler_update_types
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -89,7 +91,8 @@ class TelegramBot:
     def run(self):
         """Запуск бота"""
         logger.info("Запуск Telegram бота...")
-        self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+        # Только типы обновлений, на которые есть обработчики
+        self.application.run_polling(allowed_updates=handler_update_types(self.application))
 
 if __name__ == "__main__":
     # Загружаем переменные окружения
@@ -0,0 +1,157 @@
+"""Режим webhook для Telegram-бота внутри FastAPI.
+
+Telegram сам присылает обновления POST-запросом на наш адрес, вместо того
+чтобы бот держал отдельным процессом постоянный long polling. Запрос
+проверяется по секретному токену (заголовок X-Telegram-Bot-Api-Secret-Token),
+а Telegram присылает только те типы обновлений, на которые есть обработчики.
+"""
+
+import hashlib
+import hmac
+import logging
+import os
+from typing import List, Optional
+
+from fastapi import FastAPI, HTTPException, Request, Response
+from telegram import Update
+from telegram.ext import (
+    Application, CallbackQueryHandler, ChatJoinRequestHandler, ChatMemberHandler,
+    ChosenInlineResultHandler, CommandHandler, InlineQueryHandler, MessageHandler,
+    PollAnswerHandler, PollHandler, PreCheckoutQueryHandler, ShippingQueryHandler
+)
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+# Тип обработчика -> типы обновлений, которые он может обработать
+HANDLER_UPDATES = (
+    (CommandHandler, (Update.MESSAGE,)),
+    (MessageHandler, (Update.MESSAGE,)),
+    (CallbackQueryHandler, (Update.CALLBACK_QUERY,)),
+    (InlineQueryHandler, (Update.INLINE_QUERY,)),
+    (ChosenInlineResultHandler, (Update.CHOSEN_INLINE_RESULT,)),
+    (ShippingQueryHandler, (Update.SHIPPING_QUERY,)),
+    (PreCheckoutQueryHandler, (Update.PRE_CHECKOUT_QUERY,)),
+    (PollHandler, (Update.POLL,)),
+    (PollAnswerHandler, (Update.POLL_ANSWER,)),
+    (ChatMemberHandler, (Update.MY_CHAT_MEMBER, Update.CHAT_MEMBER)),
+    (ChatJoinRequestHandler, (Update.CHAT_JOIN_REQUEST,)),
+)
+
+
+def handler_update_types(application: Application) -> List[str]:
+    """allowed_updates по зарегистрированным обработчикам.
+
+    Для обработчиков неизвестного типа (TypeHandler, ConversationHandler)
+    нельзя сказать, что им нужно, - тогда просим все типы.
+    """
+    types = []
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            for handler_class, update_types in HANDLER_UPDATES:
+                if isinstance(handler, handler_class):
+                    types.extend(update_types)
+                    break
+            else:
+                return list(Update.ALL_TYPES)
+    return sorted({str(update_type) for update_type in types})
+
+
+def default_secret(token: str) -> str:
+    """Секрет webhook из токена бота: одинаковый во всех воркерах без настройки"""
+    return hashlib.sha256(f"webhook:{token}".encode('utf-8')).hexdigest()
+
+
+class BotWebhook:
+    """Прием обновлений Telegram эндпоинтом FastAPI и обработка в этом же процессе"""
+
+    def __init__(self, application: Application, base_url: str,
+                 path: str = '/telegram/webhook', secret_token: Optional[str] = None):
+        self.application = application
+        self.path = path
+        self.url = base_url.rstrip('/') + path
+        self.secret_token = secret_token or default_secret(application.bot.token)
+        self.allowed_updates = handler_update_types(application)
+        self.received = 0
+        self.rejected = 0
+
+    def mount(self, app: FastAPI):
+        app.add_api_route(self.path, self.handle, methods=['POST'], include_in_schema=False)
+
+    async def start(self):
+        """Запустить Application и зарегистрировать webhook, если он еще не такой"""
+        await self.application.initialize()
+        await self.application.start()
+        bot = self.application.bot
+        try:
+            info = await bot.get_webhook_info()
+            # Каждый воркер uvicorn стартует сам: не перерегистрируем то, что уже стоит.
+            # Секрет Telegram не показывает - о смене секрета говорят ответы 403
+            rejected = '403' in (info.last_error_message or '')
+            if info.url != self.url or sorted(info.allowed_updates or ()) != self.allowed_updates or rejected:
+                await bot.set_webhook(
+                    url=self.url,
+                    secret_token=self.secret_token,
+                    allowed_updates=self.allowed_updates
+                )
+                logger.info(f"Telegram webhook set to {self.url} for {', '.join(self.allowed_updates)}")
+        except Exception as e:
+            # Webhook мог остаться от прошлого запуска: обновления все равно принимаем
+            logger.error(f"Error setting Telegram webhook: {e}")
+
+    async def stop(self):
+        # Webhook не снимаем: остальные воркеры продолжают принимать обновления
+        await self.application.stop()
+        await self.application.shutdown()
+
+    async def handle(self, request: Request):
+        token = request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(token.encode('utf-8'), self.secret_token.encode('utf-8')):
+            self.rejected += 1
+            raise HTTPException(status_code=403, detail='Неверный секретный токен')
+        try:
+            update = Update.de_json(await request.json(), self.application.bot)
+        except Exception as e:
+            logger.warning(f"Bad Telegram update: {e}")
+            raise HTTPException(status_code=400, detail='Некорректное обновление')
+        self.received += 1
+        # Обрабатывает Application в фоне: Telegram получает ответ сразу
+        await self.application.update_queue.put(update)
+        return Response(status_code=200)
+
+    def stats(self):
+        return {
+            'url': self.url,
+            'allowed_updates': self.allowed_updates,
+            'received': self.received,
+            'rejected': self.rejected,
+            'queued': self.application.update_queue.qsize(),
+            'concurrent_updates': self.application.concurrent_updates,
+            'send_queue': self.application.bot.rate_limiter.stats()
+            if hasattr(self.application.bot.rate_limiter, 'stats') else None,
+        }
+
+
+def webhook_enabled() -> bool:
+    return os.getenv('TELEGRAM_WEBHOOK', 'false').lower() == 'true'
+
+
+def webhook_from_env() -> Optional[BotWebhook]:
+    """BotWebhook по переменным окружения или None, если режим выключен"""
+    if not webhook_enabled():
+        return None
+    token = os.getenv('TELEGRAM_BOT_TOKEN')
+    if not token:
+        logger.error("TELEGRAM_WEBHOOK=true, но TELEGRAM_BOT_TOKEN не задан - webhook выключен")
+        return None
+    from telegram_bot import TelegramBot
+
+    webapp_url = os.getenv('WEBAPP_URL', 'http://localhost:8000')
+    bot = TelegramBot(token, webapp_url, api_url=os.getenv('TELEGRAM_API_URL'))
+    return BotWebhook(
+        bot.application,
+        base_url=os.getenv('TELEGRAM_WEBHOOK_URL', webapp_url),
+        path=os.getenv('TELEGRAM_WEBHOOK_PATH', '/telegram/webhook'),
+        secret_token=os.getenv('TELEGRAM_WEBHOOK_SECRET')
+    )
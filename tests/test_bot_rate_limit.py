@@ -0,0 +1,68 @@
+"""SendQueueLimiter: пауза после 429 и общая корзина в Redis"""
+
+import asyncio
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+pytest.importorskip('telegram')
+
+from telegram.error import RetryAfter
+
+from bot_rate_limit import RedisTokenBucket, SendQueueLimiter, TokenBucket
+
+
+def test_retry_waits_for_pause_and_takes_new_tokens():
+    async def scenario():
+        bucket = TokenBucket(10)
+        limiter = SendQueueLimiter(private_rate=100, global_bucket=bucket)
+        sent = []
+
+        async def flaky():
+            sent.append(time.monotonic())
+            if len(sent) == 1:
+                raise RetryAfter(1)
+            return 'ok'
+
+        started = time.monotonic()
+        result = await limiter.process_request(flaky, (), {}, 'sendMessage', {'chat_id': 1}, None)
+        # Отправка в другой чат, пришедшая во время паузы, тоже ждет ее конца
+        other = await limiter.process_request(flaky, (), {}, 'sendMessage', {'chat_id': 2}, None)
+        return result, other, [moment - started for moment in sent], limiter.stats()
+
+    result, other, moments, stats = asyncio.run(scenario())
+    assert (result, other) == ('ok', 'ok')
+    assert moments[1] >= 1.0 and moments[2] >= 1.0
+    assert stats['retries'] == 1 and stats['sent'] == 2
+
+
+def test_redis_bucket_is_shared_between_limiters():
+    async def scenario():
+        client = fakeredis.aioredis.FakeRedis()
+        # Два "воркера" с общей корзиной 20/с и запасом 1
+        buckets = [RedisTokenBucket(client, 'telegram:test', 20, capacity=1) for _ in range(2)]
+
+        async def send(bucket, count):
+            for _ in range(count):
+                await bucket.acquire()
+
+        started = time.monotonic()
+        await asyncio.gather(*(send(bucket, 10) for bucket in buckets))
+        return time.monotonic() - started
+
+    # 20 токенов при 20/с и запасе 1: не меньше 0.95 с на двоих, а не 0.45 с на каждого
+    assert asyncio.run(scenario()) >= 0.9
+
+
+def test_redis_bucket_pause_applies_to_every_process():
+    async def scenario():
+        client = fakeredis.aioredis.FakeRedis()
+        first = RedisTokenBucket(client, 'telegram:test', 100)
+        second = RedisTokenBucket(client, 'telegram:test', 100)
+        await first.pause(0.5)
+        started = time.monotonic()
+        await second.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) >= 0.45
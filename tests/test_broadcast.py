@@ -0,0 +1,169 @@
+"""Рассылка против заглушки Bot API: все получатели, блокировки, 429 и продолжение"""
+
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('telegram')
+
+from telegram.ext import ExtBot
+from telegram.request import BaseRequest
+
+from bot_rate_limit import SendQueueLimiter, TokenBucket
+from bot_users import BotUserStore
+from broadcast import Broadcaster
+
+TOKEN = '123:abc'
+
+
+class StubBotAPI(BaseRequest):
+    """Bot API в памяти: sendMessage запоминает получателей, blocked отвечают 403"""
+
+    def __init__(self, blocked=(), flood_once=()):
+        self.blocked = set(blocked)
+        self.flood_once = set(flood_once)
+        self.messages = []
+        self.floods = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        parameters = request_data.parameters if request_data is not None else {}
+        if endpoint == 'getMe':
+            return 200, self._ok({'id': 123, 'is_bot': True, 'first_name': 'Bot', 'username': 'bot'})
+        chat_id = int(parameters['chat_id'])
+        if chat_id in self.blocked:
+            return 403, self._error(403, 'Forbidden: bot was blocked by the user')
+        if chat_id in self.flood_once:
+            self.flood_once.discard(chat_id)
+            self.floods += 1
+            return 429, self._error(429, 'Too Many Requests: retry after 1', {'retry_after': 1})
+        self.messages.append((chat_id, parameters['text'], 'reply_markup' in parameters))
+        return 200, self._ok({
+            'message_id': len(self.messages), 'date': 0,
+            'chat': {'id': chat_id, 'type': 'private'}, 'text': parameters['text'],
+        })
+
+    @staticmethod
+    def _ok(result):
+        return json.dumps({'ok': True, 'result': result}).encode('utf-8')
+
+    @staticmethod
+    def _error(code, description, parameters=None):
+        body = {'ok': False, 'error_code': code, 'description': description}
+        if parameters:
+            body['parameters'] = parameters
+        return json.dumps(body).encode('utf-8')
+
+
+def make_bot(api):
+    limiter = SendQueueLimiter(private_rate=100, global_bucket=TokenBucket(1000))
+    return ExtBot(TOKEN, request=api, get_updates_request=api, rate_limiter=limiter)
+
+
+def make_users(tmp_path, count):
+    users = BotUserStore(tmp_path / 'bot.db')
+    for chat_id in range(1, count + 1):
+        users.record(chat_id, f"Пользователь{chat_id}", 'ru')
+    return users
+
+
+def run_broadcast(bot, users, broadcast_id, **options):
+    async def scenario():
+        broadcaster = Broadcaster(bot, users, 'https://example.org', workers=8, rate=1000, **options)
+        async with bot:
+            return await broadcaster.run(broadcast_id)
+
+    return asyncio.run(scenario())
+
+
+def test_broadcast_reaches_every_recipient_once(tmp_path):
+    users = make_users(tmp_path, 120)
+    api = StubBotAPI(blocked={7, 50}, flood_once={3})
+    broadcast_id = users.create_broadcast('Скидки недели', '🛒 Открыть магазин')
+
+    report = run_broadcast(make_bot(api), users, broadcast_id, batch_size=25, checkpoint_every=10)
+
+    recipients = [chat_id for chat_id, _, _ in api.messages]
+    assert sorted(recipients) == [chat_id for chat_id in range(1, 121) if chat_id not in {7, 50}]
+    assert all(text == 'Скидки недели' and has_button for _, text, has_button in api.messages)
+    assert api.floods == 1
+    assert (report['sent'], report['blocked'], report['failed']) == (118, 2, 0)
+
+    state = users.broadcast(broadcast_id)
+    assert state['finished_at'] is not None and state['last_chat_id'] == 120
+    # Заблокировавшие бота выпадают из следующих рассылок
+    assert users.count() == 118
+    users.close()
+
+
+def test_resume_continues_after_checkpoint(tmp_path):
+    users = make_users(tmp_path, 30)
+    broadcast_id = users.create_broadcast('Привет', None)
+    users.save_progress(broadcast_id, 20, sent=20, failed=0, blocked=0, duration=1.0)
+    api = StubBotAPI()
+
+    report = run_broadcast(make_bot(api), users, broadcast_id, batch_size=4)
+
+    assert [chat_id for chat_id, _, _ in sorted(api.messages)] == list(range(21, 31))
+    assert not any(has_button for _, _, has_button in api.messages)
+    assert report['sent'] == 30 and report['processed'] == 10
+    users.close()
+
+
+class SlowUsers(BotUserStore):
+    """Первая запись блокировок ждет, пока рассылка не отправит всем: 403 приходят во время нее"""
+
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        self.release = threading.Event()
+        self.calls = 0
+
+    def mark_blocked(self, chat_ids):
+        self.calls += 1
+        if self.calls == 1:
+            self.release.wait(5)
+            # Даем воркерам дописать последние 403 в список
+            time.sleep(0.1)
+        super().mark_blocked(chat_ids)
+
+
+class CountingBotAPI(StubBotAPI):
+    def __init__(self, total, on_done, **options):
+        super().__init__(**options)
+        self.total = total
+        self.on_done = on_done
+        self.requests = 0
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        response = await super().do_request(url, method, request_data, *args, **kwargs)
+        if url.endswith('sendMessage'):
+            self.requests += 1
+            if self.requests == self.total:
+                self.on_done()
+        return response
+
+
+def test_blocked_during_checkpoint_save_are_not_lost(tmp_path):
+    users = SlowUsers(tmp_path / 'bot.db')
+    for chat_id in range(1, 61):
+        users.record(chat_id)
+    blocked = {chat_id for chat_id in range(1, 61) if chat_id % 3 == 0}
+    api = CountingBotAPI(60, users.release.set, blocked=blocked)
+    broadcast_id = users.create_broadcast('Привет', None)
+
+    report = run_broadcast(make_bot(api), users, broadcast_id, batch_size=10, checkpoint_every=25)
+
+    assert report['blocked'] == len(blocked)
+    # Каждый заблокировавший помечен и в следующую рассылку не попадет
+    assert users.count() == 60 - len(blocked)
+    users.close()
@@ -0,0 +1,51 @@
+"""CircuitBreaker: пробы half-open считаются только по своим вызовам"""
+
+import time
+
+from fiveka_resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+def open_breaker(**options):
+    breaker = CircuitBreaker('test', window_size=4, min_calls=4, open_seconds=0.01, half_open_calls=2, **options)
+    permits = [breaker.allow_request() for _ in range(5)]
+    for permit in permits[:4]:
+        breaker.record(False, 0.01, permit)
+    assert breaker.state == OPEN
+    # Пятый вызов пропущен еще в CLOSED и вернется позже
+    return breaker, permits[4]
+
+
+def test_late_closed_call_does_not_free_probe_slot():
+    breaker, late_permit = open_breaker()
+    time.sleep(0.02)
+    probes = [breaker.allow_request(), breaker.allow_request()]
+    assert breaker.state == HALF_OPEN and all(probes)
+    # Ответ вызова из CLOSED не освобождает место пробы
+    breaker.record(True, 0.01, late_permit)
+    assert breaker.allow_request() is None
+
+
+def test_probes_of_previous_half_open_are_ignored():
+    breaker, _ = open_breaker()
+    time.sleep(0.02)
+    first, second = breaker.allow_request(), breaker.allow_request()
+    breaker.record(False, 0.01, first)
+    assert breaker.state == OPEN
+    time.sleep(0.02)
+    probes = [breaker.allow_request(), breaker.allow_request()]
+    # Опоздавшая проба прошлого периода не двигает счетчики нового
+    breaker.record(True, 0.01, second)
+    assert breaker.allow_request() is None
+    for permit in probes:
+        breaker.record(True, 0.01, permit)
+    assert breaker.state == CLOSED
+
+
+def test_cancelled_probe_frees_its_slot():
+    breaker, _ = open_breaker()
+    time.sleep(0.02)
+    breaker.allow_request()
+    second = breaker.allow_request()
+    assert breaker.allow_request() is None
+    breaker.cancel(second)
+    assert breaker.allow_request()
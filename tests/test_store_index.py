@@ -0,0 +1,25 @@
+"""StoreDirectory: слияние ответов апстрима в справочник"""
+
+from store_index import StoreDirectory
+
+
+def store(store_id, lat, lon):
+    return {'id': store_id, 'lat': lat, 'lon': lon}
+
+
+def test_refresh_removes_vanished_store(tmp_path):
+    directory = StoreDirectory(tmp_path / 'stores.json')
+    directory.merge_and_save(55.75, 37.61, 2000, [store(1, 55.75, 37.61), store(2, 55.751, 37.611)])
+    # Магазин вне круга обновления
+    directory.merge_and_save(55.90, 37.90, 1000, [store(3, 55.90, 37.90)])
+
+    # Магазин 2 закрылся: апстрим больше его не возвращает
+    directory.merge_and_save(55.75, 37.61, 2000, [store(1, 55.75, 37.61)])
+
+    assert sorted(s['id'] for s in directory.index.stores) == [1, 3]
+    assert [s['id'] for s in directory.query(55.75, 37.61, 1000)] == [1]
+
+    # Снимок на диске тоже без закрытого магазина
+    reloaded = StoreDirectory(tmp_path / 'stores.json')
+    reloaded.load()
+    assert sorted(s['id'] for s in reloaded.index.stores) == [1, 3]
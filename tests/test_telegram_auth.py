@@ -0,0 +1,107 @@
+"""Вход Mini App по initData и токены сессии"""
+
+import hashlib
+import hmac
+import json
+import time
+from urllib.parse import urlencode
+
+import pytest
+
+from telegram_auth import MAX_CLOCK_SKEW, AuthError, SessionAuth
+
+TOKEN = '123:abc'
+USER = {'id': 42, 'first_name': 'Иван', 'language_code': 'ru'}
+
+
+def make_init_data(auth_date=None, token=TOKEN, **overrides):
+    fields = {
+        'query_id': 'AAH',
+        'user': json.dumps(USER, ensure_ascii=False),
+        'auth_date': str(int(auth_date if auth_date is not None else time.time())),
+    }
+    check_string = '\n'.join(f"{key}={value}" for key, value in sorted(fields.items()))
+    secret_key = hmac.new(b'WebAppData', token.encode('utf-8'), hashlib.sha256).digest()
+    fields['hash'] = hmac.new(secret_key, check_string.encode('utf-8'), hashlib.sha256).hexdigest()
+    # Поля меняем после подписи: так выглядит подделка
+    fields.update(overrides)
+    return urlencode(fields)
+
+
+def test_valid_init_data_gives_working_token():
+    auth = SessionAuth(TOKEN)
+
+    user, token, expires = auth.login(make_init_data())
+
+    assert user['id'] == 42 and user['first_name'] == 'Иван'
+    assert expires > time.time()
+    assert auth.authenticate(token) == '42'
+    # Повторная проверка - из кэша проверенных
+    assert auth.authenticate(token) == '42'
+    assert auth.stats()['token_hits'] == 1
+
+
+@pytest.mark.parametrize('init_data', [
+    make_init_data(user=json.dumps({**USER, 'id': 1})),
+    make_init_data(auth_date=time.time() - 10, auth_date_extra='1'),
+    make_init_data(token='999:other'),
+    'user=%7B%7D&auth_date=1',
+])
+def test_tampered_init_data_is_rejected(init_data):
+    auth = SessionAuth(TOKEN)
+
+    with pytest.raises(AuthError):
+        auth.login(init_data)
+    assert auth.stats()['login_failures'] == 1
+
+
+def test_stale_or_future_auth_date_is_rejected():
+    auth = SessionAuth(TOKEN, max_age=3600)
+
+    with pytest.raises(AuthError, match='устарел'):
+        auth.login(make_init_data(auth_date=time.time() - 3601))
+    with pytest.raises(AuthError, match='будущего'):
+        auth.login(make_init_data(auth_date=time.time() + MAX_CLOCK_SKEW + 60))
+    # Небольшое расхождение часов допустимо
+    user, _, _ = auth.login(make_init_data(auth_date=time.time() + MAX_CLOCK_SKEW / 2))
+    assert user['id'] == 42
+
+
+def test_forged_or_foreign_token_is_rejected():
+    auth = SessionAuth(TOKEN)
+    _, token, _ = auth.login(make_init_data())
+    user_id, expires, signature = token.split('.')
+
+    forged = [
+        f"1.{expires}.{signature}",
+        f"{user_id}.{int(expires) + 3600}.{signature}",
+        f"{user_id}.{expires}.{signature[:-2]}AA",
+        SessionAuth('999:other').login(make_init_data(token='999:other'))[1],
+        'garbage',
+        '',
+    ]
+    for candidate in forged:
+        with pytest.raises(AuthError):
+            auth.authenticate(candidate)
+    assert auth.stats()['token_rejected'] == len(forged)
+
+
+def test_expired_token_is_rejected():
+    auth = SessionAuth(TOKEN)
+    payload = f"42.{int(time.time()) - 1}"
+    # Подпись верная, но срок вышел
+    with pytest.raises(AuthError):
+        auth.authenticate(f"{payload}.{auth._sign(payload)}")
+
+
+def test_verified_token_leaves_cache_when_it_expires():
+    auth = SessionAuth(TOKEN, ttl=2)
+    _, token, expires = auth.login(make_init_data())
+
+    assert auth.authenticate(token) == '42'
+    assert auth.stats()['cached_tokens'] == 1
+    time.sleep(max(expires - time.time(), 0) + 0.1)
+
+    # Кэш не продлевает жизнь токена
+    with pytest.raises(AuthError):
+        auth.authenticate(token)
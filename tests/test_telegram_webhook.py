@@ -0,0 +1,129 @@
+"""BotWebhook против заглушки Bot API: секретный токен, очередь обновлений, allowed_updates"""
+
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip('telegram')
+httpx = pytest.importorskip('httpx')
+
+from fastapi import FastAPI
+from telegram import Update
+from telegram.ext import ApplicationBuilder, CallbackQueryHandler, ChatMemberHandler, CommandHandler
+from telegram.request import BaseRequest
+
+from telegram_webhook import SECRET_HEADER, BotWebhook, default_secret, handler_update_types
+
+TOKEN = '123:abc'
+
+
+class StubBotAPI(BaseRequest):
+    """Bot API в памяти: запоминает вызовы, webhook изначально не задан"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        parameters = request_data.parameters if request_data is not None else {}
+        self.calls.append((endpoint, parameters))
+        if endpoint == 'getMe':
+            result = {'id': 123, 'is_bot': True, 'first_name': 'Bot', 'username': 'bot'}
+        elif endpoint == 'getWebhookInfo':
+            result = {'url': '', 'has_custom_certificate': False, 'pending_update_count': 0}
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode('utf-8')
+
+
+async def noop(update, context):
+    pass
+
+
+def make_webhook(api):
+    application = ApplicationBuilder().token(TOKEN).request(api).get_updates_request(api).build()
+    application.add_handler(CommandHandler('start', noop))
+    application.add_handler(CallbackQueryHandler(noop))
+    application.add_handler(ChatMemberHandler(noop))
+    return BotWebhook(application, 'https://example.org/')
+
+
+UPDATE = {
+    'update_id': 10,
+    'message': {
+        'message_id': 1, 'date': 0, 'text': '/start',
+        'chat': {'id': 42, 'type': 'private'},
+        'from': {'id': 42, 'is_bot': False, 'first_name': 'Иван'},
+    },
+}
+
+
+def post_updates(webhook, requests):
+    """Отправить запросы в эндпоинт webhook и вернуть ответы и содержимое очереди.
+
+    Application не запускаем: иначе обновления сразу забирает его обработка.
+    """
+    async def scenario():
+        app = FastAPI()
+        webhook.mount(app)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='https://example.org') as client:
+            responses = [
+                await client.post(webhook.path, json=body, headers=headers)
+                for headers, body in requests
+            ]
+        queue = webhook.application.update_queue
+        queued = [queue.get_nowait() for _ in range(queue.qsize())]
+        return [response.status_code for response in responses], queued
+
+    return asyncio.run(scenario())
+
+
+def test_wrong_or_missing_secret_is_rejected():
+    webhook = make_webhook(StubBotAPI())
+
+    statuses, queued = post_updates(webhook, [
+        ({}, UPDATE),
+        ({SECRET_HEADER: 'wrong'}, UPDATE),
+    ])
+
+    assert statuses == [403, 403]
+    assert queued == [] and webhook.rejected == 2 and webhook.received == 0
+
+
+def test_valid_update_reaches_update_queue():
+    webhook = make_webhook(StubBotAPI())
+
+    statuses, queued = post_updates(webhook, [({SECRET_HEADER: default_secret(TOKEN)}, UPDATE)])
+
+    assert statuses == [200]
+    assert len(queued) == 1 and isinstance(queued[0], Update)
+    assert queued[0].update_id == 10 and queued[0].message.text == '/start'
+    assert webhook.received == 1
+
+
+def test_webhook_is_registered_for_handled_update_types():
+    api = StubBotAPI()
+    webhook = make_webhook(api)
+
+    async def scenario():
+        await webhook.start()
+        await webhook.stop()
+
+    asyncio.run(scenario())
+
+    expected = handler_update_types(webhook.application)
+    assert expected == sorted({'message', 'callback_query', 'my_chat_member', 'chat_member'})
+    assert webhook.allowed_updates == expected
+    (parameters,) = [parameters for endpoint, parameters in api.calls if endpoint == 'setWebhook']
+    assert parameters['url'] == 'https://example.org/telegram/webhook'
+    assert parameters['secret_token'] == default_secret(TOKEN)
+    assert sorted(parameters['allowed_updates']) == expected
@@ -0,0 +1,72 @@
+"""RedisUserStore на fakeredis: атомарный update и TTL"""
+
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+
+from cart_model import new_cart
+from user_storage import RedisUserStore, UserStore, create_user_stores
+
+
+def make_store(ttl=None):
+    return RedisUserStore('cart:', ttl, client=fakeredis.aioredis.FakeRedis())
+
+
+def test_user_store_is_abstract():
+    with pytest.raises(TypeError):
+        UserStore()
+
+
+def test_concurrent_updates_are_not_lost():
+    async def scenario():
+        store = make_store()
+
+        def increment(document):
+            document['hits'] = document.get('hits', 0) + 1
+
+        async def worker():
+            for _ in range(10):
+                await store.update('42', increment, dict)
+                await asyncio.sleep(0)
+
+        await asyncio.gather(*(worker() for _ in range(10)))
+        return await store.get('42')
+
+    assert asyncio.run(scenario()) == {'hits': 100}
+
+
+def test_documents_expire_and_leave_count():
+    async def scenario():
+        store = make_store(ttl=1)
+        await store.set('1', {'address': 'Москва'})
+        await store.update('2', lambda cart: None, new_cart)
+        before = await store.count()
+        await asyncio.sleep(1.2)
+        return before, await store.get('1'), await store.get('2'), await store.count()
+
+    assert asyncio.run(scenario()) == (2, None, None, 0)
+
+
+def test_count_follows_delete_and_rewrite():
+    async def scenario():
+        store = make_store(ttl=60)
+        for user_id in ('1', '2', '3'):
+            await store.set(user_id, {})
+        await store.set('1', {'again': True})
+        await store.delete('2')
+        return await store.count()
+
+    assert asyncio.run(scenario()) == 2
+
+
+def test_cart_and_session_stores_share_client_without_mixing():
+    async def scenario():
+        carts, sessions = create_user_stores(redis_client=fakeredis.aioredis.FakeRedis())
+        await carts.update('7', lambda cart: None)
+        await sessions.set('7', {'address': 'Тверская, 1'})
+        await sessions.set('8', {'address': 'Арбат, 2'})
+        return await carts.count(), await sessions.count()
+
+    assert asyncio.run(scenario()) == (1, 2)
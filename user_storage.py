@@ -0,0 +1,281 @@
+"""Хранилища корзин и сессий пользователей: в памяти процесса или в Redis"""
+
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+try:
+    import redis.asyncio as aioredis
+    from redis.exceptions import WatchError
+except ImportError:  # без redis доступно только хранилище в памяти
+    aioredis = None
+    WatchError = None
+
+from cart_model import new_cart
+
+logger = logging.getLogger(__name__)
+
+
+class UserStore(ABC):
+    """JSON-документы по user_id с TTL простоя"""
+
+    def __init__(self, ttl: Optional[int] = None):
+        self.ttl = ttl
+
+    @abstractmethod
+    async def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def get_many(self, user_ids: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        ...
+
+    @abstractmethod
+    async def set(self, user_id: str, document: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    async def update(self, user_id: str, mutate: Callable[[Dict[str, Any]], Any],
+                     default: Callable[[], Dict[str, Any]]) -> Tuple[Dict[str, Any], Any]:
+        """Атомарно изменить документ: mutate(doc) -> result, возвращает (doc, result)"""
+
+    @abstractmethod
+    async def delete(self, user_id: str):
+        ...
+
+    @abstractmethod
+    async def count(self) -> int:
+        ...
+
+    async def close(self):
+        pass
+
+
+class InMemoryUserStore(UserStore):
+    """Хранилище в памяти одного воркера: для разработки и тестов"""
+
+    # Как часто вычищать просроченные документы целиком (секунды)
+    SWEEP_INTERVAL = 60.0
+
+    def __init__(self, ttl: Optional[int] = None):
+        super().__init__(ttl)
+        self._data: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self._next_sweep = time.monotonic() + self.SWEEP_INTERVAL
+
+    def _expires_at(self) -> float:
+        return time.monotonic() + self.ttl if self.ttl else float('inf')
+
+    def _sweep(self):
+        now = time.monotonic()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.SWEEP_INTERVAL
+        expired = [user_id for user_id, (expires_at, _) in self._data.items() if expires_at <= now]
+        for user_id in expired:
+            del self._data[user_id]
+
+    def _get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        # Telegram присылает id числом, а в URL он приходит строкой
+        user_id = str(user_id)
+        entry = self._data.get(user_id)
+        if entry is None:
+            return None
+        expires_at, document = entry
+        if expires_at <= time.monotonic():
+            del self._data[user_id]
+            return None
+        return document
+
+    async def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return self._get(user_id)
+
+    async def get_many(self, user_ids: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        return {user_id: self._get(user_id) for user_id in user_ids}
+
+    async def set(self, user_id: str, document: Dict[str, Any]):
+        self._sweep()
+        self._data[str(user_id)] = (self._expires_at(), document)
+
+    async def update(self, user_id, mutate, default):
+        # Между чтением и записью нет await - внутри воркера это атомарно
+        document = self._get(user_id)
+        if document is None:
+            document = default()
+        result = mutate(document)
+        self._sweep()
+        self._data[str(user_id)] = (self._expires_at(), document)
+        return document, result
+
+    async def delete(self, user_id: str):
+        self._data.pop(str(user_id), None)
+
+    async def count(self) -> int:
+        self._sweep()
+        return len(self._data)
+
+
+class RedisUserStore(UserStore):
+    """Хранилище в Redis, общее для всех воркеров uvicorn.
+
+    Клиент можно передать готовым, например fakeredis.aioredis.FakeRedis в тестах.
+    Для count рядом ведется sorted set "index:<prefix>": user_id со сроком
+    истечения документа, чтобы не обходить SCAN все ключи на каждый /api/health.
+    """
+
+    # Сколько раз повторять update при конкурентной записи того же ключа
+    MAX_UPDATE_RETRIES = 20
+
+    def __init__(self, prefix: str, ttl: Optional[int] = None,
+                 redis_url: Optional[str] = None, client=None):
+        super().__init__(ttl)
+        if client is None:
+            if aioredis is None:
+                raise RuntimeError("Для RedisUserStore нужен пакет redis")
+            client = aioredis.from_url(redis_url)
+        self.redis = client
+        self.prefix = prefix
+        self.index_key = f"index:{prefix}"
+
+    def _key(self, user_id: str) -> str:
+        return f"{self.prefix}{user_id}"
+
+    def _expires_at(self) -> float:
+        return time.time() + self.ttl if self.ttl else float('inf')
+
+    @staticmethod
+    def _decode(raw) -> Optional[Dict[str, Any]]:
+        return json.loads(raw) if raw is not None else None
+
+    @staticmethod
+    def _encode(document: Dict[str, Any]) -> str:
+        return json.dumps(document, ensure_ascii=False)
+
+    async def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return self._decode(await self.redis.get(self._key(user_id)))
+
+    async def get_many(self, user_ids: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Чтение пачки документов одним MGET"""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        raws = await self.redis.mget([self._key(user_id) for user_id in user_ids])
+        return {user_id: self._decode(raw) for user_id, raw in zip(user_ids, raws)}
+
+    async def set(self, user_id: str, document: Dict[str, Any]):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(self._key(user_id), self._encode(document), ex=self.ttl)
+            pipe.zadd(self.index_key, {str(user_id): self._expires_at()})
+            await pipe.execute()
+
+    async def update(self, user_id, mutate, default):
+        """Оптимистичная транзакция WATCH/MULTI с повтором при конфликте"""
+        key = self._key(user_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for _ in range(self.MAX_UPDATE_RETRIES):
+                try:
+                    await pipe.watch(key)
+                    document = self._decode(await pipe.get(key))
+                    if document is None:
+                        document = default()
+                    result = mutate(document)
+                    pipe.multi()
+                    pipe.set(key, self._encode(document), ex=self.ttl)
+                    pipe.zadd(self.index_key, {str(user_id): self._expires_at()})
+                    await pipe.execute()
+                    return document, result
+                except WatchError:
+                    # Ключ изменил другой воркер - перечитываем и применяем заново
+                    continue
+        raise RuntimeError(f"Не удалось обновить {key}: слишком много конфликтов")
+
+    async def delete(self, user_id: str):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(self._key(user_id))
+            pipe.zrem(self.index_key, str(user_id))
+            await pipe.execute()
+
+    async def count(self) -> int:
+        """Живые документы по индексу: просроченные из него сначала вычищаются"""
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(self.index_key, '-inf', time.time())
+            pipe.zcard(self.index_key)
+            _, total = await pipe.execute()
+        return total
+
+    async def close(self):
+        await self.redis.close()
+
+
+class CartStore:
+    """Корзины пользователей"""
+
+    def __init__(self, backend: UserStore):
+        self.backend = backend
+
+    async def get(self, user_id: str) -> Dict[str, Any]:
+        cart = await self.backend.get(user_id)
+        return cart if cart is not None else new_cart()
+
+    async def get_many(self, user_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        carts = await self.backend.get_many(user_ids)
+        return {user_id: cart if cart is not None else new_cart() for user_id, cart in carts.items()}
+
+    async def update(self, user_id: str, mutate: Callable[[Dict[str, Any]], Any]):
+        """Атомарно изменить корзину: возвращает (cart, результат mutate)"""
+        return await self.backend.update(user_id, mutate, new_cart)
+
+    async def clear(self, user_id: str):
+        await self.backend.delete(user_id)
+
+    async def count(self) -> int:
+        return await self.backend.count()
+
+    async def close(self):
+        await self.backend.close()
+
+
+class SessionStore:
+    """Сессии пользователей: адрес доставки и результат геокодирования"""
+
+    def __init__(self, backend: UserStore):
+        self.backend = backend
+
+    async def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return await self.backend.get(user_id)
+
+    async def get_many(self, user_ids: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        return await self.backend.get_many(user_ids)
+
+    async def set(self, user_id: str, session: Dict[str, Any]):
+        await self.backend.set(user_id, session)
+
+    async def delete(self, user_id: str):
+        await self.backend.delete(user_id)
+
+    async def count(self) -> int:
+        return await self.backend.count()
+
+    async def close(self):
+        await self.backend.close()
+
+
+def create_user_stores(redis_url: Optional[str] = None, redis_client=None,
+                       cart_ttl: Optional[int] = None,
+                       session_ttl: Optional[int] = None) -> Tuple[CartStore, SessionStore]:
+    """Хранилища корзин и сессий: Redis, если он задан, иначе память процесса"""
+    if redis_client is not None or (redis_url and aioredis is not None):
+        if redis_client is None:
+            redis_client = aioredis.from_url(redis_url)
+        return (
+            CartStore(RedisUserStore('cart:', cart_ttl, client=redis_client)),
+            SessionStore(RedisUserStore('session:', session_ttl, client=redis_client)),
+        )
+
+    if redis_url:
+        logger.warning("REDIS_URL задан, но пакет redis не установлен - корзины хранятся в памяти воркера")
+    return (
+        CartStore(InMemoryUserStore(cart_ttl)),
+        SessionStore(InMemoryUserStore(session_ttl)),
+    )
@@ -0,0 +1,113 @@
+"""HTML-оболочка Mini App: собирается один раз при старте, отдается сжатой и с ETag.
+
+CSS и JS из frontend/<страница>/ копируются в static/assets/ под именами
+с хэшем содержимого, поэтому их можно кэшировать навсегда, а сама
+оболочка ссылается на актуальные версии через плейсхолдеры {{ app.js }}.
+"""
+
+import hashlib
+import os
+import re
+from pathlib import Path
+from typing import Dict, Optional
+
+from fastapi.staticfiles import StaticFiles
+from starlette.requests import Request
+from starlette.responses import Response
+
+from http_compression import SUPPORTED_ENCODINGS, choose_encoding, compress
+
+BASE_DIR = Path(__file__).parent
+FRONTEND_DIR = BASE_DIR / 'frontend'
+STATIC_DIR = BASE_DIR / 'static'
+ASSETS_DIR = STATIC_DIR / 'assets'
+ASSETS_URL = '/static/assets'
+
+# Оболочку браузер всегда перепроверяет по ETag, статика с отпечатком - неизменна
+SHELL_CACHE_CONTROL = 'no-cache'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+PLACEHOLDER = re.compile(r'\{\{\s*([\w.-]+)\s*\}\}')
+FINGERPRINTED = re.compile(r'\.[0-9a-f]{12}\.\w+$')
+ASSET_SUFFIXES = ('.css', '.js')
+
+
+def fingerprint_asset(path: Path, assets_dir: Path = ASSETS_DIR) -> str:
+    """Положить копию файла в assets_dir под именем с хэшем содержимого"""
+    content = path.read_bytes()
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    name = f"{path.stem}.{digest}{path.suffix}"
+    target = assets_dir / name
+    if not target.exists():
+        assets_dir.mkdir(parents=True, exist_ok=True)
+        # Воркеры uvicorn собирают статику одновременно - пишем через rename
+        tmp = target.with_name(f".{name}.{os.getpid()}.tmp")
+        tmp.write_bytes(content)
+        os.replace(tmp, target)
+    return name
+
+
+def etag_matches(if_none_match: Optional[str], etags) -> bool:
+    """Совпадает ли If-None-Match с одним из ETag (слабое сравнение)"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*':
+            return True
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate in etags:
+            return True
+    return False
+
+
+class ShellPage:
+    """Готовая HTML-страница: тело в каждой кодировке и свой ETag для каждой"""
+
+    def __init__(self, body: bytes, cache_control: str = SHELL_CACHE_CONTROL):
+        self.cache_control = cache_control
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.bodies: Dict[Optional[str], bytes] = {None: body}
+        self.etags: Dict[Optional[str], str] = {None: f'"{digest}"'}
+        for encoding in SUPPORTED_ENCODINGS:
+            self.bodies[encoding] = compress(body, encoding)
+            self.etags[encoding] = f'"{digest}-{encoding}"'
+        self._all_etags = set(self.etags.values())
+
+    @classmethod
+    def build(cls, source_dir: Path, assets_dir: Path = ASSETS_DIR, assets_url: str = ASSETS_URL):
+        """Собрать страницу из source_dir/index.html и соседних CSS/JS"""
+        assets = {}
+        for path in sorted(source_dir.iterdir()):
+            if path.suffix in ASSET_SUFFIXES:
+                assets[path.name] = f"{assets_url}/{fingerprint_asset(path, assets_dir)}"
+
+        template = (source_dir / 'index.html').read_text(encoding='utf-8')
+        html = PLACEHOLDER.sub(lambda match: assets[match.group(1)], template)
+        return cls(html.encode('utf-8'))
+
+    def response(self, request: Request) -> Response:
+        """200 со сжатым телом или 304 по If-None-Match"""
+        encoding = choose_encoding(request.headers.get('accept-encoding'))
+        headers = {
+            'ETag': self.etags[encoding],
+            'Cache-Control': self.cache_control,
+            'Vary': 'Accept-Encoding',
+        }
+        if etag_matches(request.headers.get('if-none-match'), self._all_etags):
+            return Response(status_code=304, headers=headers)
+
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        return Response(self.bodies[encoding], media_type='text/html', headers=headers)
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """StaticFiles, отдающий файлы с отпечатком в имени с вечным Cache-Control"""
+
+    def file_response(self, full_path, *args, **kwargs) -> Response:
+        response = super().file_response(full_path, *args, **kwargs)
+        if FINGERPRINTED.search(str(full_path)):
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response